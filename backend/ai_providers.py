@@ -1,13 +1,209 @@
 from __future__ import annotations
 
+import asyncio
 import json
+import socket
+import threading
+import time
 from abc import ABC, abstractmethod
-from typing import Generator, Iterable
+from collections import OrderedDict, deque
+from threading import Event, Lock, Thread
+from contextlib import contextmanager
+from typing import AsyncIterator, Generator, Iterable, Iterator
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.util.retry import Retry
+
+from .utils.lru_cache import LRUCache
+from .utils.streams import CancelToken
+
+try:
+    import httpx
+except ImportError:  # 未安装 httpx 时异步接口退化为线程池拉取同步流
+    httpx = None
+
+
+_STREAM_END = object()
+
+_abort_scope = threading.local()
+
+
+class UpstreamAbort:
+    """把请求所用的 socket 绑定到 CancelToken：取消时直接 shutdown 该 socket。
+    无论是在等待响应头（模型仍在预填充）还是在读取流，阻塞的读取都会立即返回，上游也能感知到断开。"""
+
+    def __init__(self, cancel: CancelToken | None) -> None:
+        self._cancel = cancel
+        self._unregister: list = []
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancel is not None and self._cancel.cancelled
+
+    @contextmanager
+    def capture(self) -> Iterator[None]:
+        """在此上下文中发出的请求会登记所用的 socket。"""
+        if self._cancel is None:
+            yield
+            return
+        _abort_scope.handle = self
+        try:
+            yield
+        finally:
+            _abort_scope.handle = None
+
+    def attach(self, sock: socket.socket) -> None:
+        def abort() -> None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+        self._unregister.append(self._cancel.on_cancel(abort))
+
+    def release(self) -> None:
+        # 连接归还连接池后可能被其他请求复用，必须先注销
+        for unregister in self._unregister:
+            unregister()
+        self._unregister.clear()
+
+
+def _capture_socket(sock: socket.socket | None) -> None:
+    handle = getattr(_abort_scope, "handle", None)
+    if handle is not None and sock is not None:
+        handle.attach(sock)
+
+
+class _AbortableHTTPConnection(HTTPConnection):
+    def request(self, *args, **kwargs) -> None:
+        super().request(*args, **kwargs)
+        _capture_socket(self.sock)
+
+
+class _AbortableHTTPSConnection(HTTPSConnection):
+    def request(self, *args, **kwargs) -> None:
+        super().request(*args, **kwargs)
+        _capture_socket(self.sock)
+
+
+class _AbortableHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _AbortableHTTPConnection
+
+
+class _AbortableHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _AbortableHTTPSConnection
+
+
+class _AbortableAdapter(HTTPAdapter):
+    def init_poolmanager(self, *args, **kwargs) -> None:
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _AbortableHTTPConnectionPool,
+            "https": _AbortableHTTPSConnectionPool,
+        }
+
+
+class HTTPSessionPool:
+    """按 base_url 复用 requests.Session，使同一上游的请求共享 keep-alive 连接池。"""
+
+    def __init__(self, pool_size: int = 10, connect_retries: int = 2, max_hosts: int = 32) -> None:
+        self._pool_size = max(1, pool_size)
+        self._connect_retries = max(0, connect_retries)
+        self._sessions = LRUCache(max_entries=max_hosts)
+        self._lock = Lock()
+
+    def _create(self) -> requests.Session:
+        # 只重试建立连接失败的情况：请求尚未发出，POST 重试也是安全的
+        retry = Retry(
+            total=self._connect_retries,
+            connect=self._connect_retries,
+            read=0,
+            status=0,
+            other=0,
+            redirect=0,
+            allowed_methods=None,
+            backoff_factor=0.2,
+        )
+        adapter = _AbortableAdapter(pool_connections=1, pool_maxsize=self._pool_size, max_retries=retry)
+        session = requests.Session()
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+
+    def get(self, base_url: str) -> requests.Session:
+        session = self._sessions.get(base_url)
+        if session is None:
+            with self._lock:
+                session = self._sessions.get(base_url)
+                if session is None:
+                    session = self._create()
+                    self._sessions.set(base_url, session)
+        return session
+
+
+# 查询模型元数据等探测请求不重试：上游不可用时应尽快失败，而不是在每次重试上等待
+_probe_sessions = HTTPSessionPool(pool_size=2, connect_retries=0)
+
+
+class AsyncClientPool:
+    """按 base_url 复用 httpx.AsyncClient，供 ASGI 模式下的异步流式请求使用。
+    超出 max_hosts 时关闭最久未使用的客户端，服务关闭时通过 aclose 关闭全部客户端。"""
+
+    def __init__(
+        self,
+        pool_size: int = 10,
+        connect_retries: int = 2,
+        connect_timeout_seconds: float = 5,
+        read_timeout_seconds: float = 120,
+        max_hosts: int = 32,
+    ) -> None:
+        self._pool_size = max(1, pool_size)
+        self._connect_retries = max(0, connect_retries)
+        self._timeout = (connect_timeout_seconds, read_timeout_seconds)
+        self._max_hosts = max(1, max_hosts)
+        self._clients: OrderedDict[str, "httpx.AsyncClient"] = OrderedDict()
+        self._closing: set[asyncio.Task] = set()
+        self._lock = Lock()
+
+    def get(self, base_url: str) -> "httpx.AsyncClient":
+        evicted: list["httpx.AsyncClient"] = []
+        with self._lock:
+            client = self._clients.get(base_url)
+            if client is None:
+                # 空闲连接数受 pool_size 限制；并发流数量不设上限，由调度层控制
+                client = httpx.AsyncClient(
+                    transport=httpx.AsyncHTTPTransport(retries=self._connect_retries),
+                    limits=httpx.Limits(max_connections=None, max_keepalive_connections=self._pool_size),
+                    timeout=httpx.Timeout(self._timeout[1], connect=self._timeout[0]),
+                )
+                self._clients[base_url] = client
+                while len(self._clients) > self._max_hosts:
+                    evicted.append(self._clients.popitem(last=False)[1])
+            else:
+                self._clients.move_to_end(base_url)
+        for old in evicted:
+            # get 在事件循环中调用，关闭放到后台任务里，释放被淘汰客户端的 keep-alive 连接
+            task = asyncio.get_running_loop().create_task(old.aclose())
+            self._closing.add(task)
+            task.add_done_callback(self._closing.discard)
+        return client
+
+    async def aclose(self) -> None:
+        with self._lock:
+            clients = list(self._clients.values())
+            self._clients.clear()
+        for client in clients:
+            await client.aclose()
 
 
 class BaseLLMProvider(ABC):
+    @property
+    def model(self) -> str:
+        return getattr(self, "_model", "")
+
     @abstractmethod
     def generate_stream(
         self,
@@ -17,20 +213,74 @@ class BaseLLMProvider(ABC):
     ) -> Iterable[str]:
         raise NotImplementedError
 
+    async def agenerate_stream(
+        self,
+        prompt: str,
+        system_prompt: str | None = None,
+        **kwargs,
+    ) -> AsyncIterator[str]:
+        # 默认实现：在线程池中逐块拉取同步流；子类可覆盖为原生异步实现
+        iterator = iter(self.generate_stream(prompt=prompt, system_prompt=system_prompt, **kwargs))
+        while True:
+            chunk = await asyncio.to_thread(next, iterator, _STREAM_END)
+            if chunk is _STREAM_END:
+                break
+            yield chunk
+
     def generate(self, prompt: str, system_prompt: str | None = None, **kwargs) -> str:
         return "".join(self.generate_stream(prompt=prompt, system_prompt=system_prompt, **kwargs))
 
 
 class OllamaProvider(BaseLLMProvider):
-    def __init__(self, base_url: str, model: str, timeout_seconds: int = 120) -> None:
+    def __init__(
+        self,
+        base_url: str,
+        model: str,
+        timeout_seconds: float = 120,
+        connect_timeout_seconds: float = 5,
+        sessions: HTTPSessionPool | None = None,
+        async_clients: AsyncClientPool | None = None,
+        keep_alive: str | None = None,
+    ) -> None:
         self._base_url = base_url.rstrip("/")
         self._model = model
-        self._timeout_seconds = timeout_seconds
+        self._timeout = (connect_timeout_seconds, timeout_seconds)
+        self._sessions = sessions or HTTPSessionPool()
+        self._async_clients = async_clients
+        self._keep_alive = keep_alive
+
+    @property
+    def base_url(self) -> str:
+        return self._base_url
+
+    def list_loaded_models(self, timeout_seconds: float = 5) -> list[str]:
+        """查询当前已加载到内存的模型（/api/ps）；请求失败时抛出异常。"""
+        url = f"{self._base_url}/api/ps"
+        with _probe_sessions.get(self._base_url).get(url, timeout=(self._timeout[0], timeout_seconds)) as response:
+            response.raise_for_status()
+            models = response.json().get("models", [])
+        return [m.get("name") or m.get("model") for m in models if isinstance(m, dict)]
+
+    def list_model_details(self, timeout_seconds: float = 5) -> list[dict]:
+        """返回 /api/tags 中的原始模型条目（名称、大小、digest、details）；请求失败时抛出异常。"""
+        url = f"{self._base_url}/api/tags"
+        with _probe_sessions.get(self._base_url).get(url, timeout=(self._timeout[0], timeout_seconds)) as response:
+            response.raise_for_status()
+            models = response.json().get("models", [])
+        return [m for m in models if isinstance(m, dict) and m.get("name")]
+
+    def show_model(self, name: str, timeout_seconds: float = 5) -> dict:
+        """查询单个模型的元数据（/api/show），包含 model_info 与 parameters。"""
+        url = f"{self._base_url}/api/show"
+        session = _probe_sessions.get(self._base_url)
+        with session.post(url, json={"model": name}, timeout=(self._timeout[0], timeout_seconds)) as response:
+            response.raise_for_status()
+            return response.json()
 
     def list_models(self) -> list[str]:
         try:
             url = f"{self._base_url}/api/tags"
-            with requests.get(url, timeout=5) as response:
+            with self._sessions.get(self._base_url).get(url, timeout=(self._timeout[0], 5)) as response:
                 if response.status_code == 200:
                     data = response.json()
                     models = data.get("models", [])
@@ -39,14 +289,7 @@ class OllamaProvider(BaseLLMProvider):
             print(f"Failed to list Ollama models: {e}")
         return []
 
-    def generate_stream(
-        self,
-        prompt: str,
-        system_prompt: str | None = None,
-        **kwargs,
-    ) -> Generator[str, None, None]:
-        url = f"{self._base_url}/api/generate"
-        
+    def _build_payload(self, prompt: str, system_prompt: str | None, kwargs: dict) -> dict[str, object]:
         # Allow model override
         model = kwargs.get("model") or self._model
 
@@ -57,38 +300,309 @@ class OllamaProvider(BaseLLMProvider):
         }
         if system_prompt:
             payload["system"] = system_prompt
+        # 上一轮返回的 context：Ollama 会把它接在本次提示词之前，并复用已缓存的 KV
+        context = kwargs.get("context")
+        if isinstance(context, list) and context:
+            payload["context"] = context
+        if self._keep_alive:
+            payload["keep_alive"] = self._keep_alive
         options = kwargs.get("options")
-        if isinstance(options, dict):
+        options = dict(options) if isinstance(options, dict) else {}
+        temperature = kwargs.get("temperature")
+        if isinstance(temperature, (int, float)):
+            options.setdefault("temperature", float(temperature))
+        if options:
             payload["options"] = options
+        return payload
+
+    @staticmethod
+    def _parse_line(raw_line: str) -> tuple[dict | None, str | None]:
+        """解析一行 NDJSON，返回 (结束消息, 文本块)；未结束时结束消息为 None。"""
+        if not raw_line:
+            return None, None
+        try:
+            data = json.loads(raw_line)
+        except json.JSONDecodeError:
+            return None, None
+        if data.get("done") is True:
+            return data, None
+        chunk = data.get("response")
+        return None, chunk if isinstance(chunk, str) and chunk else None
+
+    def generate_stream(
+        self,
+        prompt: str,
+        system_prompt: str | None = None,
+        **kwargs,
+    ) -> Generator[str, None, None]:
+        url = f"{self._base_url}/api/generate"
+        payload = self._build_payload(prompt, system_prompt, kwargs)
+        # on_done(结束消息, 完整回复)：调用方借此拿到 context 等统计信息
+        on_done = kwargs.get("on_done")
+        parts: list[str] = []
+        abort = UpstreamAbort(kwargs.get("cancel"))
+        if abort.cancelled:
+            return
 
-        with requests.post(url, json=payload, stream=True, timeout=self._timeout_seconds) as response:
+        session = self._sessions.get(self._base_url)
+        try:
+            with abort.capture():
+                response = session.post(url, json=payload, stream=True, timeout=self._timeout)
+            with response:
+                response.raise_for_status()
+                # 上游未声明 charset 时 requests 会按 ISO-8859-1 解码，这里统一按 UTF-8 处理
+                for raw_line in response.iter_lines():
+                    if abort.cancelled:
+                        return
+                    final, chunk = self._parse_line(raw_line.decode("utf-8", errors="replace"))
+                    if final is not None:
+                        if on_done is not None:
+                            on_done(final, "".join(parts))
+                        break
+                    if chunk:
+                        if on_done is not None:
+                            parts.append(chunk)
+                        yield chunk
+        except Exception:
+            # 取消时连接被强制关闭，读取报错属于预期，按正常结束处理
+            if not abort.cancelled:
+                raise
+        finally:
+            abort.release()
+
+    async def agenerate_stream(
+        self,
+        prompt: str,
+        system_prompt: str | None = None,
+        **kwargs,
+    ) -> AsyncIterator[str]:
+        if self._async_clients is None:
+            async for chunk in super().agenerate_stream(prompt, system_prompt, **kwargs):
+                yield chunk
+            return
+        url = f"{self._base_url}/api/generate"
+        payload = self._build_payload(prompt, system_prompt, kwargs)
+        on_done = kwargs.get("on_done")
+        parts: list[str] = []
+
+        client = self._async_clients.get(self._base_url)
+        async with client.stream("POST", url, json=payload) as response:
             response.raise_for_status()
-            for raw_line in response.iter_lines(decode_unicode=True):
-                if not raw_line:
-                    continue
-                try:
-                    data = json.loads(raw_line)
-                except json.JSONDecodeError:
-                    continue
-                if data.get("done") is True:
+            async for raw_line in response.aiter_lines():
+                final, chunk = self._parse_line(raw_line)
+                if final is not None:
+                    if on_done is not None:
+                        on_done(final, "".join(parts))
                     break
-                chunk = data.get("response")
-                if isinstance(chunk, str) and chunk:
+                if chunk:
+                    if on_done is not None:
+                        parts.append(chunk)
                     yield chunk
 
 
-class OpenAICompatProvider(BaseLLMProvider):
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+def _model_loaded(loaded: set[str], model: str) -> bool:
+    # /api/ps 返回的名称总是带 tag，未写 tag 的模型名按 latest 匹配
+    return model in loaded or (":" not in model and f"{model}:latest" in loaded)
+
+
+def _percentile(samples: list[float], pct: float) -> float | None:
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(pct * len(ordered)))]
+
+
+class OllamaReplica:
+    """Ollama 副本池中的一个节点：在途请求数、熔断状态与延迟统计。"""
+
+    def __init__(self, provider: OllamaProvider) -> None:
+        self.provider = provider
+        self.inflight = 0
+        self.failures = 0  # 连续失败次数
+        self.open_until = 0.0
+        self.trial = False  # 半开状态下是否已有试探请求
+        self.loaded_models: set[str] = set()
+        self.first_chunk_latency: deque[float] = deque(maxlen=200)
+        self.requests = 0
+        self.errors = 0
+        self.last_error: str | None = None
+
+    def state(self, now: float, failure_threshold: int) -> str:
+        if self.failures < failure_threshold:
+            return CLOSED
+        return OPEN if now < self.open_until else HALF_OPEN
+
+    def stats(self, now: float, failure_threshold: int) -> dict[str, object]:
+        samples = list(self.first_chunk_latency)
+        p50 = _percentile(samples, 0.5)
+        p95 = _percentile(samples, 0.95)
+        return {
+            "base_url": self.provider.base_url,
+            "state": self.state(now, failure_threshold),
+            "inflight": self.inflight,
+            "requests": self.requests,
+            "errors": self.errors,
+            "consecutive_failures": self.failures,
+            "loaded_models": sorted(self.loaded_models),
+            "first_chunk_ms_p50": round(p50 * 1000) if p50 is not None else None,
+            "first_chunk_ms_p95": round(p95 * 1000) if p95 is not None else None,
+            "last_error": self.last_error,
+        }
+
+
+class OllamaPool(BaseLLMProvider):
+    """多个 Ollama 副本的负载均衡：优先选已加载目标模型、在途流最少的副本；
+    后台定期探活，连续失败的副本被熔断摘除，冷却后放行一个试探请求。"""
+
     def __init__(
         self,
-        api_key: str,
-        base_url: str,
+        base_urls: Iterable[str],
         model: str,
-        timeout_seconds: int = 120,
+        timeout_seconds: float = 120,
+        connect_timeout_seconds: float = 5,
+        sessions: HTTPSessionPool | None = None,
+        async_clients: AsyncClientPool | None = None,
+        health_interval_seconds: float = 15,
+        failure_threshold: int = 3,
+        cooldown_seconds: float = 30,
+        keep_alive: str | None = None,
     ) -> None:
-        self._api_key = api_key
-        self._base_url = base_url.rstrip("/")
+        sessions = sessions or HTTPSessionPool()
         self._model = model
-        self._timeout_seconds = timeout_seconds
+        self._replicas = [
+            OllamaReplica(
+                OllamaProvider(
+                    base_url=url,
+                    model=model,
+                    timeout_seconds=timeout_seconds,
+                    connect_timeout_seconds=connect_timeout_seconds,
+                    sessions=sessions,
+                    async_clients=async_clients,
+                    keep_alive=keep_alive,
+                )
+            )
+            for url in dict.fromkeys(base_urls)
+        ]
+        if not self._replicas:
+            raise ValueError("OllamaPool 至少需要一个 base_url")
+        self._failure_threshold = max(1, failure_threshold)
+        self._cooldown = max(0.0, cooldown_seconds)
+        self._probe_timeout = min(5.0, health_interval_seconds) if health_interval_seconds > 0 else 5.0
+        self._lock = Lock()
+        self._stopped = Event()
+        if health_interval_seconds > 0:
+            Thread(
+                target=self._probe_loop, args=(health_interval_seconds,), name="ollama-health", daemon=True
+            ).start()
+
+    @property
+    def replicas(self) -> list[OllamaReplica]:
+        return list(self._replicas)
+
+    def _acquire(self, model: str, exclude: set[int]) -> OllamaReplica | None:
+        now = time.monotonic()
+        with self._lock:
+            candidates = []
+            for replica in self._replicas:
+                if id(replica) in exclude:
+                    continue
+                state = replica.state(now, self._failure_threshold)
+                if state == CLOSED or (state == HALF_OPEN and not replica.trial):
+                    candidates.append(replica)
+            if not candidates:
+                if exclude:
+                    return None
+                # 所有副本都被熔断时仍选最早恢复的一个，而不是直接拒绝请求
+                candidates = [min(self._replicas, key=lambda r: r.open_until)]
+            replica = min(
+                candidates,
+                key=lambda r: (not _model_loaded(r.loaded_models, model), r.inflight),
+            )
+            if replica.state(now, self._failure_threshold) == HALF_OPEN:
+                replica.trial = True
+            replica.inflight += 1
+            replica.requests += 1
+            # 请求会让该副本加载模型，后续同模型请求随之聚集
+            replica.loaded_models.add(model)
+        return replica
+
+    @staticmethod
+    def _is_replica_failure(error: BaseException) -> bool:
+        # 4xx（如模型不存在、参数错误）是请求本身的问题，不计入熔断
+        response = getattr(error, "response", None)
+        status = getattr(response, "status_code", None)
+        return not (isinstance(status, int) and status < 500)
+
+    def _release(
+        self,
+        replica: OllamaReplica,
+        first_chunk_latency: float | None = None,
+        error: BaseException | None = None,
+        cancelled: bool = False,
+    ) -> None:
+        with self._lock:
+            replica.inflight -= 1
+            replica.trial = False
+            if cancelled:
+                return
+            if error is None:
+                replica.failures = 0
+                if first_chunk_latency is not None:
+                    replica.first_chunk_latency.append(first_chunk_latency)
+                return
+            replica.errors += 1
+            replica.last_error = str(error)
+            if self._is_replica_failure(error):
+                self._record_failure(replica)
+
+    def _record_failure(self, replica: OllamaReplica) -> None:
+        replica.failures += 1
+        if replica.failures >= self._failure_threshold:
+            replica.open_until = time.monotonic() + self._cooldown
+
+    def _probe_loop(self, interval: float) -> None:
+        while True:
+            self.probe()
+            if self._stopped.wait(interval):
+                return
+
+    def probe(self) -> None:
+        """探测所有副本：刷新已加载模型列表，并据此更新熔断状态。"""
+        for replica in self._replicas:
+            try:
+                loaded = replica.provider.list_loaded_models(timeout_seconds=self._probe_timeout)
+            except Exception as e:
+                with self._lock:
+                    replica.last_error = str(e)
+                    self._record_failure(replica)
+                continue
+            with self._lock:
+                replica.loaded_models = set(loaded)
+                replica.failures = 0
+                replica.open_until = 0.0
+
+    def close(self) -> None:
+        self._stopped.set()
+
+    def available_providers(self) -> list[OllamaProvider]:
+        """未被熔断的副本，供模型目录等只读查询使用。"""
+        now = time.monotonic()
+        with self._lock:
+            return [r.provider for r in self._replicas if r.state(now, self._failure_threshold) != OPEN]
+
+    def list_models(self) -> list[str]:
+        now = time.monotonic()
+        names: dict[str, None] = {}
+        for replica in self._replicas:
+            if replica.state(now, self._failure_threshold) == OPEN:
+                continue
+            names.update(dict.fromkeys(replica.provider.list_models()))
+        return list(names)
 
     def generate_stream(
         self,
@@ -96,6 +610,133 @@ class OpenAICompatProvider(BaseLLMProvider):
         system_prompt: str | None = None,
         **kwargs,
     ) -> Generator[str, None, None]:
+        model = kwargs.get("model") or self._model
+        tried: set[int] = set()
+        replica = self._acquire(model, tried)
+        while True:
+            tried.add(id(replica))
+            started = time.monotonic()
+            latency: float | None = None
+            try:
+                for chunk in replica.provider.generate_stream(prompt=prompt, system_prompt=system_prompt, **kwargs):
+                    if latency is None:
+                        latency = time.monotonic() - started
+                    yield chunk
+            except Exception as e:
+                self._release(replica, error=e)
+                if latency is not None or not self._is_replica_failure(e):
+                    raise
+                # 尚未输出任何内容时换一个副本重试
+                replica = self._acquire(model, tried)
+                if replica is None:
+                    raise
+                continue
+            except BaseException:
+                self._release(replica, cancelled=True)
+                raise
+            cancel = kwargs.get("cancel")
+            # 被主动取消的请求不计入副本的延迟和健康统计
+            self._release(replica, first_chunk_latency=latency, cancelled=cancel is not None and cancel.cancelled)
+            return
+
+    async def agenerate_stream(
+        self,
+        prompt: str,
+        system_prompt: str | None = None,
+        **kwargs,
+    ) -> AsyncIterator[str]:
+        model = kwargs.get("model") or self._model
+        tried: set[int] = set()
+        replica = self._acquire(model, tried)
+        while True:
+            tried.add(id(replica))
+            started = time.monotonic()
+            latency: float | None = None
+            try:
+                async for chunk in replica.provider.agenerate_stream(
+                    prompt=prompt, system_prompt=system_prompt, **kwargs
+                ):
+                    if latency is None:
+                        latency = time.monotonic() - started
+                    yield chunk
+            except Exception as e:
+                self._release(replica, error=e)
+                if latency is not None or not self._is_replica_failure(e):
+                    raise
+                replica = self._acquire(model, tried)
+                if replica is None:
+                    raise
+                continue
+            except BaseException:
+                self._release(replica, cancelled=True)
+                raise
+            self._release(replica, first_chunk_latency=latency)
+            return
+
+    def stats(self) -> list[dict[str, object]]:
+        now = time.monotonic()
+        with self._lock:
+            return [replica.stats(now, self._failure_threshold) for replica in self._replicas]
+
+
+class UsageStats:
+    """累计上游返回的 token 用量，其中命中提示词前缀缓存的部分单独统计。"""
+
+    def __init__(self) -> None:
+        self._lock = Lock()
+        self._counters = {"requests": 0, "prompt_tokens": 0, "cached_tokens": 0, "completion_tokens": 0}
+
+    @staticmethod
+    def cached_tokens(usage: dict) -> int:
+        # DeepSeek 返回 prompt_cache_hit_tokens；OpenAI 及多数兼容服务放在 prompt_tokens_details.cached_tokens
+        hit = usage.get("prompt_cache_hit_tokens")
+        if not isinstance(hit, int):
+            details = usage.get("prompt_tokens_details")
+            hit = details.get("cached_tokens") if isinstance(details, dict) else None
+        return hit if isinstance(hit, int) else 0
+
+    def record(self, usage: dict) -> None:
+        prompt_tokens = usage.get("prompt_tokens")
+        completion_tokens = usage.get("completion_tokens")
+        with self._lock:
+            self._counters["requests"] += 1
+            self._counters["prompt_tokens"] += prompt_tokens if isinstance(prompt_tokens, int) else 0
+            self._counters["completion_tokens"] += completion_tokens if isinstance(completion_tokens, int) else 0
+            self._counters["cached_tokens"] += self.cached_tokens(usage)
+
+    def stats(self) -> dict[str, float]:
+        with self._lock:
+            stats: dict[str, float] = dict(self._counters)
+        prompt_tokens = stats["prompt_tokens"]
+        stats["cache_hit_rate"] = round(stats["cached_tokens"] / prompt_tokens, 4) if prompt_tokens else 0.0
+        return stats
+
+
+class OpenAICompatProvider(BaseLLMProvider):
+    def __init__(
+        self,
+        api_key: str,
+        base_url: str,
+        model: str,
+        timeout_seconds: float = 120,
+        connect_timeout_seconds: float = 5,
+        sessions: HTTPSessionPool | None = None,
+        async_clients: AsyncClientPool | None = None,
+        stream_usage: bool = False,
+    ) -> None:
+        self._api_key = api_key
+        self._base_url = base_url.rstrip("/")
+        self._model = model
+        self._timeout = (connect_timeout_seconds, timeout_seconds)
+        self._sessions = sessions or HTTPSessionPool()
+        self._async_clients = async_clients
+        self._stream_usage = stream_usage
+        self.usage = UsageStats()
+
+    def _build_request(
+        self, prompt: str, system_prompt: str | None, kwargs: dict
+    ) -> tuple[str, str, dict[str, str], dict[str, object]]:
+        """返回 (base_url, url, headers, payload)。"""
         # Allow overrides from kwargs
         api_key = kwargs.get("api_key") or self._api_key
         base_url = kwargs.get("base_url")
@@ -117,6 +758,9 @@ class OpenAICompatProvider(BaseLLMProvider):
             "messages": messages,
             "stream": True,
         }
+        if self._stream_usage:
+            # 让上游在最后一个数据块中返回 usage（含缓存命中的 token 数）
+            payload["stream_options"] = {"include_usage": True}
         temperature = kwargs.get("temperature")
         if isinstance(temperature, (int, float)):
             payload["temperature"] = float(temperature)
@@ -125,29 +769,115 @@ class OpenAICompatProvider(BaseLLMProvider):
             "Authorization": f"Bearer {api_key}",
             "Content-Type": "application/json",
         }
+        return base_url, url, headers, payload
+
+    @staticmethod
+    def _parse_choices(raw_line: str) -> tuple[bool, list[tuple[int, str]], dict | None]:
+        """解析一行 SSE，返回 (是否结束, [(候选序号, 文本块)], usage)。"""
+        if not raw_line:
+            return False, [], None
+        line = raw_line.strip()
+        if not line.startswith("data:"):
+            return False, [], None
+        data_part = line[5:].strip()
+        if data_part == "[DONE]":
+            return True, [], None
+        try:
+            data = json.loads(data_part)
+        except json.JSONDecodeError:
+            return False, [], None
+        usage = data.get("usage") if isinstance(data.get("usage"), dict) else None
+        choices = data.get("choices")
+        if not isinstance(choices, list):
+            return False, [], usage
+        chunks: list[tuple[int, str]] = []
+        for position, choice in enumerate(choices):
+            delta = choice.get("delta") if isinstance(choice, dict) else None
+            if not isinstance(delta, dict):
+                continue
+            content = delta.get("content")
+            index = choice.get("index")
+            if isinstance(content, str) and content:
+                chunks.append((index if isinstance(index, int) else position, content))
+        return False, chunks, usage
+
+    @classmethod
+    def _parse_line(cls, raw_line: str) -> tuple[bool, str | None, dict | None]:
+        """解析一行 SSE，返回 (是否结束, 文本块, usage)。"""
+        done, chunks, usage = cls._parse_choices(raw_line)
+        return done, chunks[0][1] if chunks else None, usage
 
-        with requests.post(url, headers=headers, json=payload, stream=True, timeout=self._timeout_seconds) as response:
+    def generate_stream(
+        self,
+        prompt: str,
+        system_prompt: str | None = None,
+        **kwargs,
+    ) -> Generator[str, None, None]:
+        for _, chunk in self.generate_choices(prompt, system_prompt, 1, **kwargs):
+            yield chunk
+
+    def generate_choices(
+        self,
+        prompt: str,
+        system_prompt: str | None = None,
+        n: int = 1,
+        **kwargs,
+    ) -> Generator[tuple[int, str], None, None]:
+        """用原生 n 参数一次生成多个候选，产出 (候选序号, 文本块)；不支持 n 的上游只会返回序号 0。"""
+        base_url, url, headers, payload = self._build_request(prompt, system_prompt, kwargs)
+        if n > 1:
+            payload["n"] = n
+
+        abort = UpstreamAbort(kwargs.get("cancel"))
+        if abort.cancelled:
+            return
+
+        session = self._sessions.get(base_url)
+        try:
+            with abort.capture():
+                response = session.post(url, headers=headers, json=payload, stream=True, timeout=self._timeout)
+            with response:
+                response.raise_for_status()
+                # 上游未声明 charset 时 requests 会按 ISO-8859-1 解码，这里统一按 UTF-8 处理
+                for raw_line in response.iter_lines():
+                    if abort.cancelled:
+                        return
+                    done, chunks, usage = self._parse_choices(raw_line.decode("utf-8", errors="replace"))
+                    if usage is not None:
+                        self.usage.record(usage)
+                    if done:
+                        break
+                    if n == 1:
+                        # 单个候选时不看序号，与只取第一个 choice 的旧行为一致
+                        chunks = [(0, chunk) for _, chunk in chunks[:1]]
+                    yield from chunks
+        except Exception:
+            # 取消时连接被强制关闭，读取报错属于预期，按正常结束处理
+            if not abort.cancelled:
+                raise
+        finally:
+            abort.release()
+
+    async def agenerate_stream(
+        self,
+        prompt: str,
+        system_prompt: str | None = None,
+        **kwargs,
+    ) -> AsyncIterator[str]:
+        if self._async_clients is None:
+            async for chunk in super().agenerate_stream(prompt, system_prompt, **kwargs):
+                yield chunk
+            return
+        base_url, url, headers, payload = self._build_request(prompt, system_prompt, kwargs)
+
+        client = self._async_clients.get(base_url)
+        async with client.stream("POST", url, headers=headers, json=payload) as response:
             response.raise_for_status()
-            for raw_line in response.iter_lines(decode_unicode=True):
-                if not raw_line:
-                    continue
-                line = raw_line.strip()
-                if not line.startswith("data:"):
-                    continue
-                data_part = line[5:].strip()
-                if data_part == "[DONE]":
+            async for raw_line in response.aiter_lines():
+                done, chunk, usage = self._parse_line(raw_line)
+                if usage is not None:
+                    self.usage.record(usage)
+                if done:
                     break
-                try:
-                    data = json.loads(data_part)
-                except json.JSONDecodeError:
-                    continue
-                choices = data.get("choices")
-                if not isinstance(choices, list) or not choices:
-                    continue
-                delta = choices[0].get("delta") if isinstance(choices[0], dict) else None
-                if not isinstance(delta, dict):
-                    continue
-                content = delta.get("content")
-                if isinstance(content, str) and content:
-                    yield content
-
+                if chunk:
+                    yield chunk
@@ -5,20 +5,29 @@ import os
 from flask import Flask, jsonify
 from flask_cors import CORS
 
+from .config import load_config
 from .database import init_db
+from .jobs import job_queue
 from .routes.ai_routes import ai_bp
 from .routes.auth_routes import auth_bp
+from .routes.job_routes import job_bp
 from .routes.novel_routes import novel_bp
+from .stats import ensure_stats
 
 
 def create_app() -> Flask:
     app = Flask(__name__)
     CORS(app)
     init_db()
+    ensure_stats()
 
     app.register_blueprint(auth_bp)
     app.register_blueprint(ai_bp)
     app.register_blueprint(novel_bp)
+    app.register_blueprint(job_bp)
+
+    if load_config().jobs_enabled:
+        job_queue.start()
 
     @app.get("/api/health")
     def health():
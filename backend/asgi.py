@@ -0,0 +1,203 @@
+"""ASGI 入口：AI 生成接口走原生异步流式，其余接口仍交给 Flask（WSGI）处理。
+
+运行方式：uvicorn backend.asgi:app --host 127.0.0.1 --port 5000
+"""
+from __future__ import annotations
+
+import asyncio
+import json
+from typing import Awaitable, Callable
+
+from asgiref.wsgi import WsgiToAsgi
+
+from .app import create_app
+from .context_budget import PromptTooLong
+from .novel_ai import ai_service
+from .routes.ai_routes import (
+    _asse_stream,
+    astart_stream,
+    admit_candidates,
+    check_rate_limit,
+    parse_brainstorm_request,
+    parse_candidates,
+    parse_coalesce_options,
+    parse_generate_request,
+    queue_error,
+    resume_error,
+    start_candidates_stream,
+)
+from .scheduler import QueueFull, QueueTimeout
+from .stream_registry import parse_event_id, stream_registry
+
+
+Scope = dict
+Receive = Callable[[], Awaitable[dict]]
+Send = Callable[[dict], Awaitable[None]]
+
+
+async def _read_json(receive: Receive) -> dict:
+    body = b""
+    while True:
+        message = await receive()
+        body += message.get("body", b"")
+        if not message.get("more_body"):
+            break
+    try:
+        data = json.loads(body or b"{}")
+    except ValueError:
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+async def _send_json(send: Send, payload: dict, status: int = 200) -> None:
+    body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+    await send(
+        {
+            "type": "http.response.start",
+            "status": status,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"access-control-allow-origin", b"*"),
+            ],
+        }
+    )
+    await send({"type": "http.response.body", "body": body})
+
+
+async def _send_sse(receive: Receive, send: Send, frames) -> None:
+    await send(
+        {
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [
+                (b"content-type", b"text/event-stream; charset=utf-8"),
+                (b"cache-control", b"no-cache"),
+                (b"access-control-allow-origin", b"*"),
+            ],
+        }
+    )
+
+    async def pump() -> None:
+        async for frame in frames:
+            await send({"type": "http.response.body", "body": frame.encode("utf-8"), "more_body": True})
+        await send({"type": "http.response.body", "body": b""})
+
+    async def wait_disconnect() -> None:
+        while (await receive())["type"] != "http.disconnect":
+            pass
+
+    # 客户端断开时停止推送；生成在宽限期内继续写入缓冲，可凭 Last-Event-ID 续传，超时无人续传则中止
+    pump_task = asyncio.ensure_future(pump())
+    watch_task = asyncio.ensure_future(wait_disconnect())
+    done, pending = await asyncio.wait({pump_task, watch_task}, return_when=asyncio.FIRST_COMPLETED)
+    for task in pending:
+        task.cancel()
+    await asyncio.gather(*pending, return_exceptions=True)
+    # 显式关闭事件流，使其登记订阅方断开
+    await frames.aclose()
+    if pump_task in done:
+        pump_task.result()
+
+
+def _header(scope: Scope, name: bytes) -> str | None:
+    for key, value in scope.get("headers", []):
+        if key.lower() == name:
+            return value.decode("latin-1")
+    return None
+
+
+async def _generate(scope: Scope, receive: Receive, send: Send) -> None:
+    data = await _read_json(receive)
+    resume = parse_event_id(_header(scope, b"last-event-id"))
+    if resume:
+        stream_id, after = resume
+        stream = stream_registry.get(stream_id)
+        error = resume_error(stream, after)
+        if error:
+            await _send_json(send, error[0], status=error[1])
+            return
+        stream_registry.count_resume()
+        await _send_sse(receive, send, _asse_stream(stream, after))
+        return
+    client = scope.get("client")
+    limited = check_rate_limit(client[0] if client else "anonymous")
+    if limited:
+        await _send_json(send, limited, status=429)
+        return
+
+    # 构建上下文需要访问数据库（同步），放到线程池中执行
+    req = await asyncio.to_thread(parse_generate_request, data)
+    try:
+        candidates = parse_candidates(data, req)
+    except ValueError as e:
+        await _send_json(send, {"code": "INVALID_INPUT", "message": str(e)}, status=400)
+        return
+    try:
+        if candidates is not None:
+            # 多候选由线程并发生成（受各 provider 并发上限约束），这里只异步推送缓冲中的帧
+            admit_candidates(candidates)
+            if req.stream:
+                stream = start_candidates_stream(candidates, parse_coalesce_options(data))
+                await _send_sse(receive, send, _asse_stream(stream))
+                return
+            results = await asyncio.to_thread(ai_service.generate_candidates, candidates)
+            await _send_json(send, {"code": "OK", "data": {"candidates": results}})
+            return
+        plan = ai_service.admit(req)
+        if req.stream:
+            stream = astart_stream(req, parse_coalesce_options(data), plan)
+            await _send_sse(receive, send, _asse_stream(stream))
+            return
+        content = await ai_service.agenerate(req, plan)
+    except (QueueFull, QueueTimeout) as e:
+        await _send_json(send, *queue_error(e))
+        return
+    except PromptTooLong as e:
+        await _send_json(send, {"code": "INVALID_INPUT", "message": str(e)}, status=400)
+        return
+    await _send_json(send, {"code": "OK", "data": {"content": content}})
+
+
+async def _brainstorm(scope: Scope, receive: Receive, send: Send) -> None:
+    data = await _read_json(receive)
+    req = parse_brainstorm_request(data)
+    try:
+        content = await ai_service.agenerate(req)
+    except (QueueFull, QueueTimeout) as e:
+        await _send_json(send, *queue_error(e))
+        return
+    except PromptTooLong as e:
+        await _send_json(send, {"code": "INVALID_INPUT", "message": str(e)}, status=400)
+        return
+    await _send_json(send, {"code": "OK", "data": {"content": content}})
+
+
+ASYNC_ROUTES: dict[tuple[str, str], Callable[[Scope, Receive, Send], Awaitable[None]]] = {
+    ("POST", "/api/ai/generate"): _generate,
+    ("POST", "/api/ai/brainstorm"): _brainstorm,
+}
+
+
+class NovelAIAsgiApp:
+    def __init__(self) -> None:
+        self._wsgi = WsgiToAsgi(create_app())
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] == "lifespan":
+            while True:
+                message = await receive()
+                if message["type"] == "lifespan.startup":
+                    await send({"type": "lifespan.startup.complete"})
+                elif message["type"] == "lifespan.shutdown":
+                    await ai_service.aclose()
+                    await send({"type": "lifespan.shutdown.complete"})
+                    return
+        handler = ASYNC_ROUTES.get((scope.get("method", ""), scope.get("path", "")))
+        if scope["type"] == "http" and handler is not None:
+            await handler(scope, receive, send)
+            return
+        await self._wsgi(scope, receive, send)
+
+
+app = NovelAIAsgiApp()
@@ -0,0 +1,123 @@
+from __future__ import annotations
+
+import re
+from threading import Semaphore, Thread
+from typing import Callable, Iterable, Iterator
+
+from .utils.streams import BroadcastStream, CancelToken
+
+
+_PARAGRAPH_SPLIT_RE = re.compile(r"(\n+)")
+_SENTENCE_SPLIT_RE = re.compile(r"(?<=[。！？!?；;…」”])")
+
+
+def _split_long(paragraph: str, max_chars: int) -> list[str]:
+    """超长段落按句子切开，单句仍超长时按字数硬切。"""
+    if len(paragraph) <= max_chars:
+        return [paragraph]
+    pieces: list[str] = []
+    current = ""
+    for sentence in filter(None, _SENTENCE_SPLIT_RE.split(paragraph)):
+        while len(sentence) > max_chars:
+            if current:
+                pieces.append(current)
+                current = ""
+            pieces.append(sentence[:max_chars])
+            sentence = sentence[max_chars:]
+        if current and len(current) + len(sentence) > max_chars:
+            pieces.append(current)
+            current = ""
+        current += sentence
+    if current:
+        pieces.append(current)
+    return pieces
+
+
+def split_paragraphs(text: str, max_chars: int) -> list[tuple[str, str]]:
+    """按段落边界把 text 切成不超过 max_chars 的块，返回 [(块, 块后的分隔符)]。
+    相邻的短段落合并到同一块，按顺序拼接 块+分隔符 即得到原文（首尾空白除外）。"""
+    max_chars = max(1, max_chars)
+    parts = _PARAGRAPH_SPLIT_RE.split(text.strip())
+    pieces: list[tuple[str, str]] = []
+    for i in range(0, len(parts), 2):
+        paragraph = parts[i]
+        separator = parts[i + 1] if i + 1 < len(parts) else ""
+        if not paragraph.strip() and pieces:
+            # 只有空白的行并入上一段的分隔符
+            pieces[-1] = (pieces[-1][0], pieces[-1][1] + paragraph + separator)
+            continue
+        sentences = _split_long(paragraph, max_chars)
+        pieces.extend((s, "") for s in sentences[:-1])
+        pieces.append((sentences[-1], separator))
+
+    chunks: list[tuple[str, str]] = []
+    current, current_separator = "", ""
+    for paragraph, separator in pieces:
+        if current and len(current) + len(current_separator) + len(paragraph) > max_chars:
+            chunks.append((current, current_separator))
+            current, current_separator = paragraph, separator
+        else:
+            current += current_separator + paragraph
+            current_separator = separator
+    if current:
+        chunks.append((current, current_separator))
+    return chunks
+
+
+def trim_stream(chunks: Iterable[str]) -> Iterator[str]:
+    """去掉流式输出首尾的空白，便于各块结果按原分隔符拼接。"""
+    started = False
+    held = ""
+    for chunk in chunks:
+        if not started:
+            chunk = chunk.lstrip()
+            if not chunk:
+                continue
+            started = True
+        stripped = chunk.rstrip()
+        if not stripped:
+            held += chunk
+            continue
+        yield held + stripped
+        held = chunk[len(stripped) :]
+
+
+def ordered_parallel(
+    factories: list[Callable[[CancelToken], Iterable[str]]],
+    parallelism: int,
+    cancel: CancelToken | None = None,
+) -> Iterator[str]:
+    """最多 parallelism 个流同时执行，结果按原顺序输出：排在最前的流实时转发，
+    后面的流先缓冲，轮到时回放。某块出错、调用方提前结束或 cancel 触发时停止其余的流。"""
+    outputs = [BroadcastStream() for _ in factories]
+    slots = Semaphore(max(1, parallelism))
+    stopped = CancelToken()
+    unlink = cancel.on_cancel(stopped.cancel) if cancel is not None else None
+
+    def run(index: int) -> None:
+        try:
+            outputs[index].pump(factories[index](stopped))
+        except Exception as e:
+            outputs[index].finish(e)
+        finally:
+            slots.release()
+
+    def dispatch() -> None:
+        for index in range(len(factories)):
+            slots.acquire()
+            if stopped.cancelled:
+                slots.release()
+                outputs[index].finish()
+                continue
+            Thread(target=run, args=(index,), name="chunk-worker", daemon=True).start()
+
+    Thread(target=dispatch, name="chunk-dispatch", daemon=True).start()
+    try:
+        for output in outputs:
+            yield from output.subscribe(stopped)
+            if stopped.cancelled:
+                return
+    finally:
+        stopped.cancel()
+        if unlink is not None:
+            unlink()
@@ -14,9 +14,81 @@ class Config:
     default_provider: str
     ollama_base_url: str
     ollama_model: str
+    ollama_base_urls: tuple[str, ...]
     openai_compat_api_key: str | None
     openai_compat_base_url: str | None
     openai_compat_model: str | None
+    context_cache_size: int
+    context_window_tokens: int
+    context_output_reserve_tokens: int
+    max_prompt_tokens: int
+    retrieval_top_k: int
+    retrieval_max_chars: int
+    retrieval_index_max_novels: int
+    summaries_enabled: bool
+    summary_arc_size: int
+    summary_workers: int
+    http_pool_size: int
+    http_connect_timeout_seconds: float
+    http_read_timeout_seconds: float
+    http_connect_retries: int
+    response_cache_enabled: bool
+    response_cache_size: int
+    response_cache_ttl_seconds: int
+    response_cache_max_chars: int
+    response_cache_persist: bool
+    response_cache_persist_max_entries: int
+    single_flight_enabled: bool
+    brainstorm_batch_workers: int
+    hedge_enabled: bool
+    hedge_backup_provider: str | None
+    hedge_backup_model: str | None
+    hedge_default_delay_seconds: float
+    hedge_min_delay_seconds: float
+    hedge_max_delay_seconds: float
+    ollama_health_interval_seconds: float
+    ollama_breaker_failures: int
+    ollama_breaker_cooldown_seconds: float
+    model_catalog_ttl_seconds: float
+    ollama_keep_alive: str | None
+    ollama_context_reuse: bool
+    ollama_context_cache_size: int
+    ollama_context_ttl_seconds: float
+    prompt_layout: str
+    openai_compat_stream_usage: bool
+    sse_coalesce_ms: int
+    sse_coalesce_bytes: int
+    sse_resume_ttl_seconds: float
+    sse_resume_max_total_bytes: int
+    sse_resume_stream_max_bytes: int
+    sse_disconnect_grace_seconds: float
+    sse_heartbeat_seconds: float
+    ollama_max_concurrency: int
+    openai_compat_max_concurrency: int
+    llm_queue_size: int
+    llm_queue_timeout_seconds: float
+    chunk_max_chars: int
+    chunk_parallelism: int
+    chunk_overlap_chars: int
+    chunk_auto_min_chars: int
+    jobs_enabled: bool
+    job_workers: dict[str, int]
+    job_poll_seconds: float
+    job_lease_seconds: float
+    job_retry_backoff_seconds: float
+    batch_parallelism: int
+    max_candidates: int
+    openai_compat_native_n: bool
+
+
+def _parse_counts(raw: str) -> dict[str, int]:
+    """解析 "name=数量,name=数量" 形式的配置。"""
+    counts: dict[str, int] = {}
+    for item in raw.split(","):
+        name, _, value = item.partition("=")
+        if name.strip() and value.strip().isdigit():
+            counts[name.strip()] = int(value)
+    return counts
 
 
 def load_config() -> Config:
@@ -31,8 +103,83 @@ def load_config() -> Config:
         default_provider=os.getenv("DEFAULT_PROVIDER", "ollama"),
         ollama_base_url=os.getenv("OLLAMA_BASE_URL", "http://localhost:11434"),
         ollama_model=os.getenv("OLLAMA_MODEL", "qwen2.5"),
+        # 多个 Ollama 副本用逗号分隔；未配置时只使用 OLLAMA_BASE_URL
+        ollama_base_urls=tuple(
+            url.strip() for url in os.getenv("OLLAMA_BASE_URLS", "").split(",") if url.strip()
+        ) or (os.getenv("OLLAMA_BASE_URL", "http://localhost:11434"),),
         openai_compat_api_key=os.getenv("OPENAI_COMPAT_API_KEY") or None,
         openai_compat_base_url=os.getenv("OPENAI_COMPAT_BASE_URL") or None,
         openai_compat_model=os.getenv("OPENAI_COMPAT_MODEL") or None,
+        context_cache_size=int(os.getenv("CONTEXT_CACHE_SIZE", "128")),
+        context_window_tokens=int(os.getenv("CONTEXT_WINDOW_TOKENS", "8192")),
+        context_output_reserve_tokens=int(os.getenv("CONTEXT_OUTPUT_RESERVE_TOKENS", "1024")),
+        max_prompt_tokens=int(os.getenv("MAX_PROMPT_TOKENS", "6000")),
+        retrieval_top_k=int(os.getenv("RETRIEVAL_TOP_K", "4")),
+        retrieval_max_chars=int(os.getenv("RETRIEVAL_MAX_CHARS", "1500")),
+        retrieval_index_max_novels=int(os.getenv("RETRIEVAL_INDEX_MAX_NOVELS", "16")),
+        summaries_enabled=os.getenv("SUMMARIES_ENABLED", "0") == "1",
+        summary_arc_size=int(os.getenv("SUMMARY_ARC_SIZE", "10")),
+        summary_workers=int(os.getenv("SUMMARY_WORKERS", "1")),
+        http_pool_size=int(os.getenv("HTTP_POOL_SIZE", "10")),
+        http_connect_timeout_seconds=float(os.getenv("HTTP_CONNECT_TIMEOUT_SECONDS", "5")),
+        http_read_timeout_seconds=float(os.getenv("HTTP_READ_TIMEOUT_SECONDS", "120")),
+        http_connect_retries=int(os.getenv("HTTP_CONNECT_RETRIES", "2")),
+        response_cache_enabled=os.getenv("RESPONSE_CACHE_ENABLED", "1") == "1",
+        response_cache_size=int(os.getenv("RESPONSE_CACHE_SIZE", "256")),
+        response_cache_ttl_seconds=int(os.getenv("RESPONSE_CACHE_TTL_SECONDS", "86400")),
+        response_cache_max_chars=int(os.getenv("RESPONSE_CACHE_MAX_CHARS", "50000")),
+        response_cache_persist=os.getenv("RESPONSE_CACHE_PERSIST", "0") == "1",
+        response_cache_persist_max_entries=int(os.getenv("RESPONSE_CACHE_PERSIST_MAX_ENTRIES", "5000")),
+        single_flight_enabled=os.getenv("SINGLE_FLIGHT_ENABLED", "1") == "1",
+        brainstorm_batch_workers=int(os.getenv("BRAINSTORM_BATCH_WORKERS", "4")),
+        hedge_enabled=os.getenv("HEDGE_ENABLED", "0") == "1",
+        hedge_backup_provider=os.getenv("HEDGE_BACKUP_PROVIDER") or None,
+        hedge_backup_model=os.getenv("HEDGE_BACKUP_MODEL") or None,
+        hedge_default_delay_seconds=float(os.getenv("HEDGE_DEFAULT_DELAY_SECONDS", "8")),
+        hedge_min_delay_seconds=float(os.getenv("HEDGE_MIN_DELAY_SECONDS", "1")),
+        hedge_max_delay_seconds=float(os.getenv("HEDGE_MAX_DELAY_SECONDS", "15")),
+        ollama_health_interval_seconds=float(os.getenv("OLLAMA_HEALTH_INTERVAL_SECONDS", "15")),
+        ollama_breaker_failures=int(os.getenv("OLLAMA_BREAKER_FAILURES", "3")),
+        ollama_breaker_cooldown_seconds=float(os.getenv("OLLAMA_BREAKER_COOLDOWN_SECONDS", "30")),
+        model_catalog_ttl_seconds=float(os.getenv("MODEL_CATALOG_TTL_SECONDS", "60")),
+        ollama_keep_alive=os.getenv("OLLAMA_KEEP_ALIVE", "30m") or None,
+        ollama_context_reuse=os.getenv("OLLAMA_CONTEXT_REUSE", "1") == "1",
+        ollama_context_cache_size=int(os.getenv("OLLAMA_CONTEXT_CACHE_SIZE", "64")),
+        ollama_context_ttl_seconds=float(os.getenv("OLLAMA_CONTEXT_TTL_SECONDS", "1800")),
+        prompt_layout=os.getenv("PROMPT_LAYOUT", "inline"),
+        openai_compat_stream_usage=os.getenv("OPENAI_COMPAT_STREAM_USAGE", "0") == "1",
+        sse_coalesce_ms=int(os.getenv("SSE_COALESCE_MS", "40")),
+        sse_coalesce_bytes=int(os.getenv("SSE_COALESCE_BYTES", "1024")),
+        sse_resume_ttl_seconds=float(os.getenv("SSE_RESUME_TTL_SECONDS", "300")),
+        sse_resume_max_total_bytes=int(os.getenv("SSE_RESUME_MAX_TOTAL_BYTES", str(32 * 1024 * 1024))),
+        sse_resume_stream_max_bytes=int(os.getenv("SSE_RESUME_STREAM_MAX_BYTES", str(1024 * 1024))),
+        # 客户端断开后等待续传的时间，超时仍无人续传则中止生成；0 表示立即中止
+        sse_disconnect_grace_seconds=float(os.getenv("SSE_DISCONNECT_GRACE_SECONDS", "10")),
+        # 等待模型输出期间发送心跳，以便及时发现客户端断开
+        sse_heartbeat_seconds=float(os.getenv("SSE_HEARTBEAT_SECONDS", "5")),
+        # 每个 Ollama 节点同时进行的生成数（CPU 推理通常只能同时服务一两个），0 表示不限制
+        ollama_max_concurrency=int(os.getenv("OLLAMA_MAX_CONCURRENCY", "2")),
+        openai_compat_max_concurrency=int(os.getenv("OPENAI_COMPAT_MAX_CONCURRENCY", "8")),
+        # 每个 provider 的等待队列长度，满了立即拒绝
+        llm_queue_size=int(os.getenv("LLM_QUEUE_SIZE", "16")),
+        llm_queue_timeout_seconds=float(os.getenv("LLM_QUEUE_TIMEOUT_SECONDS", "120")),
+        # 润色/改写/仿写的长文本按段落分块并发处理
+        chunk_max_chars=int(os.getenv("CHUNK_MAX_CHARS", "1500")),
+        chunk_parallelism=int(os.getenv("CHUNK_PARALLELISM", "3")),
+        chunk_overlap_chars=int(os.getenv("CHUNK_OVERLAP_CHARS", "200")),
+        # 未指定 chunked 时，超过该字数自动分块；0 表示只在请求指定时分块
+        chunk_auto_min_chars=int(os.getenv("CHUNK_AUTO_MIN_CHARS", "4000")),
+        jobs_enabled=os.getenv("JOBS_ENABLED", "1") == "1",
+        # 按任务类型覆盖工作线程数，如 "summarize_novel=1,generate_characters=2"
+        job_workers=_parse_counts(os.getenv("JOB_WORKERS", "")),
+        job_poll_seconds=float(os.getenv("JOB_POLL_SECONDS", "2")),
+        # 执行中的任务超过该时间没有心跳即视为中断，重新排队
+        job_lease_seconds=float(os.getenv("JOB_LEASE_SECONDS", "60")),
+        job_retry_backoff_seconds=float(os.getenv("JOB_RETRY_BACKOFF_SECONDS", "5")),
+        # 整书批量润色/仿写时同时处理的章节数
+        batch_parallelism=int(os.getenv("BATCH_PARALLELISM", "2")),
+        # 一次生成的候选数上限；OpenAI 兼容接口用原生 n 参数一次请求生成多个候选（上游不支持时自动改为逐个请求）
+        max_candidates=int(os.getenv("MAX_CANDIDATES", "4")),
+        openai_compat_native_n=os.getenv("OPENAI_COMPAT_NATIVE_N", "1") == "1",
     )
 
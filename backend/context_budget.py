@@ -0,0 +1,202 @@
+from __future__ import annotations
+
+import math
+import re
+from string import Formatter
+from threading import Lock
+from typing import Iterable
+
+
+# 中日韩文字及全角标点，按 1 字 ≈ 1 token 估算；其余字符按 4 字符 ≈ 1 token 估算
+_CJK_RE = re.compile(
+    r"[\u3000-\u303f\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff\uff00-\uffef]"
+)
+_NON_CJK_TOKEN_COST = 0.25
+
+# 模型名前缀 -> 上下文窗口（token），按最长前缀匹配
+MODEL_CONTEXT_WINDOWS: dict[str, int] = {
+    "deepseek": 65536,
+    "gpt-3.5-turbo": 16385,
+    "gpt-4o": 128000,
+    "moonshot-v1-8k": 8192,
+    "moonshot-v1-32k": 32768,
+    "moonshot-v1-128k": 131072,
+    "qwen2.5": 32768,
+    "qwen2": 32768,
+    "llama3": 8192,
+}
+
+# 各模式下 user 提示词中各段落的预算权重；未列出的段落权重为 1
+SECTION_WEIGHTS: dict[str, dict[str, float]] = {
+    "continue": {
+        "previous_text": 6,
+        "story_so_far": 2,
+        "character_summary": 2,
+        "related_passages": 2,
+        "novel_summary": 1,
+    },
+    "rewrite": {"target_text": 1},
+    "polish": {"target_text": 1},
+    "mimic": {"target_text": 1},
+    "character": {"novel_summary": 1, "keywords": 1},
+    "plot_twist": {"novel_summary": 1, "keywords": 1},
+    "story_fragment": {"novel_summary": 1, "keywords": 1},
+    "world_building": {"novel_summary": 1, "keywords": 1},
+}
+
+# 超出预算时保留末尾的段落（其余保留开头）
+TAIL_SECTIONS = {"previous_text", "story_so_far"}
+
+# 不参与裁剪的段落：用户要求改写的原文截断后结尾会直接丢失，只能裁剪其他辅助段落
+PRESERVED_SECTIONS: dict[str, set[str]] = {
+    "rewrite": {"target_text"},
+    "polish": {"target_text"},
+    "mimic": {"target_text"},
+}
+
+
+class PromptTooLong(ValueError):
+    """不可裁剪的段落本身已超出模型上下文。"""
+
+    def __init__(self, needed: int, available: int) -> None:
+        super().__init__(f"待处理文本约 {needed} token，超出模型可用的 {max(available, 0)} token，请缩短选区或开启分块")
+        self.needed = needed
+        self.available = available
+
+
+_learned_windows: dict[str, int] = {}
+_learned_lock = Lock()
+
+
+def _char_cost(ch: str) -> float:
+    return 1.0 if _CJK_RE.match(ch) else _NON_CJK_TOKEN_COST
+
+
+def estimate_tokens(text: str) -> int:
+    if not text:
+        return 0
+    cjk = len(_CJK_RE.findall(text))
+    return cjk + math.ceil((len(text) - cjk) * _NON_CJK_TOKEN_COST)
+
+
+def truncate_to_tokens(text: str, max_tokens: int, keep_tail: bool = False) -> str:
+    if max_tokens <= 0 or not text:
+        return ""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    chars = reversed(text) if keep_tail else iter(text)
+    used = 0.0
+    count = 0
+    for ch in chars:
+        used += _char_cost(ch)
+        if used > max_tokens:
+            break
+        count += 1
+    if keep_tail:
+        return text[len(text) - count:] if count else ""
+    cut = text[:count]
+    # 尽量在整行处截断，避免人物档案之类的条目被拦腰截断
+    newline = cut.rfind("\n")
+    if newline > count // 2:
+        cut = cut[:newline]
+    return cut
+
+
+def register_context_window(model: str, tokens: int) -> None:
+    """记录从模型元数据中获得的真实上下文窗口，优先于内置表。"""
+    if model and tokens > 0:
+        with _learned_lock:
+            _learned_windows[model] = tokens
+
+
+def resolve_context_window(model: str | None, default: int) -> int:
+    if not model:
+        return default
+    with _learned_lock:
+        learned = _learned_windows.get(model)
+    if learned:
+        return learned
+    name = model.lower().split("/")[-1]
+    best = ""
+    for prefix in MODEL_CONTEXT_WINDOWS:
+        if name.startswith(prefix) and len(prefix) > len(best):
+            best = prefix
+    return MODEL_CONTEXT_WINDOWS[best] if best else default
+
+
+def template_sections(template: str) -> list[str]:
+    return list(dict.fromkeys(field for _, field, _, _ in Formatter().parse(template) if field))
+
+
+def allocate_budget(needs: dict[str, int], weights: dict[str, float], total: int) -> dict[str, int]:
+    """按权重分配 total 个 token；需求小于份额的段落只取所需，余量再按权重分给其他段落。"""
+    budgets: dict[str, int] = {}
+    pending = {k: n for k, n in needs.items() if n > 0}
+    remaining = max(total, 0)
+    while pending:
+        weight_sum = sum(weights.get(k, 1.0) for k in pending)
+        satisfied = {
+            k: n for k, n in pending.items() if n <= remaining * weights.get(k, 1.0) / weight_sum
+        }
+        if not satisfied:
+            for k in pending:
+                budgets[k] = int(remaining * weights.get(k, 1.0) / weight_sum)
+            break
+        for k, n in satisfied.items():
+            budgets[k] = n
+            remaining -= n
+            del pending[k]
+    for k in needs:
+        budgets.setdefault(k, 0)
+    return budgets
+
+
+def fit_prompt_values(
+    mode: str,
+    user_template: str,
+    system_prompt: str | None,
+    values: dict[str, str],
+    context_window: int,
+    output_reserve: int,
+    max_prompt_tokens: int,
+    stable_sections: Iterable[str] = (),
+) -> dict[str, str]:
+    """按 token 预算裁剪 user 提示词中的各段内容，使整体提示词不超过模型上下文。
+
+    PRESERVED_SECTIONS 中的段落原样保留，只裁剪其余段落；保留段落本身超出预算时抛出 PromptTooLong。
+    stable_sections 中的段落按“其余段落都占满预算”计算份额，裁剪结果只取决于自身内容，
+    保证作为提示词前缀时逐字节稳定，便于上游的前缀缓存命中。
+    """
+    sections = [s for s in template_sections(user_template) if s in values]
+    fixed_text = user_template
+    for s in sections:
+        fixed_text = fixed_text.replace("{" + s + "}", "")
+    fixed = estimate_tokens(fixed_text) + estimate_tokens(system_prompt or "")
+    total = min(context_window - output_reserve, max_prompt_tokens) - fixed
+
+    preserved = [s for s in sections if s in PRESERVED_SECTIONS.get(mode, ())]
+    if preserved:
+        needed = sum(estimate_tokens(values[s]) for s in preserved)
+        if needed > total:
+            raise PromptTooLong(needed, total)
+        total -= needed
+        sections = [s for s in sections if s not in preserved]
+
+    needs = {s: estimate_tokens(values[s]) for s in sections}
+    weights = SECTION_WEIGHTS.get(mode, {})
+    stable = [s for s in sections if s in set(stable_sections)]
+    if stable:
+        worst_case = {s: needs[s] if s in stable else max(total, 0) for s in sections}
+        stable_budgets = allocate_budget(worst_case, weights, total)
+        budgets = {s: min(needs[s], stable_budgets[s]) for s in stable}
+        volatile = {s: needs[s] for s in sections if s not in stable}
+        budgets.update(allocate_budget(volatile, weights, total - sum(budgets.values())))
+    elif sum(needs.values()) <= total:
+        return values
+    else:
+        budgets = allocate_budget(needs, weights, total)
+    fitted = dict(values)
+    for s in sections:
+        if needs[s] > budgets[s]:
+            fitted[s] = truncate_to_tokens(values[s], budgets[s], keep_tail=s in TAIL_SECTIONS)
+    return fitted
@@ -3,24 +3,128 @@ from __future__ import annotations
 from sqlalchemy import select
 from sqlalchemy.orm import Session
 
+from .config import load_config
 from .models import Chapter, Character, Novel
+from .prompts import PROMPT_TEMPLATES
+from .retrieval import retrieval_index
+from .revisions import novel_revisions
+from .summaries import summary_service
+from .utils.lru_cache import LRUCache
 
 
-def build_context_for_novel(db: Session, novel_id: int, max_chars: int = 6000) -> dict[str, str]:
-    novel = db.scalar(select(Novel).where(Novel.id == novel_id))
+CHAPTER_SEPARATOR = "\n\n"
+PASSAGE_SEPARATOR = "\n……\n"
+# 检索查询只取末尾这么多字符（未指定查询时取前文末尾）
+DEFAULT_QUERY_CHARS = 300
+config = load_config()
+_context_cache = LRUCache(max_entries=config.context_cache_size)
+
+
+def read_novel_tail(db: Session, novel_id: int, max_chars: int) -> str:
+    """从最新章节往前读取，凑够 max_chars 个字符即停止，结果与全文拼接后截尾一致。"""
+    if max_chars <= 0:
+        return ""
+    rows = db.execute(
+        select(Chapter.content)
+        .where(Chapter.novel_id == novel_id)
+        .order_by(Chapter.order_index.desc())
+        .execution_options(yield_per=8)
+    )
+    parts: list[str] = []
+    total = 0
+    for (content,) in rows:
+        if parts:
+            total += len(CHAPTER_SEPARATOR)
+        content = content or ""
+        parts.append(content)
+        total += len(content)
+        if total >= max_chars:
+            break
+    rows.close()
+    text = CHAPTER_SEPARATOR.join(reversed(parts))
+    if len(text) > max_chars:
+        text = text[-max_chars:]
+    return text
+
+
+def retrieve_passages(db: Session, novel_id: int, query: str, exclude_text: str = "") -> str:
+    """从检索索引中取与 query 最相关的段落，跳过已包含在前文中的段落，总长度不超过配置上限。"""
+    k = config.retrieval_top_k
+    if k <= 0 or not query.strip():
+        return ""
+    hits = retrieval_index.get(db, novel_id).search(query, k * 2)
+    picked: list[tuple[int, str]] = []
+    used = 0
+    for _, chapter_id, text in hits:
+        if text in exclude_text or used + len(text) > config.retrieval_max_chars:
+            continue
+        picked.append((chapter_id, text))
+        used += len(text)
+        if len(picked) >= k:
+            break
+    picked.sort(key=lambda item: item[0])
+    return PASSAGE_SEPARATOR.join(text for _, text in picked)
+
+
+def uses_related_passages(mode: str) -> bool:
+    """该模式的提示词模板是否引用检索段落；不引用时无需检索（也不必构建索引）。"""
+    return "{related_passages}" in PROMPT_TEMPLATES.get(mode, {}).get("user", "")
+
+
+def _with_related_passages(db: Session, novel_id: int, context: dict[str, str], query: str | None) -> dict[str, str]:
+    previous_text = context.get("previous_text", "")
+    if query is None:
+        query = previous_text
+    context["related_passages"] = retrieve_passages(
+        db, novel_id, query[-DEFAULT_QUERY_CHARS:], exclude_text=previous_text
+    )
+    return context
+
+
+def build_context_for_novel(
+    db: Session, novel_id: int, max_chars: int = 6000, query: str | None = None, retrieve: bool = True
+) -> dict[str, str]:
+    context = _load_novel_context(db, novel_id, max_chars)
+    if not context or not retrieve:
+        return context
+    return _with_related_passages(db, novel_id, context, query)
+
+
+def _load_novel_context(db: Session, novel_id: int, max_chars: int) -> dict[str, str]:
+    novel = db.execute(select(Novel.title, Novel.summary).where(Novel.id == novel_id)).first()
     if not novel:
         return {}
-    chapters = db.scalars(
-        select(Chapter).where(Chapter.novel_id == novel_id).order_by(Chapter.order_index.asc())
+    text = read_novel_tail(db, novel_id, max_chars)
+    # 固定顺序，保证人物档案作为提示词前缀时逐字节稳定
+    characters = db.execute(
+        select(Character.name, Character.profile).where(Character.novel_id == novel_id).order_by(Character.id)
     ).all()
-    text = "\n\n".join((c.content or "") for c in chapters)
-    if len(text) > max_chars:
-        text = text[-max_chars:]
-    characters = db.scalars(select(Character).where(Character.novel_id == novel_id)).all()
-    character_summary = "\n".join(f"{c.name}：{(c.profile or '').strip()}" for c in characters if c.name)
+    character_summary = "\n".join(f"{name}：{(profile or '').strip()}" for name, profile in characters if name)
+    if config.summaries_enabled:
+        # 概要在后台按需重新生成，这里先用已有的（可能稍旧的）概要
+        summary_service.ensure_fresh(novel_id)
+    # 未开启自动刷新时使用 summarize_novel 任务生成的概要（没有则为空）
+    story_so_far = summary_service.story_so_far(db, novel_id)
     return {
         "novel_title": novel.title,
         "novel_summary": (novel.summary or "").strip(),
+        "story_so_far": story_so_far,
         "previous_text": text,
         "character_summary": character_summary,
     }
+
+
+def get_context_for_novel(
+    db: Session, novel_id: int, max_chars: int = 6000, query: str | None = None, retrieve: bool = True
+) -> dict[str, str]:
+    """带缓存的 build_context_for_novel，缓存键包含小说修订号，写操作后自动失效。retrieve=False 时不检索相关段落。"""
+    key = (novel_id, novel_revisions.get(novel_id), max_chars)
+    cached = _context_cache.get(key)
+    if cached is None:
+        cached = _load_novel_context(db, novel_id, max_chars)
+        if not cached:
+            return {}
+        _context_cache.set(key, cached)
+    if not retrieve:
+        return dict(cached)
+    return _with_related_passages(db, novel_id, dict(cached), query)
@@ -1,4 +1,4 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, inspect, select, text, update
 from sqlalchemy.orm import DeclarativeBase, sessionmaker
 
 from .config import load_config
@@ -17,3 +17,40 @@ def init_db() -> None:
     from . import models
 
     Base.metadata.create_all(bind=engine)
+    _add_missing_columns()
+    _backfill_version_hashes(models.ChapterVersion)
+
+
+def _add_missing_columns() -> None:
+    """create_all 不会修改已有的表：给旧库补上模型中新增的可空列。"""
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing or not column.nullable:
+                    continue
+                column_type = column.type.compile(dialect=engine.dialect)
+                conn.execute(text(f'ALTER TABLE "{table.name}" ADD COLUMN "{column.name}" {column_type}'))
+
+
+def _backfill_version_hashes(version_model, batch_size: int = 200) -> None:
+    """旧库中的章节版本没有 content_hash：启动时分批补算，读接口只读取已存的值。"""
+    from .utils.hashing import content_hash
+
+    with SessionLocal() as db:
+        while True:
+            rows = db.execute(
+                select(version_model.id, version_model.content)
+                .where(version_model.content_hash.is_(None))
+                .limit(batch_size)
+            ).all()
+            if not rows:
+                break
+            for version_id, content in rows:
+                db.execute(
+                    update(version_model).where(version_model.id == version_id).values(content_hash=content_hash(content))
+                )
+            db.commit()
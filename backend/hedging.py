@@ -0,0 +1,166 @@
+from __future__ import annotations
+
+import math
+import queue
+import time
+from collections import deque
+from threading import Lock, Thread
+from typing import Callable, Iterable, Iterator
+
+from .utils.streams import CancelToken
+
+
+PRIMARY = "primary"
+BACKUP = "backup"
+
+
+class LatencyTracker:
+    """按 provider/模型记录最近的首字延迟，用于推算对冲等待时间。"""
+
+    def __init__(self, window: int = 200, min_samples: int = 20) -> None:
+        self._window = window
+        self._min_samples = min_samples
+        self._lock = Lock()
+        self._samples: dict[str, deque[float]] = {}
+
+    def record(self, key: str, seconds: float) -> None:
+        with self._lock:
+            self._samples.setdefault(key, deque(maxlen=self._window)).append(seconds)
+
+    def percentile(self, key: str, pct: float) -> float | None:
+        with self._lock:
+            samples = sorted(self._samples.get(key, ()))
+        if len(samples) < self._min_samples:
+            return None
+        index = min(len(samples) - 1, max(0, math.ceil(pct * len(samples)) - 1))
+        return samples[index]
+
+
+class HedgedStreamer:
+    """主请求在等待时间内没有产出首个文本块时，向备用 provider/模型发起第二个请求，
+    谁先产出首块就采用谁，另一个立即取消（关闭其上游连接、归还并发名额）。"""
+
+    def __init__(self, default_delay: float, min_delay: float, max_delay: float, percentile: float = 0.95) -> None:
+        self._default_delay = default_delay
+        self._min_delay = min_delay
+        self._max_delay = max_delay
+        self._percentile = percentile
+        self.latency = LatencyTracker()
+        self._lock = Lock()
+        self._counters = {"requests": 0, "fired": 0, "primary_wins": 0, "backup_wins": 0, "failed": 0}
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self._counters[name] += 1
+
+    def delay_for(self, key: str, override: float | None = None) -> float:
+        if override is not None:
+            return max(0.0, override)
+        p95 = self.latency.percentile(key, self._percentile)
+        if p95 is None:
+            return self._default_delay
+        return min(self._max_delay, max(self._min_delay, p95))
+
+    def _pump(
+        self,
+        side: str,
+        key: str,
+        factory: Callable[[CancelToken], Iterable[str]],
+        events: queue.Queue,
+        cancel: CancelToken,
+    ) -> None:
+        started = time.monotonic()
+        first = True
+        source = None
+        try:
+            source = iter(factory(cancel))
+            for chunk in source:
+                if first:
+                    self.latency.record(key, time.monotonic() - started)
+                    first = False
+                if cancel.cancelled:
+                    break
+                events.put((side, "chunk", chunk))
+            events.put((side, "done", None))
+        except Exception as e:
+            events.put((side, "error", e))
+        finally:
+            close = getattr(source, "close", None)
+            if close is not None:
+                close()
+
+    def stream(
+        self,
+        primary_key: str,
+        primary: Callable[[CancelToken], Iterable[str]],
+        backup_key: str,
+        backup: Callable[[CancelToken], Iterable[str]],
+        delay: float | None = None,
+        cancel: CancelToken | None = None,
+    ) -> Iterator[str]:
+        """factory 接收各自独立的 CancelToken（随 cancel 一起取消），落败的一方单独取消。"""
+        self._count("requests")
+        events: queue.Queue = queue.Queue()
+        tokens = {PRIMARY: CancelToken(), BACKUP: CancelToken()}
+        unlinks = [cancel.on_cancel(token.cancel) for token in tokens.values()] if cancel is not None else []
+        sources = {PRIMARY: (primary_key, primary), BACKUP: (backup_key, backup)}
+        running: set[str] = set()
+
+        def start(side: str) -> None:
+            key, factory = sources[side]
+            running.add(side)
+            Thread(target=self._pump, args=(side, key, factory, events, tokens[side]), daemon=True).start()
+
+        start(PRIMARY)
+        deadline = time.monotonic() + self.delay_for(primary_key, delay)
+        backup_started = False
+        winner: str | None = None
+        errors: dict[str, BaseException] = {}
+        try:
+            while winner is None:
+                timeout = None if backup_started else max(0.0, deadline - time.monotonic())
+                try:
+                    side, kind, value = events.get(timeout=timeout)
+                except queue.Empty:
+                    side, kind, value = PRIMARY, "timeout", None
+                if kind == "error":
+                    errors[side] = value
+                    running.discard(side)
+                    if running:
+                        continue
+                if kind in ("timeout", "error") and not backup_started:
+                    # 主请求超时未出首块，或在出首块前失败：启动备用请求
+                    backup_started = True
+                    self._count("fired")
+                    start(BACKUP)
+                    continue
+                if kind == "error":
+                    self._count("failed")
+                    raise errors.get(PRIMARY) or value
+                winner = side
+                self._count("primary_wins" if side == PRIMARY else "backup_wins")
+                for other in running - {side}:
+                    tokens[other].cancel()
+                if kind == "done":
+                    return
+                yield value
+
+            while True:
+                side, kind, value = events.get()
+                if side != winner:
+                    continue
+                if kind == "chunk":
+                    yield value
+                elif kind == "error":
+                    raise value
+                else:
+                    return
+        finally:
+            for unlink in unlinks:
+                unlink()
+            for token in tokens.values():
+                token.cancel()
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            return dict(self._counters)
@@ -0,0 +1,238 @@
+from __future__ import annotations
+
+import json
+import re
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+
+from sqlalchemy import select
+
+from .config import load_config
+from .database import SessionLocal
+from .jobs import JobCancelled, JobContext, PermanentJobError, job_queue
+from .models import Chapter, ChapterBatchResult, ChapterVersion, Character, Novel
+from .novel_ai import AIRequest, ai_service
+from .revisions import bump_novel_revision
+from .stats import record_change
+from .summaries import summary_service
+from .utils.hashing import content_hash
+
+config = load_config()
+
+MAX_GENERATED_CHARACTERS = 20
+MAX_BATCH_PARALLELISM = 8
+BATCH_MODES = {"polish": "润色", "rewrite": "改写", "mimic": "仿写"}
+_NAME_RE = re.compile(r"姓名\s*[:：]\s*\**\s*([^\s*，,。（(]{1,20})")
+
+
+def _require_novel(novel_id: int | None) -> Novel:
+    if novel_id is None:
+        raise PermanentJobError("缺少 novel_id")
+    with SessionLocal() as db:
+        novel = db.get(Novel, novel_id)
+        if novel is None:
+            raise PermanentJobError("小说不存在")
+        db.expunge(novel)
+    return novel
+
+
+def summarize_novel(ctx: JobContext) -> dict:
+    """为整部小说生成章节概要与分卷概要；已生成且内容未变的章节按哈希跳过，重试或重启后自然从断点继续。"""
+    _require_novel(ctx.novel_id)
+
+    def on_progress(done: int, total: int) -> None:
+        ctx.progress(done, total)
+        ctx.check_cancelled()
+
+    changed = summary_service.refresh_novel(ctx.novel_id, on_progress)
+    if changed:
+        bump_novel_revision(ctx.novel_id)
+    return {"changed": changed}
+
+
+def generate_characters(ctx: JobContext) -> dict:
+    """按关键词批量生成人物档案，每生成一个保存一次断点；save 为 true 时结束后写入小说的人物列表。"""
+    payload = ctx.payload
+    count = payload.get("count", 5)
+    if not isinstance(count, int) or not 1 <= count <= MAX_GENERATED_CHARACTERS:
+        raise PermanentJobError(f"count 需在 1 到 {MAX_GENERATED_CHARACTERS} 之间")
+    keywords = payload.get("keywords") if isinstance(payload.get("keywords"), list) else []
+    context: dict = {"keywords": keywords}
+    novel = _require_novel(ctx.novel_id) if ctx.novel_id is not None else None
+    if novel is not None:
+        context.update(novel_title=novel.title, novel_summary=novel.summary or "")
+
+    results: list[str] = list(ctx.checkpoint.get("results", []))
+    while len(results) < count:
+        ctx.check_cancelled()
+        request = AIRequest(
+            mode="character",
+            context=context,
+            stream=False,
+            provider=payload.get("provider"),
+            model=payload.get("model"),
+            # 相同提示词需要得到不同的人物，不走结果缓存
+            use_cache=False,
+            priority="background",
+        )
+        results.append(ai_service.generate(request).strip())
+        ctx.save_checkpoint({"results": results}, done=len(results), total=count)
+
+    saved: list[int] = []
+    if payload.get("save") and novel is not None and not ctx.checkpoint.get("saved"):
+        with SessionLocal() as db:
+            characters = []
+            for index, profile in enumerate(results):
+                match = _NAME_RE.search(profile)
+                name = match.group(1) if match else f"新角色{index + 1}"
+                characters.append(Character(novel_id=novel.id, name=name, profile=profile))
+            db.add_all(characters)
+            record_change(db, novel.id, characters=len(characters))
+            db.commit()
+            saved = [c.id for c in characters]
+        ctx.save_checkpoint({"results": results, "saved": saved}, done=count, total=count)
+        bump_novel_revision(novel.id)
+    return {"characters": results, "saved_character_ids": saved or ctx.checkpoint.get("saved", [])}
+
+
+def _batch_settings(payload: dict) -> tuple[str, dict]:
+    mode = payload.get("mode", "polish")
+    if mode not in BATCH_MODES:
+        raise PermanentJobError(f"mode 需为以下之一：{'、'.join(BATCH_MODES)}")
+    if mode == "mimic" and not payload.get("style"):
+        raise PermanentJobError("仿写需要指定 style")
+    settings = {key: payload.get(key) for key in ("style", "provider", "model", "temperature")}
+    settings["mode"] = mode
+    return content_hash(json.dumps(settings, sort_keys=True, ensure_ascii=False)), settings
+
+
+def batch_polish(ctx: JobContext) -> dict:
+    """对整部小说逐章润色/改写/仿写，结果写成新的章节版本，不覆盖正文。
+    每章完成即记录原文哈希，重试、重启或再次提交同样设置的任务时跳过原文未变的章节。"""
+    payload = ctx.payload
+    settings_hash, settings = _batch_settings(payload)
+    parallelism = payload.get("parallelism", config.batch_parallelism)
+    if not isinstance(parallelism, int) or not 1 <= parallelism <= MAX_BATCH_PARALLELISM:
+        raise PermanentJobError(f"parallelism 需在 1 到 {MAX_BATCH_PARALLELISM} 之间")
+    novel = _require_novel(ctx.novel_id)
+    label = BATCH_MODES[settings["mode"]]
+    # 同时发出的模型调用（章节数 × 每章分块并发）不超过 provider 的并发上限，多余的在本地等待，
+    # 不去占用调度器的排队名额，以免交互请求被 QUEUE_FULL 拒绝
+    lane_limit = ai_service.lane_limit(AIRequest(mode=settings["mode"], context={}, provider=settings["provider"]))
+    if lane_limit > 0:
+        parallelism = min(parallelism, lane_limit)
+    chunk_parallelism = max(1, lane_limit // parallelism) if lane_limit > 0 else None
+
+    query = (
+        select(Chapter.id, Chapter.content)
+        .where(Chapter.novel_id == novel.id)
+        .order_by(Chapter.order_index.asc())
+    )
+    if isinstance(payload.get("chapter_ids"), list):
+        query = query.where(Chapter.id.in_(payload["chapter_ids"]))
+    with SessionLocal() as db:
+        processed = dict(
+            db.execute(
+                select(ChapterBatchResult.chapter_id, ChapterBatchResult.source_hash)
+                .join(Chapter)
+                .where(Chapter.novel_id == novel.id, ChapterBatchResult.settings_hash == settings_hash)
+            ).all()
+        )
+        pending: list[tuple[int, int]] = []
+        total = 0
+        for chapter_id, content in db.execute(query):
+            total += 1
+            if content and content.strip() and processed.get(chapter_id) != content_hash(content):
+                pending.append((chapter_id, len(content)))
+
+    def process(chapter_id: int) -> int:
+        with SessionLocal() as db:
+            content = db.scalar(select(Chapter.content).where(Chapter.id == chapter_id))
+        if not content or not content.strip():
+            return 0
+        request = AIRequest(
+            mode=settings["mode"],
+            context={"target_text": content, "style": settings["style"] or "normal"},
+            stream=False,
+            provider=settings["provider"],
+            model=settings["model"],
+            temperature=settings["temperature"],
+            use_cache=False,
+            novel_id=novel.id,
+            priority="background",
+            hedge=False,
+            chunked=payload.get("chunked"),
+            max_parallelism=chunk_parallelism,
+        )
+        output = ai_service.generate(request).strip()
+        if not output:
+            raise RuntimeError("模型没有返回内容")
+        with SessionLocal() as db:
+            version = ChapterVersion(chapter_id=chapter_id, content=output, note=f"批量{label}（任务 #{ctx.job_id}）")
+            db.add(version)
+            db.flush()
+            record = db.scalar(
+                select(ChapterBatchResult).where(
+                    ChapterBatchResult.chapter_id == chapter_id,
+                    ChapterBatchResult.settings_hash == settings_hash,
+                )
+            ) or ChapterBatchResult(chapter_id=chapter_id, settings_hash=settings_hash)
+            record.source_hash = content_hash(content)
+            record.version_id = version.id
+            record.job_id = ctx.job_id
+            db.add(record)
+            db.commit()
+        return len(content)
+
+    skipped = total - len(pending)
+    remaining_chars = sum(length for _, length in pending)
+    metrics = {"chapters_total": total, "chapters_skipped": skipped, "chapters_done": 0, "chars_done": 0}
+    errors: dict[int, str] = {}
+    started = time.monotonic()
+
+    def report() -> None:
+        elapsed = time.monotonic() - started
+        rate = metrics["chars_done"] / elapsed if elapsed > 0 else 0.0
+        metrics["chars_per_second"] = round(rate, 1)
+        metrics["chapters_per_minute"] = round(metrics["chapters_done"] / elapsed * 60, 2) if elapsed > 0 else 0.0
+        metrics["eta_seconds"] = round(remaining_chars / rate) if rate else None
+        metrics["failed"] = len(errors)
+        ctx.save_checkpoint(
+            {"metrics": metrics},
+            done=skipped + metrics["chapters_done"] + len(errors),
+            total=total,
+        )
+
+    report()
+    queue = list(pending)
+    with ThreadPoolExecutor(max_workers=parallelism, thread_name_prefix="batch-polish") as pool:
+        running: dict[Future, tuple[int, int]] = {}
+        while queue or running:
+            # 保持最多 parallelism 章在处理中，取消后不再提交新章节，等已开始的章节写完
+            while queue and len(running) < parallelism and not ctx.cancelled:
+                item = queue.pop(0)
+                running[pool.submit(process, item[0])] = item
+            if not running:
+                break
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                chapter_id, length = running.pop(future)
+                remaining_chars -= length
+                try:
+                    metrics["chars_done"] += future.result()
+                    metrics["chapters_done"] += 1
+                except Exception as e:
+                    print(f"Batch {label} failed for chapter {chapter_id}: {e}")
+                    errors[chapter_id] = str(e)
+            report()
+    if ctx.cancelled:
+        raise JobCancelled()
+    if errors:
+        # 已完成的章节有记录，重试时只处理失败的章节
+        raise RuntimeError(f"{len(errors)} 章处理失败：{next(iter(errors.values()))}")
+    return {key: metrics[key] for key in ("chapters_total", "chapters_skipped", "chapters_done", "chars_done")}
+
+
+job_queue.register("summarize_novel", summarize_novel)
+job_queue.register("generate_characters", generate_characters)
+job_queue.register("batch_polish", batch_polish)
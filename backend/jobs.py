@@ -0,0 +1,347 @@
+from __future__ import annotations
+
+import json
+import os
+import socket
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from threading import Event, Lock, Thread
+from typing import Callable
+
+from sqlalchemy import func, select, update
+
+from .config import load_config
+from .database import SessionLocal
+from .models import Job
+from .utils.streams import CancelToken
+
+config = load_config()
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED = frozenset({SUCCEEDED, FAILED, CANCELLED})
+
+MAX_BACKOFF_SECONDS = 600
+
+
+class JobCancelled(Exception):
+    """任务被请求取消，处理函数在检查点处抛出以提前结束。"""
+
+
+class PermanentJobError(Exception):
+    """不值得重试的错误（如参数错误、数据已不存在），直接标记失败。"""
+
+
+class JobContext:
+    """传给任务处理函数的执行上下文：读取参数与断点，报告进度并保存断点。"""
+
+    def __init__(self, queue: JobQueue, job: Job, worker_id: str) -> None:
+        self._queue = queue
+        self.job_id = job.id
+        self.novel_id = job.novel_id
+        self.attempt = job.attempts
+        self.payload: dict = json.loads(job.payload or "{}")
+        self.checkpoint: dict = json.loads(job.checkpoint) if job.checkpoint else {}
+        self._worker_id = worker_id
+        # 心跳发现取消请求时触发，处理函数可传给流式生成以立即中止上游
+        self.cancel_token = CancelToken()
+
+    @property
+    def cancelled(self) -> bool:
+        return self.cancel_token.cancelled
+
+    def check_cancelled(self) -> None:
+        if self.cancelled:
+            raise JobCancelled()
+
+    def progress(self, done: int, total: int | None = None) -> None:
+        if self._queue._touch(self.job_id, self._worker_id, progress_done=done, progress_total=total):
+            self.cancel_token.cancel()
+
+    def save_checkpoint(self, checkpoint: dict, done: int | None = None, total: int | None = None) -> None:
+        """保存断点（需可 JSON 序列化）；进程重启或重试时处理函数从 ctx.checkpoint 继续。"""
+        self.checkpoint = checkpoint
+        requested = self._queue._touch(
+            self.job_id,
+            self._worker_id,
+            checkpoint=json.dumps(checkpoint, ensure_ascii=False),
+            progress_done=done,
+            progress_total=total,
+        )
+        if requested:
+            self.cancel_token.cancel()
+
+
+@dataclass(frozen=True)
+class JobType:
+    name: str
+    handler: Callable[[JobContext], object]
+    workers: int = 1
+    max_attempts: int = 3
+
+
+class JobQueue:
+    """基于 SQLite 表的持久化任务队列。认领通过条件更新完成，多个进程共用同一数据库也不会重复执行；
+    执行中的任务定期写心跳，超过租期没有心跳的任务视为执行者已退出，重新排队并从断点继续。"""
+
+    def __init__(
+        self,
+        worker_counts: dict[str, int],
+        poll_seconds: float,
+        lease_seconds: float,
+        backoff_seconds: float,
+    ) -> None:
+        self._worker_counts = worker_counts
+        self._poll = max(0.05, poll_seconds)
+        self._lease = max(1.0, lease_seconds)
+        self._backoff = max(0.0, backoff_seconds)
+        self._types: dict[str, JobType] = {}
+        self._wakeups: dict[str, Event] = {}
+        self._lock = Lock()
+        self._started = False
+        self._stopping = Event()
+        self._threads: list[Thread] = []
+        self._node = f"{socket.gethostname()}:{os.getpid()}"
+
+    def register(
+        self,
+        name: str,
+        handler: Callable[[JobContext], object],
+        workers: int = 1,
+        max_attempts: int = 3,
+    ) -> None:
+        """注册任务类型；工作线程数可用配置 JOB_WORKERS 按类型覆盖。"""
+        workers = self._worker_counts.get(name, workers)
+        self._types[name] = JobType(name, handler, max(0, workers), max(1, max_attempts))
+        self._wakeups[name] = Event()
+
+    @property
+    def types(self) -> list[str]:
+        return list(self._types)
+
+    def enqueue(self, job_type: str, payload: dict, novel_id: int | None = None) -> int:
+        if job_type not in self._types:
+            raise ValueError(f"未知的任务类型：{job_type}")
+        with SessionLocal() as db:
+            job = Job(
+                job_type=job_type,
+                novel_id=novel_id,
+                payload=json.dumps(payload, ensure_ascii=False),
+                max_attempts=self._types[job_type].max_attempts,
+            )
+            db.add(job)
+            db.commit()
+            job_id = job.id
+        self._wakeups[job_type].set()
+        return job_id
+
+    def cancel(self, job_id: int) -> bool:
+        """排队中的任务直接取消；执行中的任务标记取消请求，由心跳通知处理函数。"""
+        with SessionLocal() as db:
+            cancelled = db.execute(
+                update(Job)
+                .where(Job.id == job_id, Job.status == QUEUED)
+                .values(status=CANCELLED, finished_at=datetime.utcnow())
+            ).rowcount
+            if not cancelled:
+                cancelled = db.execute(
+                    update(Job).where(Job.id == job_id, Job.status == RUNNING).values(cancel_requested=1)
+                ).rowcount
+            db.commit()
+        return bool(cancelled)
+
+    def start(self) -> None:
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        self.recover_stale()
+        for job_type in self._types.values():
+            for index in range(job_type.workers):
+                thread = Thread(
+                    target=self._work,
+                    args=(job_type, f"{self._node}:{job_type.name}:{index}"),
+                    name=f"job-{job_type.name}-{index}",
+                    daemon=True,
+                )
+                thread.start()
+                self._threads.append(thread)
+
+    def stop(self, timeout: float | None = None) -> None:
+        self._stopping.set()
+        for wakeup in self._wakeups.values():
+            wakeup.set()
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def recover_stale(self) -> int:
+        """把心跳超过租期的执行中任务放回队列（保留断点）。"""
+        expired = datetime.utcnow() - timedelta(seconds=self._lease)
+        with SessionLocal() as db:
+            count = db.execute(
+                update(Job)
+                .where(Job.status == RUNNING, Job.heartbeat_at < expired)
+                .values(status=QUEUED, locked_by=None, run_after=datetime.utcnow())
+            ).rowcount
+            db.commit()
+        if count:
+            print(f"Requeued {count} stale jobs")
+        return count
+
+    def _claim(self, job_type: str, worker_id: str) -> Job | None:
+        now = datetime.utcnow()
+        with SessionLocal() as db:
+            candidates = db.scalars(
+                select(Job.id)
+                .where(Job.job_type == job_type, Job.status == QUEUED, Job.run_after <= now)
+                .order_by(Job.run_after, Job.id)
+                .limit(5)
+            ).all()
+            for job_id in candidates:
+                # 条件更新：只有仍处于 queued 的任务才会被本线程认领
+                claimed = db.execute(
+                    update(Job)
+                    .where(Job.id == job_id, Job.status == QUEUED)
+                    .values(
+                        status=RUNNING,
+                        locked_by=worker_id,
+                        heartbeat_at=now,
+                        started_at=func.coalesce(Job.started_at, now),
+                        attempts=Job.attempts + 1,
+                    )
+                ).rowcount
+                db.commit()
+                if claimed:
+                    return db.get(Job, job_id)
+        return None
+
+    def _touch(self, job_id: int, worker_id: str, **values) -> bool:
+        """写心跳（及进度、断点），返回是否收到了取消请求。"""
+        values = {k: v for k, v in values.items() if v is not None}
+        with SessionLocal() as db:
+            db.execute(
+                update(Job)
+                .where(Job.id == job_id, Job.locked_by == worker_id)
+                .values(heartbeat_at=datetime.utcnow(), **values)
+            )
+            db.commit()
+            return bool(db.scalar(select(Job.cancel_requested).where(Job.id == job_id)))
+
+    def _heartbeat(self, ctx: JobContext, worker_id: str, done: Event) -> None:
+        while not done.wait(self._lease / 3):
+            try:
+                if self._touch(ctx.job_id, worker_id):
+                    ctx.cancel_token.cancel()
+            except Exception as e:
+                print(f"Job heartbeat failed: {e}")
+
+    def _finish(self, job_id: int, worker_id: str, **values) -> None:
+        with SessionLocal() as db:
+            db.execute(
+                update(Job).where(Job.id == job_id, Job.locked_by == worker_id).values(locked_by=None, **values)
+            )
+            db.commit()
+
+    def _backoff_seconds(self, attempts: int) -> float:
+        return min(MAX_BACKOFF_SECONDS, self._backoff * 2 ** max(0, attempts - 1))
+
+    def _run(self, job_type: JobType, job: Job, worker_id: str) -> None:
+        ctx = JobContext(self, job, worker_id)
+        if job.cancel_requested:
+            ctx.cancel_token.cancel()
+        done = Event()
+        Thread(target=self._heartbeat, args=(ctx, worker_id, done), name="job-heartbeat", daemon=True).start()
+        try:
+            result = job_type.handler(ctx)
+            if ctx.cancelled:
+                raise JobCancelled()
+        except JobCancelled:
+            self._finish(job.id, worker_id, status=CANCELLED, finished_at=datetime.utcnow())
+        except Exception as e:
+            print(f"Job {job.id} ({job_type.name}) failed on attempt {job.attempts}: {e}")
+            if isinstance(e, PermanentJobError) or job.attempts >= job.max_attempts:
+                self._finish(job.id, worker_id, status=FAILED, error=str(e), finished_at=datetime.utcnow())
+            else:
+                retry_at = datetime.utcnow() + timedelta(seconds=self._backoff_seconds(job.attempts))
+                self._finish(job.id, worker_id, status=QUEUED, error=str(e), run_after=retry_at)
+        else:
+            self._finish(
+                job.id,
+                worker_id,
+                status=SUCCEEDED,
+                result=json.dumps(result, ensure_ascii=False),
+                error=None,
+                finished_at=datetime.utcnow(),
+            )
+        finally:
+            done.set()
+
+    def _work(self, job_type: JobType, worker_id: str) -> None:
+        wakeup = self._wakeups[job_type.name]
+        last_recovery = time.monotonic()
+        while not self._stopping.is_set():
+            try:
+                if time.monotonic() - last_recovery >= self._lease:
+                    self.recover_stale()
+                    last_recovery = time.monotonic()
+                job = self._claim(job_type.name, worker_id)
+            except Exception as e:
+                print(f"Failed to claim {job_type.name} job: {e}")
+                job = None
+            if job is None:
+                wakeup.wait(self._poll)
+                wakeup.clear()
+                continue
+            try:
+                self._run(job_type, job, worker_id)
+            except Exception as e:
+                # 写回结果失败时任务保持 running，租期过后会被重新排队
+                print(f"Failed to record result of job {job.id}: {e}")
+
+    def stats(self) -> dict[str, object]:
+        with SessionLocal() as db:
+            rows = db.execute(select(Job.job_type, Job.status, func.count()).group_by(Job.job_type, Job.status)).all()
+        counts: dict[str, dict[str, int]] = {}
+        for job_type, status, count in rows:
+            counts.setdefault(job_type, {})[status] = count
+        return {
+            "workers": {t.name: t.workers for t in self._types.values()},
+            "jobs": counts,
+        }
+
+
+def job_to_dict(job: Job, include_result: bool = False) -> dict[str, object]:
+    data: dict[str, object] = {
+        "id": job.id,
+        "type": job.job_type,
+        "status": job.status,
+        "novel_id": job.novel_id,
+        "progress": {"done": job.progress_done, "total": job.progress_total},
+        "attempts": job.attempts,
+        "max_attempts": job.max_attempts,
+        "error": job.error,
+        "created_at": job.created_at.isoformat(),
+        "started_at": job.started_at.isoformat() if job.started_at else None,
+        "finished_at": job.finished_at.isoformat() if job.finished_at else None,
+    }
+    if job.status == QUEUED and job.attempts:
+        data["retry_at"] = job.run_after.isoformat()
+    checkpoint = json.loads(job.checkpoint) if job.checkpoint else {}
+    if "metrics" in checkpoint:
+        # 处理函数写在断点里的吞吐与预计剩余时间
+        data["metrics"] = checkpoint["metrics"]
+    if include_result:
+        data["result"] = json.loads(job.result) if job.result else None
+    return data
+
+
+job_queue = JobQueue(
+    worker_counts=config.job_workers,
+    poll_seconds=config.job_poll_seconds,
+    lease_seconds=config.job_lease_seconds,
+    backoff_seconds=config.job_retry_backoff_seconds,
+)
@@ -0,0 +1,213 @@
+from __future__ import annotations
+
+import re
+import time
+from dataclasses import dataclass, replace
+from threading import Lock, Thread
+from typing import Callable
+
+from .ai_providers import OllamaProvider
+from .context_budget import register_context_window
+
+
+_NUM_CTX_RE = re.compile(r"^\s*num_ctx\s+(\d+)", re.MULTILINE)
+
+
+@dataclass(frozen=True)
+class ModelInfo:
+    name: str
+    size: int | None = None
+    family: str | None = None
+    parameter_size: str | None = None
+    quantization_level: str | None = None
+    context_length: int | None = None
+    loaded: bool = False
+    modified_at: str | None = None
+
+    def to_dict(self) -> dict[str, object]:
+        return {
+            "name": self.name,
+            "size": self.size,
+            "family": self.family,
+            "parameter_size": self.parameter_size,
+            "quantization_level": self.quantization_level,
+            "context_length": self.context_length,
+            "loaded": self.loaded,
+            "modified_at": self.modified_at,
+        }
+
+
+def _context_length(show: dict) -> int | None:
+    # Modelfile 里显式设置的 num_ctx 才是实际生效的窗口，其次取模型训练时的上下文长度
+    parameters = show.get("parameters")
+    if isinstance(parameters, str):
+        match = _NUM_CTX_RE.search(parameters)
+        if match:
+            return int(match.group(1))
+    model_info = show.get("model_info")
+    if isinstance(model_info, dict):
+        for key, value in model_info.items():
+            if key.endswith(".context_length") and isinstance(value, int):
+                return value
+    return None
+
+
+class ModelCatalog:
+    """Ollama 模型目录的进程内缓存：过期后先返回旧数据并在后台刷新（stale-while-revalidate），
+    只有首次查询或显式刷新时才同步等待上游。刷新只查询 /api/tags 与 /api/ps，
+    需要上下文长度等详情时才逐个查询 /api/show。"""
+
+    def __init__(
+        self,
+        sources: Callable[[], list[OllamaProvider]],
+        ttl_seconds: float = 60,
+        error_ttl_seconds: float = 10,
+    ) -> None:
+        self._sources = sources
+        self._ttl = max(0.0, ttl_seconds)
+        self._error_ttl = max(0.0, min(error_ttl_seconds, self._ttl))
+        self._lock = Lock()
+        self._refresh_lock = Lock()
+        self._models: list[ModelInfo] | None = None
+        self._fetched_at = 0.0
+        self._expires_at = 0.0
+        self._refreshing = False
+        self._last_error: str | None = None
+        # (模型名, digest) -> 上下文长度；同一 digest 的元数据不会变化，无需重复查询 /api/show
+        self._context_lengths: dict[tuple[str, str], int | None] = {}
+        # 模型名 -> (所在节点, digest)，供按需查询详情
+        self._origins: dict[str, tuple[OllamaProvider, str]] = {}
+        self._detail_lock = Lock()
+
+    def get(self, refresh: bool = False, detail: bool = False) -> list[ModelInfo]:
+        models = self._get(refresh)
+        return self._with_details(models) if detail else models
+
+    def _get(self, refresh: bool) -> list[ModelInfo]:
+        with self._lock:
+            models = self._models
+            stale = time.monotonic() >= self._expires_at
+            start_background = models is not None and stale and not refresh and not self._refreshing
+            if start_background:
+                self._refreshing = True
+        if models is None or refresh:
+            return self.refresh()
+        if start_background:
+            Thread(target=self._background_refresh, name="model-catalog", daemon=True).start()
+        return models
+
+    def names(self, refresh: bool = False) -> list[str]:
+        return [m.name for m in self.get(refresh)]
+
+    def _background_refresh(self) -> None:
+        try:
+            self.refresh()
+        finally:
+            with self._lock:
+                self._refreshing = False
+
+    def refresh(self) -> list[ModelInfo]:
+        # 并发的同步刷新只发起一次上游查询，其余调用等待并复用结果
+        with self._refresh_lock:
+            started = time.monotonic()
+            with self._lock:
+                if self._models is not None and self._fetched_at >= started:
+                    return self._models
+            try:
+                models = self._fetch()
+            except Exception as e:
+                print(f"Failed to refresh Ollama model catalog: {e}")
+                with self._lock:
+                    self._last_error = str(e)
+                    if self._models is None:
+                        self._models = []
+                    self._fetched_at = time.monotonic()
+                    self._expires_at = time.monotonic() + self._error_ttl
+                    return self._models
+            with self._lock:
+                self._models = models
+                self._last_error = None
+                self._fetched_at = time.monotonic()
+                self._expires_at = time.monotonic() + self._ttl
+            return models
+
+    def _fetch(self) -> list[ModelInfo]:
+        sources = self._sources()
+        if not sources:
+            raise RuntimeError("没有可用的 Ollama 节点")
+        entries: dict[str, tuple[OllamaProvider, dict]] = {}
+        loaded: set[str] = set()
+        errors: list[Exception] = []
+        for provider in sources:
+            try:
+                for entry in provider.list_model_details():
+                    entries.setdefault(entry["name"], (provider, entry))
+                loaded.update(provider.list_loaded_models())
+            except Exception as e:
+                errors.append(e)
+        if len(errors) == len(sources):
+            raise errors[0]
+
+        models = []
+        origins: dict[str, tuple[OllamaProvider, str]] = {}
+        for name, (provider, entry) in entries.items():
+            details = entry.get("details") if isinstance(entry.get("details"), dict) else {}
+            digest = str(entry.get("digest", ""))
+            origins[name] = (provider, digest)
+            models.append(
+                ModelInfo(
+                    name=name,
+                    size=entry.get("size") if isinstance(entry.get("size"), int) else None,
+                    family=details.get("family"),
+                    parameter_size=details.get("parameter_size"),
+                    quantization_level=details.get("quantization_level"),
+                    context_length=self._context_lengths.get((name, digest)),
+                    loaded=name in loaded,
+                    modified_at=entry.get("modified_at"),
+                )
+            )
+        # 已加载到内存的模型排在前面，便于界面优先选用
+        models.sort(key=lambda m: not m.loaded)
+        with self._lock:
+            self._origins = origins
+        return models
+
+    def _with_details(self, models: list[ModelInfo]) -> list[ModelInfo]:
+        """补全尚未查询过的上下文长度；某个节点查询失败后不再向它发请求，本次先返回已有数据。"""
+        with self._lock:
+            origins = dict(self._origins)
+        failed: set[str] = set()
+        detailed = []
+        with self._detail_lock:
+            for model in models:
+                origin = origins.get(model.name)
+                if model.context_length is None and origin is not None and origin[0].base_url not in failed:
+                    provider, digest = origin
+                    try:
+                        model = replace(model, context_length=self._lookup_context_length(provider, model.name, digest))
+                    except Exception as e:
+                        # 不缓存失败结果，下次查询详情时重试
+                        print(f"Failed to read metadata of {model.name}: {e}")
+                        failed.add(provider.base_url)
+                detailed.append(model)
+        return detailed
+
+    def _lookup_context_length(self, provider: OllamaProvider, name: str, digest: str) -> int | None:
+        key = (name, digest)
+        if key not in self._context_lengths:
+            self._context_lengths[key] = _context_length(provider.show_model(name))
+            context_length = self._context_lengths[key]
+            if context_length:
+                register_context_window(name, context_length)
+                if name.endswith(":latest"):
+                    register_context_window(name[: -len(":latest")], context_length)
+        return self._context_lengths[key]
+
+    def stats(self) -> dict[str, object]:
+        with self._lock:
+            return {
+                "models": len(self._models or []),
+                "stale": time.monotonic() >= self._expires_at,
+                "refreshing": self._refreshing,
+                "last_error": self._last_error,
+            }
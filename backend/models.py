@@ -6,6 +6,7 @@ from sqlalchemy import DateTime, ForeignKey, Integer, String, Text, UniqueConstr
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 
 from .database import Base
+from .utils.hashing import content_hash
 
 
 class User(Base):
@@ -35,6 +36,7 @@ class Novel(Base):
     chapters: Mapped[list[Chapter]] = relationship(back_populates="novel", cascade="all, delete-orphan")
     characters: Mapped[list[Character]] = relationship(back_populates="novel", cascade="all, delete-orphan")
     ideas: Mapped[list[Idea]] = relationship(back_populates="novel", cascade="all, delete-orphan")
+    arc_summaries: Mapped[list[ArcSummary]] = relationship(back_populates="novel", cascade="all, delete-orphan")
 
 
 class Chapter(Base):
@@ -51,6 +53,10 @@ class Chapter(Base):
 
     novel: Mapped[Novel] = relationship(back_populates="chapters")
     versions: Mapped[list[ChapterVersion]] = relationship(back_populates="chapter", cascade="all, delete-orphan")
+    summary: Mapped[ChapterSummary | None] = relationship(back_populates="chapter", cascade="all, delete-orphan")
+    batch_results: Mapped[list[ChapterBatchResult]] = relationship(
+        back_populates="chapter", cascade="all, delete-orphan"
+    )
 
 
 class ChapterVersion(Base):
@@ -61,10 +67,57 @@ class ChapterVersion(Base):
     content: Mapped[str] = mapped_column(Text, default="")
     note: Mapped[str | None] = mapped_column(String(200), default=None)
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    # 插入时按正文计算，列出版本时无需读取正文；旧库中的版本为空，首次列出摘要时补算
+    content_hash: Mapped[str | None] = mapped_column(
+        String(64), default=lambda ctx: content_hash(ctx.get_current_parameters().get("content"))
+    )
 
     chapter: Mapped[Chapter] = relationship(back_populates="versions")
 
 
+class ChapterSummary(Base):
+    __tablename__ = "chapter_summaries"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    chapter_id: Mapped[int] = mapped_column(ForeignKey("chapters.id"), unique=True, index=True)
+    content_hash: Mapped[str] = mapped_column(String(64))
+    summary: Mapped[str] = mapped_column(Text, default="")
+    updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    chapter: Mapped[Chapter] = relationship(back_populates="summary")
+
+
+class ArcSummary(Base):
+    __tablename__ = "arc_summaries"
+    __table_args__ = (UniqueConstraint("novel_id", "arc_index", name="uq_arc_summary"),)
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    novel_id: Mapped[int] = mapped_column(ForeignKey("novels.id"), index=True)
+    arc_index: Mapped[int] = mapped_column(Integer)
+    source_hash: Mapped[str] = mapped_column(String(64))
+    summary: Mapped[str] = mapped_column(Text, default="")
+    updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    novel: Mapped[Novel] = relationship(back_populates="arc_summaries")
+
+
+class ChapterBatchResult(Base):
+    """批量润色/仿写的处理记录：同一章节在同一组设置下，原文哈希不变时不再重复处理。"""
+
+    __tablename__ = "chapter_batch_results"
+    __table_args__ = (UniqueConstraint("chapter_id", "settings_hash", name="uq_chapter_batch_result"),)
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    chapter_id: Mapped[int] = mapped_column(ForeignKey("chapters.id"), index=True)
+    settings_hash: Mapped[str] = mapped_column(String(64))
+    source_hash: Mapped[str] = mapped_column(String(64))
+    version_id: Mapped[int | None] = mapped_column(ForeignKey("chapter_versions.id"), default=None)
+    job_id: Mapped[int | None] = mapped_column(Integer, default=None)
+    updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    chapter: Mapped[Chapter] = relationship(back_populates="batch_results")
+
+
 class Character(Base):
     __tablename__ = "characters"
 
@@ -88,3 +141,68 @@ class Idea(Base):
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
 
     novel: Mapped[Novel] = relationship(back_populates="ideas")
+
+
+class NovelStats(Base):
+    """按小说汇总的统计（章节数、人物数、字数），由写接口在同一事务中增量维护。"""
+
+    __tablename__ = "novel_stats"
+
+    novel_id: Mapped[int] = mapped_column(ForeignKey("novels.id"), primary_key=True)
+    chapter_count: Mapped[int] = mapped_column(Integer, default=0)
+    character_count: Mapped[int] = mapped_column(Integer, default=0)
+    word_count: Mapped[int] = mapped_column(Integer, default=0)
+    cjk_count: Mapped[int] = mapped_column(Integer, default=0)
+    last_edited_at: Mapped[datetime | None] = mapped_column(DateTime, default=None)
+
+
+class GlobalStats(Base):
+    """全站统计，只有 id=1 一行。"""
+
+    __tablename__ = "global_stats"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    novel_count: Mapped[int] = mapped_column(Integer, default=0)
+    chapter_count: Mapped[int] = mapped_column(Integer, default=0)
+    character_count: Mapped[int] = mapped_column(Integer, default=0)
+    word_count: Mapped[int] = mapped_column(Integer, default=0)
+    cjk_count: Mapped[int] = mapped_column(Integer, default=0)
+    last_edited_at: Mapped[datetime | None] = mapped_column(DateTime, default=None)
+
+
+class ResponseCacheEntry(Base):
+    __tablename__ = "response_cache"
+
+    key: Mapped[str] = mapped_column(String(64), primary_key=True)
+    content: Mapped[str] = mapped_column(Text, default="")
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, index=True)
+    expires_at: Mapped[datetime] = mapped_column(DateTime, index=True)
+
+
+class Job(Base):
+    """后台任务队列：工作线程按类型认领 queued 任务，进度与断点随执行写回，重启后从断点继续。"""
+
+    __tablename__ = "jobs"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    job_type: Mapped[str] = mapped_column(String(50), index=True)
+    # queued / running / succeeded / failed / cancelled
+    status: Mapped[str] = mapped_column(String(20), default="queued", index=True)
+    novel_id: Mapped[int | None] = mapped_column(Integer, index=True, nullable=True, default=None)
+    payload: Mapped[str] = mapped_column(Text, default="{}")
+    checkpoint: Mapped[str | None] = mapped_column(Text, default=None)
+    result: Mapped[str | None] = mapped_column(Text, default=None)
+    error: Mapped[str | None] = mapped_column(Text, default=None)
+    progress_done: Mapped[int] = mapped_column(Integer, default=0)
+    progress_total: Mapped[int] = mapped_column(Integer, default=0)
+    attempts: Mapped[int] = mapped_column(Integer, default=0)
+    max_attempts: Mapped[int] = mapped_column(Integer, default=3)
+    cancel_requested: Mapped[int] = mapped_column(Integer, default=0)
+    # 重试退避：早于该时间不会被认领
+    run_after: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, index=True)
+    locked_by: Mapped[str | None] = mapped_column(String(64), default=None)
+    heartbeat_at: Mapped[datetime | None] = mapped_column(DateTime, default=None)
+    started_at: Mapped[datetime | None] = mapped_column(DateTime, default=None)
+    finished_at: Mapped[datetime | None] = mapped_column(DateTime, default=None)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
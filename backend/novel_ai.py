@@ -1,11 +1,43 @@
 from __future__ import annotations
 
-from dataclasses import dataclass
-from typing import Iterable
+import asyncio
+import hashlib
+import json
+from dataclasses import dataclass, field, replace
+from threading import Lock
+from typing import AsyncIterator, Callable, Iterable, Iterator
 
-from .ai_providers import BaseLLMProvider, OllamaProvider, OpenAICompatProvider
+from .ai_providers import (
+    AsyncClientPool,
+    BaseLLMProvider,
+    HTTPSessionPool,
+    OllamaPool,
+    OllamaProvider,
+    OpenAICompatProvider,
+    httpx,
+)
+from .chunking import ordered_parallel, split_paragraphs, trim_stream
 from .config import Config, load_config
-from .prompts import PROMPT_TEMPLATES
+from .context_budget import (
+    PromptTooLong,
+    estimate_tokens,
+    fit_prompt_values,
+    resolve_context_window,
+    template_sections,
+)
+from .hedging import HedgedStreamer
+from .model_catalog import ModelCatalog, ModelInfo
+from .ollama_context import OllamaContextCache
+from .prompts import (
+    CHUNK_OVERLAP_TEMPLATE,
+    CONTINUE_FOLLOWUP_NEW_TEXT,
+    CONTINUE_FOLLOWUP_TEMPLATE,
+    PROMPT_TEMPLATES,
+    drop_empty_sections,
+)
+from .response_cache import ResponseCache
+from .scheduler import PRIORITIES, LLMScheduler
+from .utils.streams import AsyncSingleFlight, CancelToken, SingleFlight, merge_streams
 
 
 @dataclass(frozen=True)
@@ -17,14 +49,160 @@ class AIRequest:
     model: str | None = None
     api_key: str | None = None
     base_url: str | None = None
+    temperature: float | None = None
+    use_cache: bool = True
+    # None 表示按配置决定；True/dict 开启对冲（dict 可指定 provider、model、delay_ms 等），False 关闭
+    hedge: bool | dict | None = None
+    # 所属小说；用于按小说复用 Ollama 的 context
+    novel_id: int | None = None
+    # 提示词布局："split" 把稳定前缀并入 system 消息以利于上游前缀缓存，"inline" 为单条 user 消息；None 按配置
+    prompt_layout: str | None = None
+    # 排队优先级：interactive / normal / background；None 时流式的续写、改写类请求为 interactive，其余为 normal
+    priority: str | None = None
+    # 长文本分块并发处理（仅 CHUNKABLE_MODES）：None 按配置自动决定；True/dict 开启（dict 可指定 max_chars、
+    # parallelism、overlap_chars），False 关闭
+    chunked: bool | dict | None = None
+    # 分块时同时进行的模型调用数上限（覆盖 parallelism）；批量任务用来避免占满 provider 的排队名额
+    max_parallelism: int | None = None
+
+
+# 用户在编辑器里等待结果的模式
+INTERACTIVE_MODES = frozenset({"continue", "rewrite", "polish", "mimic"})
+# 逐段处理 target_text、可以分块并发的模式
+CHUNKABLE_MODES = frozenset({"rewrite", "polish", "mimic"})
+
+
+def _option_int(options: dict, name: str, default: int, minimum: int) -> int:
+    value = options.get(name)
+    if not isinstance(value, int) or isinstance(value, bool) or value < minimum:
+        return default
+    return value
+
+
+@dataclass(frozen=True)
+class PreparedCall:
+    """渲染完成、已选定 provider 的一次模型调用。"""
+
+    mode: str
+    provider_key: str
+    provider: BaseLLMProvider
+    prompt: str
+    system_prompt: str | None
+    kwargs: dict = field(default_factory=dict)
+    priority: int = PRIORITIES["normal"]
+
+    @property
+    def model(self) -> str:
+        return self.kwargs.get("model") or self.provider.model
+
+    @property
+    def latency_key(self) -> str:
+        return f"{self.provider_key}:{self.model}"
+
+    def fingerprint(self) -> str:
+        # 包含 api_key 的哈希：自带密钥的请求不能复用或合并他人的结果（密钥无效时也不能拿到缓存内容）
+        api_key = self.kwargs.get("api_key")
+        payload = {
+            "mode": self.mode,
+            "prompt": self.prompt,
+            "system": self.system_prompt,
+            "provider": self.provider_key,
+            "base_url": self.kwargs.get("base_url"),
+            "model": self.model,
+            "temperature": self.kwargs.get("temperature"),
+            "options": self.kwargs.get("options"),
+            "context": self.kwargs.get("context"),
+            "api_key": hashlib.sha256(api_key.encode("utf-8")).hexdigest() if api_key else None,
+        }
+        raw = json.dumps(payload, ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def stream(self, cancel: CancelToken | None = None) -> Iterable[str]:
+        kwargs = self.kwargs if cancel is None else {**self.kwargs, "cancel": cancel}
+        return self.provider.generate_stream(prompt=self.prompt, system_prompt=self.system_prompt, **kwargs)
+
+    def stream_choices(self, n: int, cancel: CancelToken | None = None) -> Iterable[tuple[int, str]]:
+        """用 provider 原生的 n 参数一次生成 n 个候选，产出 (候选序号, 文本块)。"""
+        kwargs = self.kwargs if cancel is None else {**self.kwargs, "cancel": cancel}
+        return self.provider.generate_choices(prompt=self.prompt, system_prompt=self.system_prompt, n=n, **kwargs)
+
+    def astream(self) -> AsyncIterator[str]:
+        return self.provider.agenerate_stream(prompt=self.prompt, system_prompt=self.system_prompt, **self.kwargs)
+
+
+ChunkPlan = tuple[list[tuple[str, str]], int, int]
+
+
+@dataclass(frozen=True)
+class RequestPlan:
+    """一次请求的执行方式：分块计划，或渲染好的调用（及对冲用的备用调用）。
+    由 admit 计算一次后传给 stream/generate，避免重复渲染提示词。"""
+
+    chunks: ChunkPlan | None = None
+    call: PreparedCall | None = None
+    hedge: tuple[PreparedCall, float | None] | None = None
+
+
+class CancellationStats:
+    """统计被中止的上游生成；节省的 token 按同模式已完成生成的平均长度估算。"""
+
+    def __init__(self, default_expected_tokens: int) -> None:
+        self._default_expected = default_expected_tokens
+        self._lock = Lock()
+        self._completed: dict[str, tuple[int, int]] = {}  # 模式 -> (次数, 输出 token 总数)
+        self._counters = {"aborted": 0, "tokens_before_abort": 0, "tokens_saved_estimate": 0}
+
+    def record(self, mode: str, tokens: int, aborted: bool) -> None:
+        with self._lock:
+            count, total = self._completed.get(mode, (0, 0))
+            if not aborted:
+                self._completed[mode] = (count + 1, total + tokens)
+                return
+            expected = total // count if count else self._default_expected
+            self._counters["aborted"] += 1
+            self._counters["tokens_before_abort"] += tokens
+            self._counters["tokens_saved_estimate"] += max(0, expected - tokens)
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            return dict(self._counters)
 
 
 class NovelAIService:
     def __init__(self, config: Config) -> None:
         self._config = config
-        self._providers: dict[str, BaseLLMProvider] = {
-            "ollama": OllamaProvider(base_url=config.ollama_base_url, model=config.ollama_model),
-        }
+        self.response_cache = ResponseCache(
+            enabled=config.response_cache_enabled,
+            max_entries=config.response_cache_size,
+            ttl_seconds=config.response_cache_ttl_seconds,
+            max_chars=config.response_cache_max_chars,
+            persist=config.response_cache_persist,
+            persist_max_entries=config.response_cache_persist_max_entries,
+        )
+        self._flights = SingleFlight()
+        self._aflights = AsyncSingleFlight()
+        self._async_pools: list[AsyncClientPool] = []
+        self.cancellations = CancellationStats(config.context_output_reserve_tokens)
+        self.scheduler = LLMScheduler(
+            limits={
+                "ollama": config.ollama_max_concurrency * len(config.ollama_base_urls),
+                "openai_compat": config.openai_compat_max_concurrency,
+            },
+            max_queue=config.llm_queue_size,
+            timeout_seconds=config.llm_queue_timeout_seconds,
+        )
+        self._hedger = HedgedStreamer(
+            default_delay=config.hedge_default_delay_seconds,
+            min_delay=config.hedge_min_delay_seconds,
+            max_delay=config.hedge_max_delay_seconds,
+        )
+        self._providers: dict[str, BaseLLMProvider] = {"ollama": self._create_ollama_provider()}
+        self.model_catalog = ModelCatalog(self._ollama_sources, ttl_seconds=config.model_catalog_ttl_seconds)
+        self.ollama_contexts = OllamaContextCache(
+            enabled=config.ollama_context_reuse,
+            max_entries=config.ollama_context_cache_size,
+            ttl_seconds=config.ollama_context_ttl_seconds,
+        )
         # Always initialize OpenAI provider if possible, or create a dummy one if needed
         # But for now, we'll just keep the logic as is. 
         # Ideally, we should have a provider factory or a generic provider.
@@ -34,30 +212,122 @@ class NovelAIService:
                 api_key=config.openai_compat_api_key or "",
                 base_url=config.openai_compat_base_url or "https://api.openai.com",
                 model=config.openai_compat_model or "gpt-3.5-turbo",
+                stream_usage=config.openai_compat_stream_usage,
+                **self._http_options(),
             )
         elif "openai_compat" not in self._providers:
              # Add a default one for dynamic usage
              self._providers["openai_compat"] = OpenAICompatProvider(
                 api_key="",
                 base_url="https://api.openai.com",
-                model="gpt-3.5-turbo"
+                model="gpt-3.5-turbo",
+                stream_usage=config.openai_compat_stream_usage,
+                **self._http_options(),
              )
 
-    def _select_provider(self, request: AIRequest) -> BaseLLMProvider:
+    def _http_options(self) -> dict:
+        # 每个 provider 各自持有按 base_url 区分的连接池
+        return {
+            "timeout_seconds": self._config.http_read_timeout_seconds,
+            "connect_timeout_seconds": self._config.http_connect_timeout_seconds,
+            "sessions": HTTPSessionPool(
+                pool_size=self._config.http_pool_size,
+                connect_retries=self._config.http_connect_retries,
+            ),
+            "async_clients": self._async_client_pool() if httpx is not None else None,
+        }
+
+    def _async_client_pool(self) -> AsyncClientPool:
+        pool = AsyncClientPool(
+            pool_size=self._config.http_pool_size,
+            connect_retries=self._config.http_connect_retries,
+            connect_timeout_seconds=self._config.http_connect_timeout_seconds,
+            read_timeout_seconds=self._config.http_read_timeout_seconds,
+        )
+        self._async_pools.append(pool)
+        return pool
+
+    async def aclose(self) -> None:
+        """关闭所有异步连接池中的客户端（ASGI 服务关闭时调用）。"""
+        for pool in self._async_pools:
+            await pool.aclose()
+
+    def _create_ollama_provider(self) -> BaseLLMProvider:
+        config = self._config
+        if len(config.ollama_base_urls) > 1:
+            return OllamaPool(
+                base_urls=config.ollama_base_urls,
+                model=config.ollama_model,
+                health_interval_seconds=config.ollama_health_interval_seconds,
+                failure_threshold=config.ollama_breaker_failures,
+                cooldown_seconds=config.ollama_breaker_cooldown_seconds,
+                keep_alive=config.ollama_keep_alive,
+                **self._http_options(),
+            )
+        return OllamaProvider(
+            base_url=config.ollama_base_urls[0],
+            model=config.ollama_model,
+            keep_alive=config.ollama_keep_alive,
+            **self._http_options(),
+        )
+
+    def _ollama_sources(self) -> list[OllamaProvider]:
+        provider = self._providers.get("ollama")
+        if isinstance(provider, OllamaPool):
+            return provider.available_providers()
+        if isinstance(provider, OllamaProvider):
+            return [provider]
+        return []
+
+    def _provider_key(self, request: AIRequest) -> str:
         provider_key = request.provider or self._config.default_provider
-        provider = self._providers.get(provider_key)
-        if provider is None:
-            # If requesting openai_compat but it wasn't configured in env, we might need it now
-            if provider_key == "openai_compat":
-                 # It should have been added in __init__ now
-                 pass
-            provider = self._providers.get("ollama") # Fallback
-        return provider
-
-    def stream(self, request: AIRequest) -> Iterable[str]:
+        if provider_key not in self._providers:
+            # If requesting openai_compat but it wasn't configured in env, it was still added in __init__
+            provider_key = "ollama" # Fallback
+        return provider_key
+
+    @staticmethod
+    def _priority(request: AIRequest) -> int:
+        if request.priority in PRIORITIES:
+            return PRIORITIES[request.priority]
+        if request.stream and request.mode in INTERACTIVE_MODES:
+            return PRIORITIES["interactive"]
+        return PRIORITIES["normal"]
+
+    def lane_limit(self, request: AIRequest) -> int:
+        """请求所用 provider 的并发上限，0 表示不限。"""
+        return self.scheduler.limit(self._provider_key(request))
+
+    def admit(self, request: AIRequest) -> RequestPlan:
+        """对应 provider 的排队已满时立即抛出 QueueFull，待处理文本超出模型上下文且无法分块时抛出
+        PromptTooLong，供接口在开始生成前快速拒绝。返回的执行计划可直接传给 stream/generate。"""
+        self.scheduler.check(self._provider_key(request), self._priority(request))
+        return self.plan(request)
+
+    def plan(self, request: AIRequest) -> RequestPlan:
+        """需要分块时返回分块计划，否则渲染提示词。原文不能截断（选区结尾会丢失）：原文本身超出模型上下文时
+        按剩余预算改为分块，仍放不下时抛出 PromptTooLong。"""
+        chunks = self._chunk_plan(request)
+        if chunks is None:
+            try:
+                call = self.prepare(request)
+            except PromptTooLong as e:
+                chunks = self._forced_chunk_plan(request, e)
+            else:
+                hedge = self._prepare_hedge(request, call) if call is not None else None
+                return RequestPlan(call=call, hedge=hedge)
+        # 只检查最长的一块：放得下就能正常生成，避免开始输出后才在中途报错
+        longest = max(self._chunk_requests(request, chunks), key=lambda item: len(item[0].context["target_text"]))
+        self.render_prompt(longest[0])
+        return RequestPlan(chunks=chunks)
+
+    def _select_provider(self, request: AIRequest) -> BaseLLMProvider:
+        return self._providers[self._provider_key(request)]
+
+    def render_prompt(self, request: AIRequest) -> tuple[str, str | None] | None:
         template = PROMPT_TEMPLATES.get(request.mode)
         if not template:
-            return iter([f"不支持的模式：{request.mode}"])
+            return None
 
         system_prompt = template.get("system")
         user_template = template.get("user", "{target_text}")
@@ -69,17 +339,453 @@ class NovelAIService:
         else:
             keywords_str = str(keywords) if keywords is not None else ""
 
-        prompt = user_template.format(
-            previous_text=str(ctx.get("previous_text", "")),
-            target_text=str(ctx.get("target_text", "")),
-            style=str(ctx.get("style", "normal")),
-            keywords=keywords_str,
-            novel_title=str(ctx.get("novel_title", "")),
-            novel_summary=str(ctx.get("novel_summary", "")),
-            character_summary=str(ctx.get("character_summary", "")),
+        values = {
+            "previous_text": str(ctx.get("previous_text", "")),
+            "target_text": str(ctx.get("target_text", "")),
+            "style": str(ctx.get("style", "normal")),
+            "keywords": keywords_str,
+            "novel_title": str(ctx.get("novel_title", "")),
+            "novel_summary": str(ctx.get("novel_summary", "")),
+            "character_summary": str(ctx.get("character_summary", "")),
+            "related_passages": str(ctx.get("related_passages", "")),
+            "story_so_far": str(ctx.get("story_so_far", "")),
+        }
+        layout = request.prompt_layout or self._config.prompt_layout
+        prefix = template.get("prefix") if layout == "split" else None
+        if prefix and not user_template.startswith(prefix):
+            prefix = None
+        model = request.model or self._select_provider(request).model
+        values = fit_prompt_values(
+            request.mode,
+            user_template,
+            system_prompt,
+            values,
+            context_window=resolve_context_window(model, self._config.context_window_tokens),
+            output_reserve=self._config.context_output_reserve_tokens,
+            max_prompt_tokens=self._config.max_prompt_tokens,
+            stable_sections=template_sections(prefix) if prefix else (),
+        )
+        user_template = drop_empty_sections(user_template, values)
+        if prefix:
+            prefix = drop_empty_sections(prefix, values)
+            # 稳定部分放在最前且顺序固定，易变部分单独作为 user 消息
+            stable = prefix.format(**values).strip()
+            system_prompt = f"{system_prompt}\n\n{stable}" if system_prompt else stable
+            return user_template[len(prefix) :].format(**values), system_prompt
+        return user_template.format(**values), system_prompt
+
+    def prepare(self, request: AIRequest) -> PreparedCall | None:
+        rendered = self.render_prompt(request)
+        if rendered is None:
+            return None
+        prompt, system_prompt = rendered
+        provider_key = self._provider_key(request)
+        call = PreparedCall(
+            mode=request.mode,
+            provider_key=provider_key,
+            provider=self._providers[provider_key],
+            prompt=prompt,
+            system_prompt=system_prompt,
+            kwargs=self._request_kwargs(request),
+            priority=self._priority(request),
+        )
+        if (
+            request.mode == "continue"
+            and request.novel_id is not None
+            and self.ollama_contexts.enabled
+            and isinstance(call.provider, (OllamaProvider, OllamaPool))
+        ):
+            call = self._with_ollama_context(request, call)
+        return call
+
+    def _with_ollama_context(self, request: AIRequest, call: PreparedCall) -> PreparedCall:
+        """续写接在上一轮结果之后时改为只发送新增前文并附带上一轮的 context；结束后记录新的 context。"""
+        ctx = request.context or {}
+        previous_text = str(ctx.get("previous_text", ""))
+        style = str(ctx.get("style", "normal"))
+        key = (request.novel_id, call.model)
+        stable_key = self.ollama_contexts.stable_key(
+            call.system_prompt,
+            {k: str(ctx.get(k, "")) for k in ("novel_title", "novel_summary", "character_summary", "story_so_far")}
+            | {"style": style},
+        )
+        max_tokens = min(
+            resolve_context_window(call.model, self._config.context_window_tokens)
+            - self._config.context_output_reserve_tokens,
+            self._config.max_prompt_tokens,
+        )
+        prompt = call.prompt
+        kwargs = dict(call.kwargs)
+        reuse = self.ollama_contexts.lookup(
+            key, stable_key, previous_text, max_tokens - estimate_tokens(CONTINUE_FOLLOWUP_TEMPLATE)
+        )
+        if reuse is not None:
+            context, new_text = reuse
+            prompt = CONTINUE_FOLLOWUP_TEMPLATE.format(
+                new_text=CONTINUE_FOLLOWUP_NEW_TEXT.format(text=new_text.strip()) if new_text.strip() else "",
+                style=style,
+            )
+            kwargs["context"] = context
+            # 上一轮的 system（含稳定前缀）已在 context 中，这里只需原始的角色设定
+            call = replace(call, system_prompt=PROMPT_TEMPLATES[request.mode].get("system"))
+
+        def on_done(final: dict, response: str) -> None:
+            self.ollama_contexts.store(key, stable_key, previous_text, response, final.get("context"))
+
+        kwargs["on_done"] = on_done
+        return replace(call, prompt=prompt, kwargs=kwargs)
+
+    def _prepare_hedge(self, request: AIRequest, call: PreparedCall) -> tuple[PreparedCall, float | None] | None:
+        """按请求或配置生成对冲用的备用调用，返回 (备用调用, 指定的等待秒数)。"""
+        options = request.hedge
+        if options is None:
+            options = self._config.hedge_enabled
+        if options is False:
+            return None
+        options = options if isinstance(options, dict) else {}
+        provider_key = options.get("provider") or self._config.hedge_backup_provider or call.provider_key
+        same_provider = provider_key == call.provider_key
+        backup_request = replace(
+            request,
+            provider=provider_key,
+            model=options.get("model") or self._config.hedge_backup_model or (request.model if same_provider else None),
+            api_key=options.get("api_key") or (request.api_key if same_provider else None),
+            base_url=options.get("base_url") or (request.base_url if same_provider else None),
+            hedge=False,
         )
-        provider = self._select_provider(request)
-        
+        backup = self.prepare(backup_request)
+        if backup is None:
+            return None
+        delay_ms = options.get("delay_ms")
+        delay = float(delay_ms) / 1000 if isinstance(delay_ms, (int, float)) else None
+        return backup, delay
+
+    def _stream_call(
+        self,
+        call: PreparedCall,
+        hedge: tuple[PreparedCall, float | None] | None = None,
+        cancel: CancelToken | None = None,
+        on_queue: Callable[[int], None] | None = None,
+        shared: bool = True,
+    ) -> Iterable[str]:
+        def factory(upstream: CancelToken | None) -> Iterable[str]:
+            if hedge is None:
+                return self._track(call.mode, self._scheduled(call, upstream, on_queue), upstream)
+            backup, delay = hedge
+            chunks = self._hedger.stream(
+                call.latency_key,
+                lambda token: self._scheduled(call, token, on_queue),
+                backup.latency_key,
+                lambda token: self._scheduled(backup, token),
+                delay,
+                upstream,
+            )
+            return self._track(call.mode, chunks, upstream)
+
+        # 相同指纹的请求正在进行时直接加入，共享同一个上游流；所有调用方都取消后才中止上游
+        if not shared or not self._config.single_flight_enabled:
+            return factory(cancel)
+        return self._flights.stream(call.fingerprint(), factory, cancel)
+
+    def _scheduled(
+        self,
+        call: PreparedCall,
+        cancel: CancelToken | None,
+        on_queue: Callable[[int], None] | None = None,
+        n: int = 1,
+    ) -> Iterator:
+        """占到 provider 的名额后才发起请求，结束（含取消）后归还。n > 1 时用原生 n 参数，产出 (候选序号, 文本块)。"""
+        if not self.scheduler.acquire(call.provider_key, call.priority, cancel, on_queue):
+            return
+        try:
+            yield from call.stream(cancel) if n == 1 else call.stream_choices(n, cancel)
+        finally:
+            self.scheduler.release(call.provider_key)
+
+    async def _ascheduled(self, call: PreparedCall, on_queue: Callable[[int], None] | None = None) -> AsyncIterator[str]:
+        await self.scheduler.aacquire(call.provider_key, call.priority, on_queue)
+        try:
+            async for chunk in call.astream():
+                yield chunk
+        finally:
+            self.scheduler.release(call.provider_key)
+
+    def _track(self, mode: str, chunks: Iterable[str], cancel: CancelToken | None) -> Iterator[str]:
+        tokens = 0
+        completed = False
+        try:
+            for chunk in chunks:
+                tokens += estimate_tokens(chunk)
+                yield chunk
+            completed = True
+        finally:
+            aborted = cancel is not None and cancel.cancelled
+            if aborted or completed:
+                self.cancellations.record(mode, tokens, aborted=aborted)
+
+    def _chunk_plan(self, request: AIRequest, limits: tuple[int, int] | None = None) -> ChunkPlan | None:
+        """需要分块时返回 ([(块, 分隔符)], 并发数, 衔接字数)。limits 为强制分块时的 (块长上限, 衔接字数上限)。"""
+        options = request.chunked
+        if request.mode not in CHUNKABLE_MODES:
+            return None
+        text = str((request.context or {}).get("target_text", ""))
+        threshold = self._config.chunk_auto_min_chars
+        if limits is None and (options is False or (options is None and (threshold <= 0 or len(text) < threshold))):
+            return None
+        options = options if isinstance(options, dict) else {}
+        max_chars = _option_int(options, "max_chars", self._config.chunk_max_chars, 1)
+        overlap = _option_int(options, "overlap_chars", self._config.chunk_overlap_chars, 0)
+        if limits is not None:
+            max_chars, overlap = min(max_chars, limits[0]), min(overlap, limits[1])
+        chunks = split_paragraphs(text, max_chars)
+        if len(chunks) < 2:
+            return None
+        parallelism = _option_int(options, "parallelism", self._config.chunk_parallelism, 1)
+        if request.max_parallelism:
+            parallelism = min(parallelism, max(1, request.max_parallelism))
+        return chunks, parallelism, overlap
+
+    def _forced_chunk_plan(self, request: AIRequest, error: PromptTooLong) -> ChunkPlan:
+        """原文超出预算时按剩余 token 推算块长：每个字至多算 1 个 token，并给衔接用的上文留出位置。"""
+        budget = error.available - estimate_tokens(CHUNK_OVERLAP_TEMPLATE)
+        overlap = max(0, budget // 4)
+        plan = self._chunk_plan(request, (budget - overlap, overlap)) if budget - overlap > 0 else None
+        if plan is None:
+            raise error
+        return plan
+
+    def _chunk_requests(self, request: AIRequest, plan: ChunkPlan) -> list[tuple[AIRequest, str]]:
+        """每块对应的子请求（附带前一块结尾作为衔接参考）及块后的分隔符。"""
+        chunks, _, overlap = plan
+        ctx = request.context or {}
+        requests = []
+        preceding = ""
+        for index, (chunk, separator) in enumerate(chunks):
+            target = chunk
+            before = preceding[-overlap:].strip() if overlap else ""
+            if before:
+                target = CHUNK_OVERLAP_TEMPLATE.format(before=before, text=chunk)
+            sub_request = replace(request, context={**ctx, "target_text": target}, chunked=False)
+            requests.append((sub_request, separator if index < len(chunks) - 1 else ""))
+            preceding += chunk + separator
+        return requests
+
+    def _chunked_stream(
+        self,
+        request: AIRequest,
+        plan: ChunkPlan,
+        cancel: CancelToken | None = None,
+        on_queue: Callable[[int], None] | None = None,
+    ) -> Iterator[str]:
+        """各块作为独立请求并发生成，按原文顺序拼接输出；块之间保留原来的段落分隔。"""
+        factories = [
+            self._chunk_factory(sub_request, tail, on_queue if index == 0 else None)
+            for index, (sub_request, tail) in enumerate(self._chunk_requests(request, plan))
+        ]
+        return ordered_parallel(factories, plan[1], cancel)
+
+    def _chunk_factory(
+        self,
+        request: AIRequest,
+        separator: str,
+        on_queue: Callable[[int], None] | None,
+    ) -> Callable[[CancelToken], Iterable[str]]:
+        def factory(cancel: CancelToken) -> Iterator[str]:
+            if request.stream:
+                yield from trim_stream(self.stream(request, cancel, on_queue))
+            else:
+                # 非流式逐块走结果缓存：只改动了部分段落时，其余块直接命中
+                yield self.generate(request).strip()
+            if separator:
+                yield separator
+
+        return factory
+
+    def stream(
+        self,
+        request: AIRequest,
+        cancel: CancelToken | None = None,
+        on_queue: Callable[[int], None] | None = None,
+        plan: RequestPlan | None = None,
+    ) -> Iterable[str]:
+        """cancel 触发后关闭上游连接，流随即结束；需要排队时通过 on_queue 报告排队位置。
+        plan 为 admit 返回的执行计划，未提供时现算。"""
+        plan = plan or self.plan(request)
+        if plan.chunks is not None:
+            return self._chunked_stream(request, plan.chunks, cancel, on_queue)
+        if plan.call is None:
+            return iter([f"不支持的模式：{request.mode}"])
+        return self._stream_call(plan.call, plan.hedge, cancel, on_queue)
+
+    async def astream(
+        self,
+        request: AIRequest,
+        on_queue: Callable[[int], None] | None = None,
+        plan: RequestPlan | None = None,
+    ) -> AsyncIterator[str]:
+        """异步版本通过取消任务中止：httpx 会随之关闭上游连接。"""
+        plan = plan or self.plan(request)
+        if plan.chunks is not None:
+            # 分块请求由线程并发执行，这里在线程池中逐块拉取；任务被取消时中止各块
+            cancel = CancelToken()
+            async for chunk in self._athreaded(self._chunked_stream(request, plan.chunks, cancel, on_queue), cancel):
+                yield chunk
+            return
+        if plan.call is None:
+            yield f"不支持的模式：{request.mode}"
+            return
+        async for chunk in self._astream_call(plan.call, plan.hedge, on_queue):
+            yield chunk
+
+    def _astream_call(
+        self,
+        call: PreparedCall,
+        hedge: tuple[PreparedCall, float | None] | None = None,
+        on_queue: Callable[[int], None] | None = None,
+    ) -> AsyncIterator[str]:
+        if hedge is not None:
+            # 对冲需要同时读取两个上游并单独中止落败的一方，沿用同步实现，在线程池中逐块拉取
+            cancel = CancelToken()
+            return self._athreaded(self._stream_call(call, hedge, cancel, on_queue), cancel)
+
+        def factory() -> AsyncIterator[str]:
+            return self._atrack(call.mode, self._ascheduled(call, on_queue))
+
+        # 相同指纹的请求正在进行时直接加入，共享同一个上游任务；所有调用方都离开后才中止上游
+        if not self._config.single_flight_enabled:
+            return factory()
+        return self._aflights.stream(call.fingerprint(), factory)
+
+    @staticmethod
+    async def _athreaded(chunks: Iterable[str], cancel: CancelToken) -> AsyncIterator[str]:
+        """在线程池中逐块拉取同步流；任务被取消或提前结束时通过 cancel 中止该流。"""
+        iterator = iter(chunks)
+        try:
+            while (chunk := await asyncio.to_thread(next, iterator, None)) is not None:
+                yield chunk
+        finally:
+            cancel.cancel()
+
+    async def _atrack(self, mode: str, chunks: AsyncIterator[str]) -> AsyncIterator[str]:
+        tokens = 0
+        try:
+            async for chunk in chunks:
+                tokens += estimate_tokens(chunk)
+                yield chunk
+        except asyncio.CancelledError:
+            self.cancellations.record(mode, tokens, aborted=True)
+            raise
+        self.cancellations.record(mode, tokens, aborted=False)
+
+    def stream_candidates(
+        self,
+        requests: list[AIRequest],
+        cancel: CancelToken | None = None,
+        on_queue: Callable[[int], None] | None = None,
+    ) -> Iterator[dict]:
+        """多个候选并发生成，按到达顺序产出带序号的帧 {"candidate": i, "content": 文本块}；
+        每个候选结束时产出 {"candidate": i, "done": true}，出错时产出 {"candidate": i, "error": 信息}，不影响其他候选。
+        同一 provider 同时生成的候选数不超过其并发上限；设置完全相同的 OpenAI 兼容请求用原生 n 参数一次生成。"""
+        # 候选之间不能合并成同一个上游流，也不做分块与对冲
+        calls = [self.prepare(replace(r, chunked=False, hedge=False)) for r in requests]
+        if any(call is None for call in calls):
+            for index, request in enumerate(requests):
+                yield {"candidate": index, "error": f"不支持的模式：{request.mode}"}
+            return
+        if (
+            len(calls) > 1
+            and self._config.openai_compat_native_n
+            and all(isinstance(call.provider, OpenAICompatProvider) for call in calls)
+            and len({call.fingerprint() for call in calls}) == 1
+        ):
+            yield from self._native_candidates(calls, cancel, on_queue)
+            return
+        yield from self._parallel_candidates(list(enumerate(calls)), cancel, on_queue)
+
+    def _candidate_factory(
+        self,
+        index: int,
+        call: PreparedCall,
+        on_queue: Callable[[int], None] | None,
+    ) -> Callable[[CancelToken], Iterator[dict]]:
+        def factory(cancel: CancelToken) -> Iterator[dict]:
+            try:
+                chunks = self._stream_call(call, None, cancel, on_queue, shared=False)
+                for chunk in chunks:
+                    yield {"candidate": index, "content": chunk}
+            except Exception as e:
+                yield {"candidate": index, "error": str(e)}
+                return
+            if not cancel.cancelled:
+                yield {"candidate": index, "done": True}
+
+        return factory
+
+    def _parallel_candidates(
+        self,
+        calls: list[tuple[int, PreparedCall]],
+        cancel: CancelToken | None,
+        on_queue: Callable[[int], None] | None,
+    ) -> Iterator[dict]:
+        # 超出 provider 并发上限的候选在本地等待，不占用调度器的排队名额；只由第一个候选报告排队位置
+        factories = [
+            self._candidate_factory(index, call, on_queue if position == 0 else None)
+            for position, (index, call) in enumerate(calls)
+        ]
+        lanes = [call.provider_key for _, call in calls]
+        limits = {lane: self.scheduler.limit(lane) for lane in lanes}
+        return merge_streams(factories, lanes, limits, cancel)
+
+    def _native_candidates(
+        self,
+        calls: list[PreparedCall],
+        cancel: CancelToken | None,
+        on_queue: Callable[[int], None] | None,
+    ) -> Iterator[dict]:
+        n = len(calls)
+        upstream = CancelToken()
+        unlink = cancel.on_cancel(upstream.cancel) if cancel is not None else None
+        seen: set[int] = set()
+        try:
+            for index, chunk in self._scheduled(calls[0], upstream, on_queue, n=n):
+                if 0 <= index < n:
+                    seen.add(index)
+                    yield {"candidate": index, "content": chunk}
+        except GeneratorExit:
+            upstream.cancel()
+            raise
+        except Exception as e:
+            for index in range(n):
+                yield {"candidate": index, "error": str(e)}
+            return
+        finally:
+            if unlink is not None:
+                unlink()
+        if upstream.cancelled:
+            return
+        for index in sorted(seen):
+            yield {"candidate": index, "done": True}
+        missing = [index for index in range(n) if index not in seen]
+        if missing and seen:
+            # 上游忽略了 n 参数，只返回了一个候选：其余的改为逐个请求
+            yield from self._parallel_candidates([(index, calls[index]) for index in missing], cancel, None)
+        else:
+            for index in missing:
+                yield {"candidate": index, "done": True}
+
+    def generate_candidates(self, requests: list[AIRequest]) -> list[dict[str, str]]:
+        """stream_candidates 的非流式版本，按候选顺序返回 {"content": 文本} 或 {"error": 信息}。"""
+        results: list[dict[str, str]] = [{"content": ""} for _ in requests]
+        for frame in self.stream_candidates(requests):
+            result = results[frame["candidate"]]
+            if "error" in frame:
+                results[frame["candidate"]] = {"error": frame["error"]}
+            elif "content" in frame and "content" in result:
+                result["content"] += frame["content"]
+        return results
+
+    @staticmethod
+    def _request_kwargs(request: AIRequest) -> dict:
         # Pass request-specific overrides
         kwargs = {}
         if request.model:
@@ -88,17 +794,70 @@ class NovelAIService:
             kwargs["api_key"] = request.api_key
         if request.base_url:
             kwargs["base_url"] = request.base_url
-            
-        return provider.generate_stream(prompt=prompt, system_prompt=system_prompt, **kwargs)
+        if request.temperature is not None:
+            kwargs["temperature"] = request.temperature
+        return kwargs
 
-    def get_ollama_models(self) -> list[str]:
-        provider = self._providers.get("ollama")
-        if isinstance(provider, OllamaProvider):
-            return provider.list_models()
-        return []
+    def get_ollama_models(self, refresh: bool = False) -> list[str]:
+        return self.model_catalog.names(refresh)
+
+    def get_ollama_model_details(self, refresh: bool = False) -> list[ModelInfo]:
+        return self.model_catalog.get(refresh, detail=True)
+
+    def generate(self, request: AIRequest, plan: RequestPlan | None = None, cancel: CancelToken | None = None) -> str:
+        """cancel 触发后关闭上游连接并返回已生成的部分，这部分内容不写入结果缓存。"""
+        plan = plan or self.plan(request)
+        if plan.chunks is not None:
+            return "".join(self._chunked_stream(request, plan.chunks, cancel))
+        call = plan.call
+        if call is None:
+            return f"不支持的模式：{request.mode}"
+        use_cache = request.use_cache and self.response_cache.enabled
+        key = call.fingerprint() if use_cache else ""
+        if use_cache:
+            cached = self.response_cache.get(key)
+            if cached is not None:
+                return cached
+        content = "".join(self._stream_call(call, plan.hedge, cancel))
+        if use_cache and not (cancel is not None and cancel.cancelled):
+            self.response_cache.set(key, content)
+        return content
 
-    def generate(self, request: AIRequest) -> str:
-        return "".join(self.stream(request))
+    async def agenerate(self, request: AIRequest, plan: RequestPlan | None = None) -> str:
+        plan = plan or self.plan(request)
+        if plan.chunks is not None:
+            return await asyncio.to_thread(self.generate, request, plan)
+        call = plan.call
+        if call is None:
+            return f"不支持的模式：{request.mode}"
+        use_cache = request.use_cache and self.response_cache.enabled
+        key = call.fingerprint() if use_cache else ""
+        if use_cache:
+            cached = await asyncio.to_thread(self.response_cache.get, key)
+            if cached is not None:
+                return cached
+        content = "".join([chunk async for chunk in self._astream_call(call, plan.hedge)])
+        if use_cache:
+            await asyncio.to_thread(self.response_cache.set, key, content)
+        return content
+
+    def stats(self) -> dict[str, object]:
+        stats: dict[str, object] = {
+            "response_cache": self.response_cache.stats(),
+            "single_flight": {**self._flights.stats(), "async": self._aflights.stats()},
+            "hedging": self._hedger.stats(),
+            "cancellation": self.cancellations.stats(),
+            "scheduler": self.scheduler.stats(),
+        }
+        stats["model_catalog"] = self.model_catalog.stats()
+        stats["ollama_context"] = self.ollama_contexts.stats()
+        openai_compat = self._providers.get("openai_compat")
+        if isinstance(openai_compat, OpenAICompatProvider):
+            stats["prompt_cache"] = openai_compat.usage.stats()
+        provider = self._providers.get("ollama")
+        if isinstance(provider, OllamaPool):
+            stats["ollama_replicas"] = provider.stats()
+        return stats
 
 
 ai_service = NovelAIService(load_config())
@@ -0,0 +1,84 @@
+from __future__ import annotations
+
+import json
+from dataclasses import dataclass
+from threading import Lock
+
+from .context_budget import estimate_tokens
+from .utils.hashing import content_hash
+from .utils.lru_cache import LRUCache
+
+
+# 续写时与上一轮结果对齐所用的锚点长度（去掉空白后的字符数）
+ANCHOR_CHARS = 80
+
+
+@dataclass(frozen=True)
+class ContextSession:
+    stable_key: str
+    covered_text: str  # 上一轮的前文 + 模型回复
+    context: tuple[int, ...]
+
+
+def _new_text_after(covered: str, text: str) -> str | None:
+    """text 若是接在 covered 之后继续写的（以 covered 结尾为锚点），返回锚点之后新增的部分。
+    编辑器会调整换行和空格，比较时忽略空白。"""
+    anchor = "".join(covered.split())[-ANCHOR_CHARS:]
+    if not anchor:
+        return None
+    positions = [i for i, ch in enumerate(text) if not ch.isspace()]
+    compact = "".join(text[i] for i in positions)
+    index = compact.rfind(anchor)
+    if index < 0:
+        return None
+    return text[positions[index + len(anchor) - 1] + 1 :]
+
+
+class OllamaContextCache:
+    """按 (小说, 模型) 保存 Ollama 上一轮返回的 context（提示词与回复的 token）。
+    下一次续写如果接着上一轮结果往下写，只发送新增的前文并附带 context，
+    Ollama 只需预填充新增部分，已计算的 KV 在 keep_alive 期间可直接复用。"""
+
+    def __init__(self, enabled: bool, max_entries: int, ttl_seconds: float) -> None:
+        self.enabled = enabled
+        self._sessions = LRUCache(max_entries=max_entries, ttl_seconds=ttl_seconds)
+        self._lock = Lock()
+        self._counters = {"reused": 0, "misses": 0, "stored": 0, "reused_tokens": 0}
+
+    def _count(self, name: str, amount: int = 1) -> None:
+        with self._lock:
+            self._counters[name] += amount
+
+    @staticmethod
+    def stable_key(system_prompt: str | None, values: dict) -> str:
+        # 小说信息、人物档案等变化后，上一轮 context 中的设定已过时，不再复用
+        raw = json.dumps({"system": system_prompt, **values}, ensure_ascii=False, sort_keys=True)
+        return content_hash(raw)
+
+    def lookup(self, key: tuple, stable_key: str, previous_text: str, max_tokens: int) -> tuple[list[int], str] | None:
+        """可以复用时返回 (context, 新增前文)。"""
+        session: ContextSession | None = self._sessions.get(key)
+        if session is None or session.stable_key != stable_key:
+            self._count("misses")
+            return None
+        new_text = _new_text_after(session.covered_text, previous_text)
+        # context 会随轮次累积，超过预算后回到完整提示词，重新开始一轮
+        if new_text is None or len(session.context) + estimate_tokens(new_text) > max_tokens:
+            self._count("misses")
+            return None
+        self._count("reused")
+        self._count("reused_tokens", len(session.context))
+        return list(session.context), new_text
+
+    def store(self, key: tuple, stable_key: str, previous_text: str, response: str, context: object) -> None:
+        if not isinstance(context, list) or not context or not response:
+            return
+        self._sessions.set(key, ContextSession(stable_key, previous_text + response, tuple(context)))
+        self._count("stored")
+
+    def clear(self) -> None:
+        self._sessions.clear()
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            return {**self._counters, "sessions": len(self._sessions)}
@@ -1,7 +1,20 @@
+# 各模式中相对稳定的开头部分（小说信息、人物档案等）。split 布局下这部分并入 system 消息，
+# 易变的内容单独作为 user 消息，使上游的前缀缓存（如 DeepSeek 的上下文硬盘缓存）能够命中
+_NOVEL_INFO = "【小说信息】\n标题：{novel_title}\n简介：{novel_summary}\n\n"
+# 内容为空时整段省略（连同标题），避免提示词里出现空的【…】段落
+OPTIONAL_SECTIONS: dict[str, str] = {
+    "story_so_far": "【前情提要】\n{story_so_far}\n\n",
+    "related_passages": "【相关前情】\n{related_passages}\n\n",
+}
+_CONTINUE_PREFIX = _NOVEL_INFO + "【人物档案】\n{character_summary}\n\n" + OPTIONAL_SECTIONS["story_so_far"]
+
 PROMPT_TEMPLATES: dict[str, dict[str, str]] = {
     "continue": {
         "system": "你是一个专业的小说家。根据给出的前文续写故事，保持风格一致，逻辑通顺。",
-        "user": "【小说信息】\n标题：{novel_title}\n简介：{novel_summary}\n\n【人物档案】\n{character_summary}\n\n【前文】\n{previous_text}\n\n【续写要求】\n接着写一段，风格倾向为{style}。不要重复前文。",
+        "prefix": _CONTINUE_PREFIX,
+        "user": _CONTINUE_PREFIX
+        + OPTIONAL_SECTIONS["related_passages"]
+        + "【前文】\n{previous_text}\n\n【续写要求】\n接着写一段，风格倾向为{style}。不要重复前文。",
     },
     "rewrite": {
         "system": "你是一个资深文学编辑，擅长改写与增强表现力。",
@@ -17,23 +30,54 @@ PROMPT_TEMPLATES: dict[str, dict[str, str]] = {
     },
     "character": {
         "system": "你是一个人物设定专家。",
-        "user": "【小说信息】\n标题：{novel_title}\n简介：{novel_summary}\n\n请根据关键词：{keywords}，生成一个详细的人物档案（姓名、外貌、性格、动机、弱点、成长线、口头禅）。",
+        "prefix": _NOVEL_INFO,
+        "user": _NOVEL_INFO
+        + "请根据关键词：{keywords}，生成一个详细的人物档案（姓名、外貌、性格、动机、弱点、成长线、口头禅）。",
     },
     "plot_twist": {
         "system": "你是一个擅长制造悬念和反转的编剧。",
-        "user": "【小说信息】\n标题：{novel_title}\n简介：{novel_summary}\n\n关键词：{keywords}\n\n请根据上述信息，设计3个令人意想不到的情节转折或冲突升级方案。",
+        "prefix": _NOVEL_INFO,
+        "user": _NOVEL_INFO
+        + "关键词：{keywords}\n\n请根据上述信息，设计3个令人意想不到的情节转折或冲突升级方案。",
     },
     "story_fragment": {
         "system": "你是一个极具画面感的创意写作助手。",
-        "user": "【小说信息】\n标题：{novel_title}\n简介：{novel_summary}\n\n关键词：{keywords}\n\n请根据关键词写一个精彩的故事片段（约300-500字），注重场景描写和氛围渲染。",
+        "prefix": _NOVEL_INFO,
+        "user": _NOVEL_INFO
+        + "关键词：{keywords}\n\n请根据关键词写一个精彩的故事片段（约300-500字），注重场景描写和氛围渲染。",
     },
     "world_building": {
         "system": "你是一个世界观架构师。",
-        "user": "【小说信息】\n标题：{novel_title}\n简介：{novel_summary}\n\n关键词：{keywords}\n\n请设计一个独特的世界观设定（地理环境、社会制度、力量体系或特殊规则）。",
+        "prefix": _NOVEL_INFO,
+        "user": _NOVEL_INFO
+        + "关键词：{keywords}\n\n请设计一个独特的世界观设定（地理环境、社会制度、力量体系或特殊规则）。",
     },
     "mimic": {
         "system": "你是一个擅长模仿各种写作风格的文学大师。",
         "user": "请将以下这段文本改写，严格模仿【{style}】的写作风格和语感。\n\n【原文本】\n{target_text}\n\n【改写后】",
     },
+    "chapter_summary": {
+        "system": "你是一个严谨的小说编辑，擅长提炼情节。",
+        "user": "请用200字以内概括以下章节的主要情节、人物行动与关键伏笔，只输出概要：\n\n{target_text}\n",
+    },
+    "arc_summary": {
+        "system": "你是一个严谨的小说编辑，擅长提炼情节。",
+        "user": "以下是连续若干章的章节概要，请合并为一段300字以内的剧情梗概，保留主线进展、人物关系变化和未解决的伏笔：\n\n{target_text}\n",
+    },
 }
 
+
+def drop_empty_sections(template: str, values: dict[str, str]) -> str:
+    """去掉值为空的可选段落（含标题）。"""
+    for name, block in OPTIONAL_SECTIONS.items():
+        if not values.get(name, "").strip():
+            template = template.replace(block, "")
+    return template
+
+
+# 复用上一轮 Ollama context 时的续写提示词：上一轮的完整提示词与回复已在 context 中，只需补充新增前文
+CONTINUE_FOLLOWUP_TEMPLATE = "{new_text}【续写要求】\n接着上文再写一段，风格倾向为{style}。不要重复前文。"
+CONTINUE_FOLLOWUP_NEW_TEXT = "【新增前文】\n{text}\n\n"
+
+# 分块处理长文本时，把前一块的结尾附在待处理文本前，帮助模型衔接语气与指代
+CHUNK_OVERLAP_TEMPLATE = "【上文（仅供衔接参考，不要输出）】\n{before}\n\n【需要处理的部分】\n{text}"
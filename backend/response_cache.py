@@ -0,0 +1,111 @@
+from __future__ import annotations
+
+from datetime import datetime, timedelta
+from threading import Lock
+
+from sqlalchemy import delete, func, select
+
+from .database import SessionLocal
+from .models import ResponseCacheEntry
+from .utils.lru_cache import LRUCache
+
+
+# 持久层每写入这么多次清理一次过期与超量条目
+PRUNE_EVERY = 50
+
+
+class ResponseCache:
+    """非流式生成结果缓存：内存 LRU 为第一层，可选 SQLite 持久化为第二层。"""
+
+    def __init__(
+        self,
+        enabled: bool,
+        max_entries: int,
+        ttl_seconds: int,
+        max_chars: int,
+        persist: bool = False,
+        persist_max_entries: int = 5000,
+    ) -> None:
+        self.enabled = enabled
+        self._memory = LRUCache(max_entries=max_entries, ttl_seconds=ttl_seconds)
+        self._ttl_seconds = ttl_seconds
+        self._max_chars = max_chars
+        self._persist = persist
+        self._persist_max_entries = persist_max_entries
+        self._lock = Lock()
+        self._writes = 0
+        self._counters = {"memory_hits": 0, "persist_hits": 0, "misses": 0, "stores": 0}
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self._counters[name] += 1
+
+    def get(self, key: str) -> str | None:
+        content = self._memory.get(key)
+        if content is not None:
+            self._count("memory_hits")
+            return content
+        if self._persist:
+            with SessionLocal() as db:
+                entry = db.get(ResponseCacheEntry, key)
+                if entry is not None and entry.expires_at > datetime.utcnow():
+                    remaining = (entry.expires_at - datetime.utcnow()).total_seconds()
+                    self._memory.set(key, entry.content, ttl_seconds=remaining)
+                    self._count("persist_hits")
+                    return entry.content
+        self._count("misses")
+        return None
+
+    def set(self, key: str, content: str) -> None:
+        # 空结果通常意味着上游出错，不缓存
+        if not content or len(content) > self._max_chars:
+            return
+        self._memory.set(key, content)
+        self._count("stores")
+        if not self._persist:
+            return
+        now = datetime.utcnow()
+        with SessionLocal() as db:
+            db.merge(
+                ResponseCacheEntry(
+                    key=key,
+                    content=content,
+                    created_at=now,
+                    expires_at=now + timedelta(seconds=self._ttl_seconds),
+                )
+            )
+            db.commit()
+        with self._lock:
+            self._writes += 1
+            prune = self._writes % PRUNE_EVERY == 0
+        if prune:
+            self._prune()
+
+    def _prune(self) -> None:
+        with SessionLocal() as db:
+            db.execute(delete(ResponseCacheEntry).where(ResponseCacheEntry.expires_at <= datetime.utcnow()))
+            overflow = (db.scalar(select(func.count()).select_from(ResponseCacheEntry)) or 0) - self._persist_max_entries
+            if overflow > 0:
+                oldest = select(ResponseCacheEntry.key).order_by(ResponseCacheEntry.created_at.asc()).limit(overflow)
+                db.execute(delete(ResponseCacheEntry).where(ResponseCacheEntry.key.in_(oldest)))
+            db.commit()
+
+    def clear(self) -> None:
+        self._memory.clear()
+        if self._persist:
+            with SessionLocal() as db:
+                db.execute(delete(ResponseCacheEntry))
+                db.commit()
+
+    def stats(self) -> dict[str, object]:
+        with self._lock:
+            counters = dict(self._counters)
+        lookups = counters["memory_hits"] + counters["persist_hits"] + counters["misses"]
+        hits = counters["memory_hits"] + counters["persist_hits"]
+        return {
+            "enabled": self.enabled,
+            "persist": self._persist,
+            "memory_entries": len(self._memory),
+            **counters,
+            "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+        }
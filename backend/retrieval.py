@@ -0,0 +1,205 @@
+from __future__ import annotations
+
+import heapq
+import math
+import re
+from collections import Counter
+from threading import Lock
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from .config import load_config
+from .models import Chapter
+from .utils.hashing import content_hash
+from .utils.lru_cache import LRUCache
+
+
+config = load_config()
+
+_CJK_RUN_RE = re.compile(r"[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]+")
+_WORD_RE = re.compile(r"[0-9A-Za-z]+")
+_PARAGRAPH_SPLIT_RE = re.compile(r"\n\s*\n|\n")
+
+PARAGRAPH_MAX_CHARS = 400
+PARAGRAPH_MIN_CHARS = 12
+# 每次查询最多使用的查询词数量（按文档频率从低到高挑选），保证查询耗时有上界
+QUERY_MAX_TERMS = 48
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+
+def tokenize(text: str) -> list[str]:
+    """中文按相邻两字切分（单字成段时保留单字），英文数字按单词切分。"""
+    terms: list[str] = []
+    for run in _CJK_RUN_RE.findall(text):
+        if len(run) == 1:
+            terms.append(run)
+        else:
+            terms.extend(run[i:i + 2] for i in range(len(run) - 1))
+    terms.extend(w.lower() for w in _WORD_RE.findall(text))
+    return terms
+
+
+def split_paragraphs(content: str) -> list[str]:
+    paragraphs: list[str] = []
+    for block in _PARAGRAPH_SPLIT_RE.split(content or ""):
+        block = block.strip()
+        while len(block) > PARAGRAPH_MAX_CHARS:
+            paragraphs.append(block[:PARAGRAPH_MAX_CHARS])
+            block = block[PARAGRAPH_MAX_CHARS:]
+        if len(block) >= PARAGRAPH_MIN_CHARS:
+            paragraphs.append(block)
+    return paragraphs
+
+
+class NovelIndex:
+    """单部小说的段落级 BM25 倒排索引，按章节增量更新。"""
+
+    def __init__(self) -> None:
+        self._lock = Lock()
+        self._next_pid = 0
+        self._paragraphs: dict[int, tuple[int, str, int]] = {}
+        self._chapter_pids: dict[int, list[int]] = {}
+        self._chapter_hashes: dict[int, str] = {}
+        self._postings: dict[str, dict[int, int]] = {}
+        self._total_len = 0
+
+    def update_chapter(self, chapter_id: int, content: str) -> None:
+        digest = content_hash(content)
+        with self._lock:
+            if self._chapter_hashes.get(chapter_id) == digest:
+                return
+            self._remove_locked(chapter_id)
+            pids: list[int] = []
+            for text in split_paragraphs(content):
+                terms = Counter(tokenize(text))
+                if not terms:
+                    continue
+                pid = self._next_pid
+                self._next_pid += 1
+                length = sum(terms.values())
+                self._paragraphs[pid] = (chapter_id, text, length)
+                self._total_len += length
+                for term, tf in terms.items():
+                    self._postings.setdefault(term, {})[pid] = tf
+                pids.append(pid)
+            self._chapter_pids[chapter_id] = pids
+            self._chapter_hashes[chapter_id] = digest
+
+    def remove_chapter(self, chapter_id: int) -> None:
+        with self._lock:
+            self._remove_locked(chapter_id)
+
+    def _remove_locked(self, chapter_id: int) -> None:
+        self._chapter_hashes.pop(chapter_id, None)
+        for pid in self._chapter_pids.pop(chapter_id, []):
+            _, text, length = self._paragraphs.pop(pid)
+            self._total_len -= length
+            for term in set(tokenize(text)):
+                posting = self._postings.get(term)
+                if posting is None:
+                    continue
+                posting.pop(pid, None)
+                if not posting:
+                    del self._postings[term]
+
+    def search(self, query: str, k: int) -> list[tuple[float, int, str]]:
+        """返回得分最高的 k 个段落：(score, chapter_id, text)。"""
+        with self._lock:
+            n = len(self._paragraphs)
+            if n == 0 or k <= 0:
+                return []
+            avg_len = self._total_len / n
+            candidates = [(len(self._postings[t]), t) for t in set(tokenize(query)) if t in self._postings]
+            terms = [t for _, t in heapq.nsmallest(QUERY_MAX_TERMS, candidates)]
+            paragraphs = self._paragraphs
+            base = BM25_K1 * (1 - BM25_B)
+            scale = BM25_K1 * BM25_B / avg_len
+            scores: dict[int, float] = {}
+            for term in terms:
+                posting = self._postings[term]
+                df = len(posting)
+                weight = math.log(1 + (n - df + 0.5) / (df + 0.5)) * (BM25_K1 + 1)
+                for pid, tf in posting.items():
+                    norm = tf + base + scale * paragraphs[pid][2]
+                    scores[pid] = scores.get(pid, 0.0) + weight * tf / norm
+            top = heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+            return [(score, self._paragraphs[pid][0], self._paragraphs[pid][1]) for pid, score in top]
+
+
+class RetrievalIndexRegistry:
+    """按小说缓存索引；首次查询时从数据库全量构建，之后由章节写接口增量维护。"""
+
+    def __init__(self, max_novels: int) -> None:
+        self._indexes = LRUCache(max_entries=max_novels)
+        self._build_lock = Lock()
+        # 正在构建的小说 -> 构建期间到达的写入（章节 id -> 内容，None 表示删除），构建完成后补上
+        self._pending: dict[int, dict[int, str | None]] = {}
+        self._pending_lock = Lock()
+
+    def get(self, db: Session, novel_id: int) -> NovelIndex:
+        index = self._indexes.get(novel_id)
+        if index is not None:
+            return index
+        with self._build_lock:
+            index = self._indexes.get(novel_id)
+            if index is not None:
+                return index
+            with self._pending_lock:
+                self._pending[novel_id] = {}
+            index = NovelIndex()
+            try:
+                rows = db.execute(
+                    select(Chapter.id, Chapter.content)
+                    .where(Chapter.novel_id == novel_id)
+                    .execution_options(yield_per=32)
+                )
+                for chapter_id, content in rows:
+                    index.update_chapter(chapter_id, content or "")
+            except Exception:
+                with self._pending_lock:
+                    self._pending.pop(novel_id, None)
+                raise
+            with self._pending_lock:
+                writes = self._pending.pop(novel_id, None)
+                # 构建期间小说被删除时不登记索引
+                if writes is not None:
+                    for chapter_id, content in writes.items():
+                        if content is None:
+                            index.remove_chapter(chapter_id)
+                        else:
+                            index.update_chapter(chapter_id, content)
+                    self._indexes.set(novel_id, index)
+        return index
+
+    def _record_pending(self, novel_id: int, chapter_id: int, content: str | None) -> bool:
+        with self._pending_lock:
+            writes = self._pending.get(novel_id)
+            if writes is None:
+                return False
+            writes[chapter_id] = content
+            return True
+
+    def update_chapter(self, novel_id: int, chapter_id: int, content: str) -> None:
+        # 尚未构建索引的小说无需维护，首次查询时会从数据库读取最新内容；正在构建的先记下，构建完成后补上
+        if self._record_pending(novel_id, chapter_id, content):
+            return
+        index = self._indexes.get(novel_id)
+        if index is not None:
+            index.update_chapter(chapter_id, content)
+
+    def remove_chapter(self, novel_id: int, chapter_id: int) -> None:
+        if self._record_pending(novel_id, chapter_id, None):
+            return
+        index = self._indexes.get(novel_id)
+        if index is not None:
+            index.remove_chapter(chapter_id)
+
+    def drop_novel(self, novel_id: int) -> None:
+        with self._pending_lock:
+            self._pending.pop(novel_id, None)
+        self._indexes.pop(novel_id)
+
+
+retrieval_index = RetrievalIndexRegistry(max_novels=config.retrieval_index_max_novels)
@@ -0,0 +1,38 @@
+from __future__ import annotations
+
+from threading import Lock
+
+
+class NovelRevisions:
+    """进程内的小说修订号，写接口提交后调用 bump，使旧的上下文缓存失效。"""
+
+    def __init__(self) -> None:
+        self._lock = Lock()
+        self._revisions: dict[int, int] = {}
+
+    def get(self, novel_id: int) -> int:
+        with self._lock:
+            return self._revisions.get(novel_id, 0)
+
+    def bump(self, novel_id: int) -> int:
+        with self._lock:
+            revision = self._revisions.get(novel_id, 0) + 1
+            self._revisions[novel_id] = revision
+            return revision
+
+    def bump_if(self, novel_id: int, expected: int) -> int | None:
+        """修订号仍为 expected 时加一并返回新值，否则（期间有其他写入）不修改并返回 None。"""
+        with self._lock:
+            if self._revisions.get(novel_id, 0) != expected:
+                return None
+            revision = expected + 1
+            self._revisions[novel_id] = revision
+            return revision
+
+
+novel_revisions = NovelRevisions()
+
+
+def bump_novel_revision(novel_id: int | None) -> None:
+    if novel_id is not None:
+        novel_revisions.bump(novel_id)
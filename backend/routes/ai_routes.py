@@ -1,59 +1,198 @@
 from __future__ import annotations
 
 import json
-from typing import Iterable
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import replace
+from typing import AsyncIterable, Iterable
 
 from flask import Blueprint, Response, jsonify, request
 
-from ..novel_ai import AIRequest, ai_service
+from ..config import load_config
+from ..context_budget import PromptTooLong
+from ..novel_ai import AIRequest, RequestPlan, ai_service
+from ..scheduler import QueueFull, QueueTimeout
+from ..stream_registry import ResumableStream, parse_event_id, stream_registry
 from ..utils.rate_limiter import InMemoryFixedWindowLimiter
+from ..utils.streams import CancelToken, acoalesce_chunks
 
 
-from ..context_builder import build_context_for_novel
+from ..context_builder import get_context_for_novel, uses_related_passages
 from ..database import SessionLocal
 
 ai_bp = Blueprint("ai", __name__, url_prefix="/api/ai")
+config = load_config()
 limiter = InMemoryFixedWindowLimiter(limit=60, window_seconds=60)
+brainstorm_executor = ThreadPoolExecutor(
+    max_workers=max(1, config.brainstorm_batch_workers), thread_name_prefix="brainstorm"
+)
+MAX_BRAINSTORM_BATCH = 10
+MAX_COALESCE_MS = 1000
 
 
-def _sse_stream(chunks: Iterable[str]) -> Iterable[str]:
+def _sse_frame(payload: dict | str, event_id: str | None = None) -> str:
+    data = payload if isinstance(payload, str) else json.dumps(payload, ensure_ascii=False)
+    # data 行放在最前：前端按 "data: " 开头识别事件
+    if event_id:
+        return f"data: {data}\nid: {event_id}\n\n"
+    return f"data: {data}\n\n"
+
+
+def parse_coalesce_options(data: dict) -> tuple[float, int]:
+    """SSE 合并参数：coalesce_ms（0 表示逐块发送）与 coalesce_bytes，未提供时使用配置值。"""
+    ms = data.get("coalesce_ms")
+    size = data.get("coalesce_bytes")
+    if not isinstance(ms, int) or isinstance(ms, bool):
+        ms = config.sse_coalesce_ms
+    if not isinstance(size, int) or isinstance(size, bool) or size <= 0:
+        size = config.sse_coalesce_bytes
+    return min(max(ms, 0), MAX_COALESCE_MS) / 1000, size
+
+
+def start_stream(req: AIRequest, coalesce: tuple[float, int], plan: RequestPlan | None = None) -> ResumableStream:
+    """在后台开始生成并写入可续传的缓冲；客户端断开后在宽限期内仍继续生成，等待续传。"""
+    return stream_registry.start(
+        lambda stream: ai_service.stream(req, stream.cancel_token, stream.set_queue_position, plan), coalesce
+    )
+
+
+def start_candidates_stream(requests: list[AIRequest], coalesce: tuple[float, int]) -> ResumableStream:
+    """多候选生成：各候选的输出合并写入同一个可续传缓冲，每帧带 candidate 序号。"""
+    return stream_registry.start(
+        lambda stream: ai_service.stream_candidates(requests, stream.cancel_token, stream.set_queue_position), coalesce
+    )
+
+
+def astart_stream(req: AIRequest, coalesce: tuple[float, int], plan: RequestPlan | None = None) -> ResumableStream:
+    """start_stream 的异步版本，生成在事件循环的后台任务中进行。"""
+    return stream_registry.astart(
+        lambda stream: acoalesce_chunks(ai_service.astream(req, stream.set_queue_position, plan), *coalesce)
+    )
+
+
+def queue_error(error: QueueFull | QueueTimeout) -> tuple[dict, int]:
+    code = "QUEUE_FULL" if isinstance(error, QueueFull) else "QUEUE_TIMEOUT"
+    return {"code": code, "message": str(error)}, 503
+
+
+def resume_error(stream: ResumableStream | None, after: int) -> tuple[dict, int] | None:
+    if stream is None:
+        return {"code": "NOT_FOUND", "message": "生成流不存在或已过期"}, 404
+    if not stream.can_resume(after):
+        return {"code": "STREAM_EXPIRED", "message": "断点之后的内容已被清理，请重新生成"}, 410
+    return None
+
+
+def _cancelled_frame(stream: ResumableStream) -> str:
+    return _sse_frame({"cancelled": True, "reason": stream.cancel_reason})
+
+
+def _queue_frame(stream: ResumableStream) -> str:
+    return _sse_frame({"queue": {"position": stream.queue_position}})
+
+
+def _sse_stream(stream: ResumableStream, after: int = 0) -> Iterable[str]:
+    """推送 after 之后的事件；每帧带 "<stream_id>:<事件号>" 形式的 id，供断线后续传。
+    等待期间定期发送心跳注释，写入失败即可发现客户端已断开。"""
+    stream.attach()
+    sent_position = None
     try:
-        for chunk in chunks:
-            data = json.dumps({"content": chunk}, ensure_ascii=False)
-            yield f"data: {data}\n\n"
-        yield "data: [DONE]\n\n"
+        if after == 0:
+            yield _sse_frame({"stream_id": stream.id}, f"{stream.id}:0")
+        for event in stream.subscribe(after, heartbeat=config.sse_heartbeat_seconds or None):
+            if event is None:
+                if stream.queue_position != sent_position:
+                    sent_position = stream.queue_position
+                    yield _queue_frame(stream)
+                else:
+                    yield ": keep-alive\n\n"
+                continue
+            seq, chunk = event
+            yield _sse_frame(chunk if isinstance(chunk, dict) else {"content": chunk}, f"{stream.id}:{seq}")
+        if stream.cancel_reason:
+            yield _cancelled_frame(stream)
+        yield _sse_frame("[DONE]")
     except Exception as e:
-        err = json.dumps({"error": str(e)}, ensure_ascii=False)
-        yield f"data: {err}\n\n"
+        yield _sse_frame({"error": str(e)})
+    finally:
+        # 包括客户端断开时服务器关闭本生成器的情况
+        stream_registry.release(stream)
 
 
-@ai_bp.get("/models")
-def list_models():
-    """获取本地 Ollama 模型列表"""
+def _batch_sse_stream(requests: list[AIRequest]) -> Iterable[str]:
+    """并发执行多个灵感请求，按完成顺序逐条推送，每条带上序号与类型。"""
+    tokens = [CancelToken() for _ in requests]
+    futures = {
+        brainstorm_executor.submit(ai_service.generate, req, None, token): i
+        for i, (req, token) in enumerate(zip(requests, tokens))
+    }
     try:
-        models = ai_service.get_ollama_models()
-        return jsonify({"code": "OK", "data": models})
+        for future in as_completed(futures):
+            index = futures[future]
+            payload: dict = {"index": index, "type": requests[index].mode}
+            try:
+                payload["content"] = future.result()
+            except Exception as e:
+                payload["error"] = str(e)
+            yield _sse_frame(payload)
+        yield _sse_frame("[DONE]")
+    finally:
+        # 客户端提前断开时，尚未开始的请求不再执行，进行中的请求关闭上游连接
+        for future in futures:
+            future.cancel()
+        for token in tokens:
+            token.cancel()
+
+
+async def _asse_stream(stream: ResumableStream, after: int = 0) -> AsyncIterable[str]:
+    stream.attach()
+    sent_position = None
+    try:
+        if after == 0:
+            yield _sse_frame({"stream_id": stream.id}, f"{stream.id}:0")
+        async for event in stream.asubscribe(after):
+            if event is None:
+                if stream.queue_position != sent_position:
+                    sent_position = stream.queue_position
+                    yield _queue_frame(stream)
+                continue
+            seq, chunk = event
+            yield _sse_frame(chunk if isinstance(chunk, dict) else {"content": chunk}, f"{stream.id}:{seq}")
+        if stream.cancel_reason:
+            yield _cancelled_frame(stream)
+        yield _sse_frame("[DONE]")
     except Exception as e:
-        return jsonify({"code": "ERROR", "message": str(e)}), 500
+        yield _sse_frame({"error": str(e)})
+    finally:
+        stream_registry.release(stream)
 
 
-@ai_bp.post("/generate")
-def generate():
-    data = request.get_json(silent=True) or {}
-    key = request.remote_addr or "anonymous"
-    result = limiter.check(key)
-    if not result.allowed:
-        return (
-            jsonify(
-                {
-                    "code": "RATE_LIMITED",
-                    "message": "请求过于频繁",
-                    "data": {"reset_in_seconds": result.reset_in_seconds},
-                }
-            ),
-            429,
-        )
+def check_rate_limit(key: str, cost: int = 1) -> dict | None:
+    """超出频率限制时返回错误响应体，否则返回 None。cost 为本次计入的请求数（如批量请求的项数）。"""
+    result = limiter.check(key, cost)
+    if result.allowed:
+        return None
+    return {
+        "code": "RATE_LIMITED",
+        "message": "请求过于频繁",
+        "data": {"reset_in_seconds": result.reset_in_seconds},
+    }
+
+
+def _parse_temperature(value) -> float | None:
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    return None
+
 
+def _parse_novel_id(value) -> int | None:
+    try:
+        return int(value) if value else None
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_generate_request(data: dict) -> AIRequest:
+    """解析 /generate 请求体；提供 novel_id 时会查询数据库补全上下文。"""
     mode = str(data.get("mode", "continue"))
     context = data.get("context") if isinstance(data.get("context"), dict) else {}
     stream = bool(data.get("stream", True))
@@ -61,13 +200,24 @@ def generate():
     model = data.get("model")
     api_key = data.get("api_key")
     base_url = data.get("base_url")
+    temperature = _parse_temperature(data.get("temperature"))
+    use_cache = data.get("cache", True) is not False
+    hedge = data.get("hedge") if isinstance(data.get("hedge"), (bool, dict)) else None
+    chunked = data.get("chunked") if isinstance(data.get("chunked"), (bool, dict)) else None
     novel_id = data.get("novel_id")
+    prompt_layout = data.get("prompt_layout") if data.get("prompt_layout") in ("split", "inline") else None
 
     # 如果提供了 novel_id，自动构建上下文
     if novel_id:
         try:
             with SessionLocal() as db:
-                novel_context = build_context_for_novel(db, int(novel_id))
+                query = context.get("target_text") or context.get("previous_text")
+                novel_context = get_context_for_novel(
+                    db,
+                    int(novel_id),
+                    query=query if isinstance(query, str) else None,
+                    retrieve=uses_related_passages(mode),
+                )
                 # 合并上下文，前端传来的优先级更高（如果有）
                 for k, v in novel_context.items():
                     if k not in context:
@@ -75,43 +225,216 @@ def generate():
         except Exception as e:
             print(f"Error building context: {e}")
 
-    req = AIRequest(
-        mode=mode, 
-        context=context, 
-        stream=stream, 
-        provider=provider, 
+    return AIRequest(
+        mode=mode,
+        context=context,
+        stream=stream,
+        provider=provider,
         model=model,
         api_key=api_key,
-        base_url=base_url
+        base_url=base_url,
+        temperature=temperature,
+        use_cache=use_cache,
+        hedge=hedge,
+        chunked=chunked,
+        novel_id=_parse_novel_id(novel_id),
+        prompt_layout=prompt_layout,
     )
-    if stream:
-        return Response(_sse_stream(ai_service.stream(req)), mimetype="text/event-stream")
 
-    content = ai_service.generate(req)
-    return jsonify({"code": "OK", "data": {"content": content}})
 
+def parse_candidates(data: dict, req: AIRequest) -> list[AIRequest] | None:
+    """解析 n 与 candidates（逐个候选覆盖 provider、model、temperature），返回各候选的请求；
+    只要一个结果时返回 None。参数不合法时抛出 ValueError。"""
+    overrides = data.get("candidates")
+    if overrides is None:
+        n = data.get("n", 1)
+        if not isinstance(n, int) or isinstance(n, bool) or n < 1:
+            raise ValueError("n 需为正整数")
+        if n == 1:
+            return None
+        overrides = [{}] * n
+    elif not isinstance(overrides, list) or not overrides or not all(isinstance(o, dict) for o in overrides):
+        raise ValueError("candidates 需为非空的对象数组")
+    if len(overrides) > config.max_candidates:
+        raise ValueError(f"候选数不能超过 {config.max_candidates}")
+    return [
+        replace(
+            req,
+            provider=o.get("provider") or req.provider,
+            model=o.get("model") or req.model,
+            temperature=_parse_temperature(o["temperature"]) if "temperature" in o else req.temperature,
+        )
+        for o in overrides
+    ]
 
-@ai_bp.post("/brainstorm")
-def brainstorm():
-    data = request.get_json(silent=True) or {}
+
+def admit_candidates(requests: list[AIRequest]) -> None:
+    for provider in {req.provider for req in requests}:
+        ai_service.admit(next(req for req in requests if req.provider == provider))
+
+
+def parse_brainstorm_request(data: dict) -> AIRequest:
     brainstorm_type = str(data.get("type", "outline"))
     keywords = data.get("keywords")
     provider = data.get("provider")
     model = data.get("model")
     api_key = data.get("api_key")
     base_url = data.get("base_url")
+    temperature = _parse_temperature(data.get("temperature"))
+    use_cache = data.get("cache", True) is not False
 
     if not isinstance(keywords, list):
         keywords = []
-    
-    req = AIRequest(
-        mode=brainstorm_type, 
-        context={"keywords": keywords}, 
+
+    return AIRequest(
+        mode=brainstorm_type,
+        context={"keywords": keywords},
         stream=False,
         provider=provider,
         model=model,
         api_key=api_key,
-        base_url=base_url
+        base_url=base_url,
+        temperature=temperature,
+        use_cache=use_cache,
     )
+
+
+@ai_bp.errorhandler(QueueFull)
+@ai_bp.errorhandler(QueueTimeout)
+def handle_queue_error(error):
+    body, status = queue_error(error)
+    return jsonify(body), status
+
+
+@ai_bp.errorhandler(PromptTooLong)
+def handle_prompt_too_long(error):
+    return jsonify({"code": "INVALID_INPUT", "message": str(error)}), 400
+
+
+@ai_bp.get("/models")
+def list_models():
+    """获取本地 Ollama 模型列表；detail=1 时返回大小、上下文长度、是否已加载等元数据，refresh=1 时强制刷新"""
+    refresh = request.args.get("refresh") == "1"
+    try:
+        if request.args.get("detail") == "1":
+            models = [m.to_dict() for m in ai_service.get_ollama_model_details(refresh)]
+        else:
+            models = ai_service.get_ollama_models(refresh)
+        return jsonify({"code": "OK", "data": models})
+    except Exception as e:
+        return jsonify({"code": "ERROR", "message": str(e)}), 500
+
+
+@ai_bp.get("/stats")
+def ai_stats():
+    """AI 调用层各组件的运行统计"""
+    return jsonify({"code": "OK", "data": {**ai_service.stats(), "streams": stream_registry.stats()}})
+
+
+@ai_bp.get("/cache/stats")
+def cache_stats():
+    """生成结果缓存的命中统计"""
+    return jsonify({"code": "OK", "data": ai_service.response_cache.stats()})
+
+
+@ai_bp.delete("/cache")
+def clear_cache():
+    ai_service.response_cache.clear()
+    return jsonify({"code": "OK"})
+
+
+def _resume_response(stream_id: str, after: int):
+    stream = stream_registry.get(stream_id)
+    error = resume_error(stream, after)
+    if error:
+        return jsonify(error[0]), error[1]
+    stream_registry.count_resume()
+    return Response(_sse_stream(stream, after), mimetype="text/event-stream")
+
+
+@ai_bp.get("/streams/<stream_id>")
+def resume_stream(stream_id: str):
+    """断线重连：从 Last-Event-ID 请求头（或 last_event_id 参数）之后继续推送生成内容"""
+    parsed = parse_event_id(request.headers.get("Last-Event-ID"))
+    if parsed and parsed[0] == stream_id:
+        after = parsed[1]
+    else:
+        after = request.args.get("last_event_id", 0, type=int)
+    return _resume_response(stream_id, after)
+
+
+@ai_bp.post("/streams/<stream_id>/cancel")
+def cancel_stream(stream_id: str):
+    """中止仍在进行的生成，上游连接随即关闭；已输出的内容仍可续传读取"""
+    stream = stream_registry.get(stream_id)
+    if stream is None:
+        return jsonify({"code": "NOT_FOUND", "message": "生成流不存在或已过期"}), 404
+    cancelled = stream_registry.cancel(stream_id)
+    return jsonify({"code": "OK", "data": {"cancelled": cancelled}})
+
+
+@ai_bp.post("/generate")
+def generate():
+    data = request.get_json(silent=True) or {}
+    # 带 Last-Event-ID 重新提交时续传原来的生成，而不是重新生成
+    resume = parse_event_id(request.headers.get("Last-Event-ID"))
+    if resume:
+        return _resume_response(*resume)
+    limited = check_rate_limit(request.remote_addr or "anonymous")
+    if limited:
+        return jsonify(limited), 429
+
+    req = parse_generate_request(data)
+    try:
+        candidates = parse_candidates(data, req)
+    except ValueError as e:
+        return jsonify({"code": "INVALID_INPUT", "message": str(e)}), 400
+    if candidates is not None:
+        admit_candidates(candidates)
+        if req.stream:
+            stream = start_candidates_stream(candidates, parse_coalesce_options(data))
+            return Response(_sse_stream(stream), mimetype="text/event-stream")
+        return jsonify({"code": "OK", "data": {"candidates": ai_service.generate_candidates(candidates)}})
+
+    # 排队已满时直接返回 503，而不是先建立 SSE 连接再报错；准入时算好的执行计划直接用于生成
+    plan = ai_service.admit(req)
+    if req.stream:
+        stream = start_stream(req, parse_coalesce_options(data), plan)
+        return Response(_sse_stream(stream), mimetype="text/event-stream")
+
+    content = ai_service.generate(req, plan)
+    return jsonify({"code": "OK", "data": {"content": content}})
+
+
+@ai_bp.post("/brainstorm")
+def brainstorm():
+    data = request.get_json(silent=True) or {}
+    req = parse_brainstorm_request(data)
     content = ai_service.generate(req)
     return jsonify({"code": "OK", "data": {"content": content}})
+
+
+@ai_bp.post("/brainstorm/batch")
+def brainstorm_batch():
+    """一次提交多个灵感类型（及各自的关键词），并发生成并以 SSE 按完成顺序返回"""
+    data = request.get_json(silent=True) or {}
+    items = data.get("items")
+    if not isinstance(items, list):
+        types = data.get("types")
+        items = [{"type": t} for t in types] if isinstance(types, list) else []
+    items = [item for item in items if isinstance(item, dict)]
+    if not items or len(items) > MAX_BRAINSTORM_BATCH:
+        return (
+            jsonify({"code": "INVALID_INPUT", "message": f"items 数量需在 1 到 {MAX_BRAINSTORM_BATCH} 之间"}),
+            400,
+        )
+
+    # 每一项都是一次模型调用，按项数计入频率限制
+    limited = check_rate_limit(request.remote_addr or "anonymous", len(items))
+    if limited:
+        return jsonify(limited), 429
+
+    # 顶层字段（关键词、模型等）作为每一项的默认值
+    defaults = {k: v for k, v in data.items() if k not in ("items", "types")}
+    requests = [parse_brainstorm_request({**defaults, **item}) for item in items]
+    return Response(_batch_sse_stream(requests), mimetype="text/event-stream")
@@ -0,0 +1,83 @@
+from __future__ import annotations
+
+from flask import Blueprint, jsonify, request
+from sqlalchemy import select
+
+from .. import job_types  # noqa: F401  注册任务类型
+from ..database import SessionLocal
+from ..jobs import FINISHED, SUCCEEDED, job_queue, job_to_dict
+from ..models import Job
+
+
+job_bp = Blueprint("jobs", __name__, url_prefix="/api/jobs")
+
+MAX_LIST_LIMIT = 100
+
+
+@job_bp.post("")
+def create_job():
+    data = request.get_json(silent=True) or {}
+    job_type = data.get("type")
+    if job_type not in job_queue.types:
+        return (
+            jsonify({"code": "INVALID_INPUT", "message": f"type 需为以下之一：{'、'.join(job_queue.types)}"}),
+            400,
+        )
+    payload = data.get("payload") or {}
+    if not isinstance(payload, dict):
+        return jsonify({"code": "INVALID_INPUT", "message": "payload 需为对象"}), 400
+    novel_id = data.get("novel_id")
+    if novel_id is not None and not isinstance(novel_id, int):
+        return jsonify({"code": "INVALID_INPUT", "message": "novel_id 需为整数"}), 400
+    job_id = job_queue.enqueue(job_type, payload, novel_id)
+    return jsonify({"code": "OK", "data": {"id": job_id}}), 202
+
+
+@job_bp.get("")
+def list_jobs():
+    limit = min(request.args.get("limit", 20, type=int), MAX_LIST_LIMIT)
+    query = select(Job).order_by(Job.id.desc()).limit(max(1, limit))
+    if request.args.get("type"):
+        query = query.where(Job.job_type == request.args["type"])
+    if request.args.get("status"):
+        query = query.where(Job.status == request.args["status"])
+    novel_id = request.args.get("novel_id", type=int)
+    if novel_id is not None:
+        query = query.where(Job.novel_id == novel_id)
+    with SessionLocal() as db:
+        jobs = db.scalars(query).all()
+        return jsonify({"code": "OK", "data": [job_to_dict(j) for j in jobs]})
+
+
+@job_bp.get("/stats")
+def job_stats():
+    return jsonify({"code": "OK", "data": job_queue.stats()})
+
+
+@job_bp.get("/<int:job_id>")
+def get_job(job_id: int):
+    with SessionLocal() as db:
+        job = db.get(Job, job_id)
+        if job is None:
+            return jsonify({"code": "NOT_FOUND", "message": "任务不存在"}), 404
+        return jsonify({"code": "OK", "data": job_to_dict(job)})
+
+
+@job_bp.get("/<int:job_id>/result")
+def get_job_result(job_id: int):
+    with SessionLocal() as db:
+        job = db.get(Job, job_id)
+        if job is None:
+            return jsonify({"code": "NOT_FOUND", "message": "任务不存在"}), 404
+        if job.status != SUCCEEDED:
+            message = "任务未成功完成" if job.status in FINISHED else "任务尚未完成"
+            return jsonify({"code": "NOT_READY", "message": message, "data": job_to_dict(job)}), 409
+        return jsonify({"code": "OK", "data": job_to_dict(job, include_result=True)})
+
+
+@job_bp.post("/<int:job_id>/cancel")
+def cancel_job(job_id: int):
+    with SessionLocal() as db:
+        if db.get(Job, job_id) is None:
+            return jsonify({"code": "NOT_FOUND", "message": "任务不存在"}), 404
+    return jsonify({"code": "OK", "data": {"cancelled": job_queue.cancel(job_id)}})
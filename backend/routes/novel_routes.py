@@ -1,52 +1,97 @@
 from __future__ import annotations
 
+from datetime import datetime
 from io import BytesIO
 from flask import Blueprint, jsonify, request, send_file
-from sqlalchemy import select
+from sqlalchemy import delete, func, select
 from docx import Document
 
 from ..database import SessionLocal
-from ..models import Chapter, Novel, Character, Idea, ChapterVersion
+from ..models import Chapter, Novel, Character, Idea, ChapterVersion, ChapterBatchResult, NovelStats
+from ..retrieval import retrieval_index
+from ..revisions import bump_novel_revision
+from ..stats import global_stats, novel_stats, record_change, record_novel_created, record_novel_deleted
+from ..utils.hashing import content_hash
 
 
 novel_bp = Blueprint("novels", __name__, url_prefix="/api")
 
+VERSION_PREVIEW_CHARS = 80
+
+# 列表接口可通过 ?fields= 选择的字段；只查询用到的列，不读取正文
+NOVEL_FIELDS = {
+    "id": Novel.id,
+    "title": Novel.title,
+    "summary": Novel.summary,
+    "tags": Novel.tags,
+    "created_at": Novel.created_at,
+    "updated_at": Novel.updated_at,
+    "chapter_count": NovelStats.chapter_count,
+    "character_count": NovelStats.character_count,
+    "word_count": NovelStats.word_count,
+    "last_edited_at": NovelStats.last_edited_at,
+}
+NOVEL_DEFAULT_FIELDS = ["id", "title", "summary", "tags", "updated_at"]
+CHAPTER_FIELDS = {
+    "id": Chapter.id,
+    "novel_id": Chapter.novel_id,
+    "title": Chapter.title,
+    "order_index": Chapter.order_index,
+    "created_at": Chapter.created_at,
+    "updated_at": Chapter.updated_at,
+    # 由数据库计算，正文不会传回应用
+    "length": func.length(Chapter.content),
+}
+CHAPTER_DEFAULT_FIELDS = ["id", "title", "order_index", "updated_at"]
+
+
+def _parse_fields(allowed: dict, default: list[str]) -> list[str]:
+    """解析 ?fields=a,b，未提供时返回默认字段；id 总是包含在内。字段未知时抛出 ValueError。"""
+    raw = request.args.get("fields")
+    if not raw:
+        return default
+    fields = [name.strip() for name in raw.split(",") if name.strip()]
+    unknown = [name for name in fields if name not in allowed]
+    if unknown:
+        raise ValueError(f"未知字段：{'、'.join(unknown)}，可选：{'、'.join(allowed)}")
+    return ["id"] + [name for name in dict.fromkeys(fields) if name != "id"]
+
+
+def _row_to_dict(fields: list[str], row) -> dict:
+    return {
+        name: value.isoformat() if isinstance(value, datetime) else value
+        for name, value in zip(fields, row)
+    }
+
 
 @novel_bp.get("/stats")
 def get_stats():
+    # 统计由写接口增量维护，这里只读一行
     with SessionLocal() as db:
-        novel_count = db.query(Novel).count()
-        chapter_count = db.query(Chapter).count()
-        character_count = db.query(Character).count()
-        # 简单估算字数
-        all_chapters = db.scalars(select(Chapter)).all()
-        word_count = sum(len(c.content) for c in all_chapters if c.content)
-        
-    return jsonify({
-        "code": "OK", 
-        "data": {
-            "novel_count": novel_count,
-            "chapter_count": chapter_count,
-            "character_count": character_count,
-            "word_count": word_count
-        }
-    })
+        data = global_stats(db)
+    return jsonify({"code": "OK", "data": data})
+
+
+@novel_bp.get("/novels/<int:novel_id>/stats")
+def get_novel_stats(novel_id: int):
+    with SessionLocal() as db:
+        if db.get(Novel, novel_id) is None:
+            return jsonify({"code": "NOT_FOUND", "message": "小说不存在"}), 404
+        data = novel_stats(db, novel_id)
+    return jsonify({"code": "OK", "data": data})
 
 
 @novel_bp.get("/novels")
 def list_novels():
+    try:
+        fields = _parse_fields(NOVEL_FIELDS, NOVEL_DEFAULT_FIELDS)
+    except ValueError as e:
+        return jsonify({"code": "INVALID_INPUT", "message": str(e)}), 400
+    query = select(*(NOVEL_FIELDS[name] for name in fields)).order_by(Novel.updated_at.desc())
+    if any(NOVEL_FIELDS[name].class_ is NovelStats for name in fields):
+        query = query.select_from(Novel).outerjoin(NovelStats, NovelStats.novel_id == Novel.id)
     with SessionLocal() as db:
-        novels = db.scalars(select(Novel).order_by(Novel.updated_at.desc())).all()
-        data = [
-            {
-                "id": n.id,
-                "title": n.title,
-                "summary": n.summary,
-                "tags": n.tags,
-                "updated_at": n.updated_at.isoformat(),
-            }
-            for n in novels
-        ]
+        data = [_row_to_dict(fields, row) for row in db.execute(query)]
     return jsonify({"code": "OK", "data": data})
 
 
@@ -61,6 +106,8 @@ def create_novel():
     with SessionLocal() as db:
         novel = Novel(owner_id=1, title=title, summary=summary, tags=tags)
         db.add(novel)
+        db.flush()
+        record_novel_created(db, novel.id)
         db.commit()
         db.refresh(novel)
     return jsonify({"code": "OK", "data": {"id": novel.id}})
@@ -87,6 +134,7 @@ def update_novel(novel_id: int):
             
         db.add(novel)
         db.commit()
+    bump_novel_revision(novel_id)
     return jsonify({"code": "OK"})
 
 
@@ -99,8 +147,11 @@ def delete_novel(novel_id: int):
             # but usually it's better to rely on DB constraints or manual cleanup if needed.
             # Assuming models are defined with cascade or we just delete the novel and DB handles it (or orphan records remain).
             # For simplicity let's just delete the novel object.
+            record_novel_deleted(db, novel_id)
             db.delete(novel)
             db.commit()
+    bump_novel_revision(novel_id)
+    retrieval_index.drop_novel(novel_id)
     return jsonify({"code": "OK"})
 
 
@@ -194,14 +245,17 @@ def delete_idea(idea_id: int):
 
 @novel_bp.get("/novels/<int:novel_id>/chapters")
 def list_chapters(novel_id: int):
+    try:
+        fields = _parse_fields(CHAPTER_FIELDS, CHAPTER_DEFAULT_FIELDS)
+    except ValueError as e:
+        return jsonify({"code": "INVALID_INPUT", "message": str(e)}), 400
+    query = (
+        select(*(CHAPTER_FIELDS[name] for name in fields))
+        .where(Chapter.novel_id == novel_id)
+        .order_by(Chapter.order_index.asc())
+    )
     with SessionLocal() as db:
-        chapters = db.scalars(
-            select(Chapter).where(Chapter.novel_id == novel_id).order_by(Chapter.order_index.asc())
-        ).all()
-        data = [
-            {"id": c.id, "title": c.title, "order_index": c.order_index, "updated_at": c.updated_at.isoformat()}
-            for c in chapters
-        ]
+        data = [_row_to_dict(fields, row) for row in db.execute(query)]
     return jsonify({"code": "OK", "data": data})
 
 
@@ -216,8 +270,10 @@ def create_chapter(novel_id: int):
         next_index = (last.order_index + 1) if last else 1
         chapter = Chapter(novel_id=novel_id, title=title, order_index=next_index, content="")
         db.add(chapter)
+        record_change(db, novel_id, chapters=1)
         db.commit()
         db.refresh(chapter)
+    bump_novel_revision(novel_id)
     return jsonify({"code": "OK", "data": {"id": chapter.id}})
 
 
@@ -240,32 +296,47 @@ def update_chapter(chapter_id: int):
         chapter = db.get(Chapter, chapter_id)
         if not chapter:
             return jsonify({"code": "NOT_FOUND", "message": "章节不存在"}), 404
+        old_content = chapter.content
         if isinstance(content, str):
             chapter.content = content
         if isinstance(title, str) and title.strip():
             chapter.title = title.strip()
+        novel_id = chapter.novel_id
+        content = chapter.content
         db.add(chapter)
+        record_change(db, novel_id, old_text=old_content, new_text=content)
         db.commit()
+    bump_novel_revision(novel_id)
+    retrieval_index.update_chapter(novel_id, chapter_id, content)
     return jsonify({"code": "OK"})
 
 
 @novel_bp.delete("/chapters/<int:chapter_id>")
 def delete_chapter(chapter_id: int):
+    novel_id = None
     with SessionLocal() as db:
         chapter = db.get(Chapter, chapter_id)
         if chapter:
+            novel_id = chapter.novel_id
+            record_change(db, novel_id, chapters=-1, old_text=chapter.content)
             db.delete(chapter)
             db.commit()
+            retrieval_index.remove_chapter(novel_id, chapter_id)
+    bump_novel_revision(novel_id)
     return jsonify({"code": "OK"})
 
 
 @novel_bp.delete("/characters/<int:char_id>")
 def delete_character(char_id: int):
+    novel_id = None
     with SessionLocal() as db:
         char = db.get(Character, char_id)
         if char:
+            novel_id = char.novel_id
+            record_change(db, novel_id, characters=-1)
             db.delete(char)
             db.commit()
+    bump_novel_revision(novel_id)
     return jsonify({"code": "OK"})
 
 
@@ -294,8 +365,10 @@ def create_character(novel_id: int):
     with SessionLocal() as db:
         char = Character(novel_id=novel_id, name=name, profile=profile)
         db.add(char)
+        record_change(db, novel_id, characters=1)
         db.commit()
         db.refresh(char)
+    bump_novel_revision(novel_id)
     return jsonify({"code": "OK", "data": {"id": char.id}})
 
 
@@ -315,13 +388,19 @@ def update_character(char_id: int):
         if isinstance(profile, str):
             char.profile = profile
             
+        novel_id = char.novel_id
         db.add(char)
+        record_change(db, novel_id)
         db.commit()
+    bump_novel_revision(novel_id)
     return jsonify({"code": "OK"})
 
 
 @novel_bp.get("/chapters/<int:chapter_id>/versions")
 def list_chapter_versions(chapter_id: int):
+    """版本列表只返回摘要，不载入正文；content=1 时兼容旧格式返回完整正文。"""
+    if request.args.get("content") != "1":
+        return jsonify({"code": "OK", "data": _version_summaries(chapter_id)})
     with SessionLocal() as db:
         versions = db.scalars(
             select(ChapterVersion)
@@ -331,7 +410,7 @@ def list_chapter_versions(chapter_id: int):
         data = [
             {
                 "id": v.id,
-                "content": v.content, # Optionally exclude content for list if too large
+                "content": v.content,
                 "note": v.note,
                 "created_at": v.created_at.isoformat()
             }
@@ -340,6 +419,51 @@ def list_chapter_versions(chapter_id: int):
     return jsonify({"code": "OK", "data": data})
 
 
+def _version_summaries(chapter_id: int) -> list[dict]:
+    """版本摘要：长度与开头预览由数据库计算，哈希读取已存的值（旧数据在 init_db 时补齐），不载入正文。"""
+    with SessionLocal() as db:
+        rows = db.execute(
+            select(
+                ChapterVersion.id,
+                ChapterVersion.note,
+                ChapterVersion.created_at,
+                func.length(ChapterVersion.content),
+                ChapterVersion.content_hash,
+                func.substr(ChapterVersion.content, 1, VERSION_PREVIEW_CHARS),
+            )
+            .where(ChapterVersion.chapter_id == chapter_id)
+            .order_by(ChapterVersion.created_at.desc())
+        ).all()
+    return [
+        {
+            "id": version_id,
+            "note": note,
+            "created_at": created_at.isoformat(),
+            "length": length or 0,
+            "hash": digest,
+            "preview": preview or "",
+        }
+        for version_id, note, created_at, length, digest, preview in rows
+    ]
+
+
+@novel_bp.get("/versions/<int:version_id>")
+def get_chapter_version(version_id: int):
+    with SessionLocal() as db:
+        version = db.get(ChapterVersion, version_id)
+        if not version:
+            return jsonify({"code": "NOT_FOUND", "message": "版本不存在"}), 404
+        data = {
+            "id": version.id,
+            "chapter_id": version.chapter_id,
+            "content": version.content,
+            "note": version.note,
+            "hash": version.content_hash or content_hash(version.content),
+            "created_at": version.created_at.isoformat(),
+        }
+    return jsonify({"code": "OK", "data": data})
+
+
 @novel_bp.post("/chapters/<int:chapter_id>/versions")
 def create_chapter_version(chapter_id: int):
     body = request.get_json(silent=True) or {}
@@ -376,10 +500,16 @@ def restore_chapter_version(chapter_id: int, version_id: int):
              
         # Optional: Create a backup of current state before restoring?
         # For now, just overwrite
+        old_content = chapter.content
         chapter.content = version.content
+        novel_id = chapter.novel_id
+        content = chapter.content
         db.add(chapter)
+        record_change(db, novel_id, old_text=old_content, new_text=content)
         db.commit()
         
+    bump_novel_revision(novel_id)
+    retrieval_index.update_chapter(novel_id, chapter_id, content)
     return jsonify({"code": "OK"})
 
 
@@ -388,6 +518,8 @@ def delete_chapter_version(version_id: int):
     with SessionLocal() as db:
         version = db.get(ChapterVersion, version_id)
         if version:
+            # 删除批量任务生成的版本后清除处理记录，再次运行同样设置的任务时会重新处理该章
+            db.execute(delete(ChapterBatchResult).where(ChapterBatchResult.version_id == version_id))
             db.delete(version)
             db.commit()
     return jsonify({"code": "OK"})
@@ -0,0 +1,235 @@
+from __future__ import annotations
+
+import asyncio
+import itertools
+import time
+from threading import Event, Lock
+from typing import Callable
+
+from .utils.streams import CancelToken
+
+
+# 优先级：数值越小越先执行
+PRIORITIES = {"interactive": 0, "normal": 1, "background": 2}
+
+# 排队位置变化的检查间隔（秒）
+POSITION_POLL_SECONDS = 0.5
+
+
+class QueueFull(Exception):
+    """等待队列已满，请求被直接拒绝。"""
+
+    def __init__(self, provider_key: str, queue_size: int) -> None:
+        super().__init__(f"{provider_key} 排队请求已满（{queue_size}），请稍后重试")
+        self.provider_key = provider_key
+        self.queue_size = queue_size
+
+
+class QueueTimeout(Exception):
+    """排队超过等待上限仍未轮到。"""
+
+
+class _Waiter:
+    def __init__(self, priority: int, seq: int, wake: Callable[[], None]) -> None:
+        self.priority = priority
+        self.seq = seq
+        self.wake = wake
+        self.enqueued_at = time.monotonic()
+        self.granted = False
+
+
+class _Lane:
+    def __init__(self, limit: int) -> None:
+        self.limit = limit
+        self.active = 0
+        self.waiters: list[_Waiter] = []
+        self.counters = {"admitted": 0, "queued": 0, "rejected": 0, "timeouts": 0, "abandoned": 0}
+        self.waited = 0
+        self.wait_seconds = 0.0
+
+
+class LLMScheduler:
+    """按 provider 限制同时进行的模型调用数，超出的请求按优先级排队。
+    等待越久优先级越高（每 aging_seconds 提升一级），避免后台任务一直得不到执行；
+    队列已满时立即拒绝，而不是让所有请求一起变慢直到超时。队列容量只计算优先级不低于新请求的排队者，
+    后台任务排满队列也不会挡住交互请求；后台任务排队不受等待时间上限限制。"""
+
+    def __init__(
+        self,
+        limits: dict[str, int],
+        max_queue: int,
+        timeout_seconds: float,
+        aging_seconds: float = 30,
+    ) -> None:
+        self._limits = limits
+        self._max_queue = max(0, max_queue)
+        self._timeout = timeout_seconds
+        self._aging = max(1.0, aging_seconds)
+        self._lock = Lock()
+        self._lanes: dict[str, _Lane] = {}
+        self._seq = itertools.count()
+
+    def _lane(self, key: str) -> _Lane:
+        lane = self._lanes.get(key)
+        if lane is None:
+            lane = self._lanes[key] = _Lane(self._limits.get(key, 0))
+        return lane
+
+    def _rank(self, waiter: _Waiter, now: float) -> tuple[float, int]:
+        return waiter.priority - (now - waiter.enqueued_at) / self._aging, waiter.seq
+
+    def _position(self, lane: _Lane, waiter: _Waiter) -> int:
+        now = time.monotonic()
+        rank = self._rank(waiter, now)
+        return 1 + sum(1 for w in lane.waiters if self._rank(w, now) < rank)
+
+    def _full(self, lane: _Lane, priority: int) -> bool:
+        if lane.limit <= 0 or lane.active < lane.limit:
+            return False
+        return sum(1 for w in lane.waiters if w.priority <= priority) >= self._max_queue
+
+    def _deadline(self, waiter: _Waiter) -> float | None:
+        if waiter.priority >= PRIORITIES["background"]:
+            return None
+        return waiter.enqueued_at + self._timeout
+
+    def limit(self, key: str) -> int:
+        """provider 的并发上限，0 表示不限。"""
+        return self._limits.get(key, 0)
+
+    def check(self, key: str, priority: int = PRIORITIES["normal"]) -> None:
+        """提前检查能否接受新请求，队列已满时抛出 QueueFull。"""
+        with self._lock:
+            lane = self._lane(key)
+            if self._full(lane, priority):
+                lane.counters["rejected"] += 1
+                raise QueueFull(key, self._max_queue)
+
+    def _enqueue(self, key: str, priority: int, wake: Callable[[], None]) -> _Waiter | None:
+        """有空位且无人排队时直接占用（返回 None），否则加入队列。"""
+        with self._lock:
+            lane = self._lane(key)
+            if lane.limit <= 0 or (lane.active < lane.limit and not lane.waiters):
+                lane.active += 1
+                lane.counters["admitted"] += 1
+                return None
+            if self._full(lane, priority):
+                lane.counters["rejected"] += 1
+                raise QueueFull(key, self._max_queue)
+            waiter = _Waiter(priority, next(self._seq), wake)
+            lane.waiters.append(waiter)
+            lane.counters["queued"] += 1
+            return waiter
+
+    def _grant_next(self, lane: _Lane) -> None:
+        while lane.waiters and lane.active < lane.limit:
+            now = time.monotonic()
+            waiter = min(lane.waiters, key=lambda w: self._rank(w, now))
+            lane.waiters.remove(waiter)
+            lane.active += 1
+            lane.counters["admitted"] += 1
+            lane.waited += 1
+            lane.wait_seconds += now - waiter.enqueued_at
+            waiter.granted = True
+            waiter.wake()
+
+    def _poll(self, key: str, waiter: _Waiter) -> int:
+        """返回当前排队位置，已轮到时返回 0。"""
+        with self._lock:
+            if waiter.granted:
+                return 0
+            return self._position(self._lane(key), waiter)
+
+    def _abandon(self, key: str, waiter: _Waiter, counter: str) -> None:
+        with self._lock:
+            lane = self._lane(key)
+            if waiter.granted:
+                # 放弃的同时刚好轮到：归还名额
+                lane.active -= 1
+                self._grant_next(lane)
+            else:
+                lane.waiters.remove(waiter)
+            lane.counters[counter] += 1
+
+    def acquire(
+        self,
+        key: str,
+        priority: int,
+        cancel: CancelToken | None = None,
+        on_queue: Callable[[int], None] | None = None,
+    ) -> bool:
+        """占用一个名额；排队期间位置变化时回调 on_queue(位置)，轮到时回调 on_queue(0)。
+        排队期间被取消返回 False。"""
+        event = Event()
+        waiter = self._enqueue(key, priority, event.set)
+        if waiter is None:
+            return True
+        unregister = cancel.on_cancel(event.set) if cancel is not None else None
+        try:
+            deadline = self._deadline(waiter)
+            reported = None
+            while True:
+                position = self._poll(key, waiter)
+                if position and cancel is not None and cancel.cancelled:
+                    self._abandon(key, waiter, "abandoned")
+                    return False
+                if position != reported and on_queue is not None:
+                    on_queue(position)
+                    reported = position
+                if not position:
+                    return True
+                remaining = POSITION_POLL_SECONDS if deadline is None else deadline - time.monotonic()
+                if remaining <= 0:
+                    self._abandon(key, waiter, "timeouts")
+                    raise QueueTimeout(f"排队超过 {self._timeout:g} 秒，请稍后重试")
+                event.wait(min(remaining, POSITION_POLL_SECONDS))
+        finally:
+            if unregister is not None:
+                unregister()
+
+    async def aacquire(self, key: str, priority: int, on_queue: Callable[[int], None] | None = None) -> None:
+        """acquire 的异步版本，通过取消任务放弃排队。"""
+        loop = asyncio.get_running_loop()
+        woken = asyncio.Event()
+        waiter = self._enqueue(key, priority, lambda: loop.call_soon_threadsafe(woken.set))
+        if waiter is None:
+            return
+        deadline = self._deadline(waiter)
+        reported = None
+        try:
+            while True:
+                position = self._poll(key, waiter)
+                if position != reported and on_queue is not None:
+                    on_queue(position)
+                    reported = position
+                if not position:
+                    return
+                remaining = POSITION_POLL_SECONDS if deadline is None else deadline - time.monotonic()
+                if remaining <= 0:
+                    raise QueueTimeout(f"排队超过 {self._timeout:g} 秒，请稍后重试")
+                try:
+                    await asyncio.wait_for(woken.wait(), min(remaining, POSITION_POLL_SECONDS))
+                except asyncio.TimeoutError:
+                    pass
+        except BaseException as e:
+            self._abandon(key, waiter, "timeouts" if isinstance(e, QueueTimeout) else "abandoned")
+            raise
+
+    def release(self, key: str) -> None:
+        with self._lock:
+            lane = self._lane(key)
+            lane.active -= 1
+            self._grant_next(lane)
+
+    def stats(self) -> dict[str, dict[str, object]]:
+        with self._lock:
+            return {
+                key: {
+                    "limit": lane.limit,
+                    "active": lane.active,
+                    "waiting": len(lane.waiters),
+                    **lane.counters,
+                    "avg_wait_ms": round(lane.wait_seconds / lane.waited * 1000, 1) if lane.waited else 0.0,
+                }
+                for key, lane in self._lanes.items()
+            }
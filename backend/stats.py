@@ -0,0 +1,161 @@
+"""小说与全站统计：写接口在各自的事务中累加增量，/api/stats 只读一行。
+
+统计与实际数据出现偏差时（如直接改库）可全量重建：python -m backend.stats rebuild
+"""
+from __future__ import annotations
+
+import re
+import sys
+from datetime import datetime
+
+from sqlalchemy import delete, func, select, update
+from sqlalchemy.orm import Session
+
+from .database import SessionLocal, init_db
+from .models import Chapter, Character, GlobalStats, Novel, NovelStats
+
+GLOBAL_ID = 1
+COUNTERS = ("chapter_count", "character_count", "word_count", "cjk_count")
+
+_CJK_RE = re.compile("[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\U00020000-\U0002fa1f]")
+
+
+def text_counts(text: str | None) -> tuple[int, int]:
+    """返回 (字数, 汉字数)；字数沿用原来的估算方式，即正文长度。"""
+    text = text or ""
+    return len(text), len(_CJK_RE.findall(text))
+
+
+def _apply(db: Session, model: type, key, deltas: dict[str, int], now: datetime) -> bool:
+    values: dict[str, object] = {name: getattr(model, name) + delta for name, delta in deltas.items() if delta}
+    values["last_edited_at"] = now
+    # 用 col = col + delta 的原子更新，并发写入不会互相覆盖
+    return bool(db.execute(update(model).where(key).values(**values)).rowcount)
+
+
+def record_change(
+    db: Session,
+    novel_id: int,
+    *,
+    chapters: int = 0,
+    characters: int = 0,
+    old_text: str | None = None,
+    new_text: str | None = None,
+) -> None:
+    """在调用方的事务中累加统计增量，随调用方一起提交。old_text/new_text 为章节正文的修改前后内容。"""
+    old_words, old_cjk = text_counts(old_text)
+    new_words, new_cjk = text_counts(new_text)
+    deltas = {
+        "chapter_count": chapters,
+        "character_count": characters,
+        "word_count": new_words - old_words,
+        "cjk_count": new_cjk - old_cjk,
+    }
+    now = datetime.utcnow()
+    if not _apply(db, NovelStats, NovelStats.novel_id == novel_id, deltas, now):
+        db.add(NovelStats(novel_id=novel_id, last_edited_at=now, **deltas))
+    if not _apply(db, GlobalStats, GlobalStats.id == GLOBAL_ID, deltas, now):
+        db.add(GlobalStats(id=GLOBAL_ID, novel_count=0, last_edited_at=now, **deltas))
+
+
+def record_novel_created(db: Session, novel_id: int) -> None:
+    db.add(NovelStats(novel_id=novel_id))
+    updated = db.execute(
+        update(GlobalStats).where(GlobalStats.id == GLOBAL_ID).values(novel_count=GlobalStats.novel_count + 1)
+    ).rowcount
+    if not updated:
+        db.add(GlobalStats(id=GLOBAL_ID, novel_count=1))
+
+
+def record_novel_deleted(db: Session, novel_id: int) -> None:
+    """从全站统计中减去该小说的部分；需在删除小说的同一事务中调用。"""
+    stats = db.get(NovelStats, novel_id)
+    values: dict[str, object] = {"novel_count": GlobalStats.novel_count - 1}
+    if stats is not None:
+        values.update({name: getattr(GlobalStats, name) - getattr(stats, name) for name in COUNTERS})
+        db.delete(stats)
+    db.execute(update(GlobalStats).where(GlobalStats.id == GLOBAL_ID).values(**values))
+
+
+def rebuild(db: Session) -> GlobalStats:
+    """按实际数据重新计算全部统计。正文按章逐条读取，不会一次性载入整张表。"""
+    per_novel: dict[int, dict[str, int]] = {
+        novel_id: dict.fromkeys(COUNTERS, 0) for novel_id in db.scalars(select(Novel.id))
+    }
+    last_edited: dict[int, datetime] = {}
+    rows = db.execute(
+        select(Chapter.novel_id, Chapter.content, Chapter.updated_at).execution_options(yield_per=200)
+    )
+    for novel_id, content, updated_at in rows:
+        counts = per_novel.get(novel_id)
+        if counts is None:
+            continue
+        words, cjk = text_counts(content)
+        counts["chapter_count"] += 1
+        counts["word_count"] += words
+        counts["cjk_count"] += cjk
+        if updated_at and (novel_id not in last_edited or updated_at > last_edited[novel_id]):
+            last_edited[novel_id] = updated_at
+    character_rows = db.execute(
+        select(Character.novel_id, func.count(), func.max(Character.updated_at)).group_by(Character.novel_id)
+    )
+    for novel_id, count, updated_at in character_rows:
+        if novel_id in per_novel:
+            per_novel[novel_id]["character_count"] = count
+            if updated_at and (novel_id not in last_edited or updated_at > last_edited[novel_id]):
+                last_edited[novel_id] = updated_at
+
+    db.execute(delete(NovelStats))
+    db.add_all(
+        NovelStats(novel_id=novel_id, last_edited_at=last_edited.get(novel_id), **counts)
+        for novel_id, counts in per_novel.items()
+    )
+    db.execute(delete(GlobalStats))
+    totals = GlobalStats(
+        id=GLOBAL_ID,
+        novel_count=len(per_novel),
+        last_edited_at=max(last_edited.values(), default=None),
+        **{name: sum(counts[name] for counts in per_novel.values()) for name in COUNTERS},
+    )
+    db.add(totals)
+    db.commit()
+    return totals
+
+
+def ensure_stats() -> None:
+    """首次启用统计表（全站统计行不存在）时全量计算一次。"""
+    with SessionLocal() as db:
+        if db.get(GlobalStats, GLOBAL_ID) is None:
+            rebuild(db)
+
+
+def global_stats(db: Session) -> dict[str, object]:
+    stats = db.get(GlobalStats, GLOBAL_ID)
+    if stats is None:
+        stats = rebuild(db)
+    return {
+        "novel_count": stats.novel_count,
+        **{name: getattr(stats, name) for name in COUNTERS},
+        "last_edited_at": stats.last_edited_at.isoformat() if stats.last_edited_at else None,
+    }
+
+
+def novel_stats(db: Session, novel_id: int) -> dict[str, object]:
+    stats = db.get(NovelStats, novel_id) or NovelStats(novel_id=novel_id, **dict.fromkeys(COUNTERS, 0))
+    return {
+        **{name: getattr(stats, name) for name in COUNTERS},
+        "last_edited_at": stats.last_edited_at.isoformat() if stats.last_edited_at else None,
+    }
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] != ["rebuild"]:
+        print("用法：python -m backend.stats rebuild")
+        sys.exit(1)
+    init_db()
+    with SessionLocal() as session:
+        result = rebuild(session)
+        print(
+            f"Rebuilt stats: {result.novel_count} novels, {result.chapter_count} chapters, "
+            f"{result.character_count} characters, {result.word_count} words"
+        )
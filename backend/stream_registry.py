@@ -0,0 +1,428 @@
+from __future__ import annotations
+
+import asyncio
+import heapq
+import itertools
+import json
+import time
+import uuid
+from collections import OrderedDict, deque
+from threading import Condition, Lock, Thread
+from typing import AsyncIterable, AsyncIterator, Callable, Iterable, Iterator
+
+from .config import load_config
+from .utils.streams import CancelToken
+
+config = load_config()
+
+# 取消原因
+CANCEL_REQUESTED = "requested"
+CANCEL_DISCONNECTED = "disconnected"
+
+
+class StreamExpired(Exception):
+    """请求续传的事件已被淘汰出缓冲区。"""
+
+
+def _wake(future: asyncio.Future) -> None:
+    if not future.done():
+        future.set_result(None)
+
+
+def _event_size(chunk: str | dict) -> int:
+    if isinstance(chunk, dict):
+        chunk = json.dumps(chunk, ensure_ascii=False)
+    return len(chunk.encode("utf-8"))
+
+
+def _content_of(chunk: str | dict) -> tuple[object, str | None]:
+    """返回 (所属的路, 可合并的文本)：文本块属于同一路；多候选的帧按候选序号分路，只有内容帧可合并。"""
+    if isinstance(chunk, str):
+        return None, chunk
+    if set(chunk) == {"candidate", "content"}:
+        return chunk["candidate"], chunk["content"]
+    return chunk.get("candidate"), None
+
+
+class ResumableStream:
+    """一次生成的输出缓冲：上游在后台持续写入，客户端可从任意未被淘汰的事件号之后继续读取。
+    事件号从 1 开始递增；缓冲超过 max_bytes 时淘汰最早的事件（至少保留最后一个）。
+    事件为文本块，或已成形的帧（dict，如多候选生成中带候选序号的帧）。"""
+
+    def __init__(self, stream_id: str, max_bytes: int) -> None:
+        self.id = stream_id
+        self._max_bytes = max(1, max_bytes)
+        self._cond = Condition()
+        self._events: deque[tuple[int, str | dict]] = deque()
+        self._bytes = 0
+        self._last_seq = 0
+        self._done = False
+        self._error: BaseException | None = None
+        self._waiters: list[tuple[asyncio.AbstractEventLoop, asyncio.Future]] = []
+        self.finished_at: float | None = None
+        self.cancel_token = CancelToken()
+        self.cancel_reason: str | None = None
+        self._subscribers = 0
+        # 等待 provider 名额时的排队位置，0 表示已开始生成
+        self.queue_position: int | None = None
+        self._status_version = 0
+        self.released_at = 0.0
+        # 合并中的小文本块：按路缓冲，截止时间由 StreamRegistry 的清理线程负责
+        self._pending: dict[object, list[str]] = {}
+        self._pending_bytes: dict[object, int] = {}
+        self._started: set[object] = set()
+        self._flush_at: float | None = None
+
+    @property
+    def nbytes(self) -> int:
+        return self._bytes
+
+    @property
+    def done(self) -> bool:
+        return self._done
+
+    @property
+    def subscribers(self) -> int:
+        return self._subscribers
+
+    def attach(self) -> None:
+        with self._cond:
+            self._subscribers += 1
+
+    def detach(self) -> int:
+        with self._cond:
+            self._subscribers -= 1
+            if self._subscribers <= 0:
+                self.released_at = time.monotonic()
+            return self._subscribers
+
+    def set_queue_position(self, position: int) -> None:
+        with self._cond:
+            self.queue_position = position
+            self._status_version += 1
+            self._notify()
+
+    def _notify(self) -> None:
+        self._cond.notify_all()
+        for loop, future in self._waiters:
+            loop.call_soon_threadsafe(_wake, future)
+        self._waiters.clear()
+
+    def _append(self, chunk: str | dict) -> None:
+        self._last_seq += 1
+        self._events.append((self._last_seq, chunk))
+        self._bytes += _event_size(chunk)
+        while self._bytes > self._max_bytes and len(self._events) > 1:
+            _, dropped = self._events.popleft()
+            self._bytes -= _event_size(dropped)
+
+    def publish(self, chunk: str | dict) -> None:
+        with self._cond:
+            self._append(chunk)
+            self._notify()
+
+    def coalesce(self, chunk: str | dict, max_latency: float, max_bytes: int) -> float | None:
+        """合并相邻的小文本块后写入：每路的首个文本块立即写入，缓冲超过 max_bytes 字节时写入一次。
+        开始新一轮缓冲时返回截止时间，调用方需在此时调用 flush，保证缓冲内容在 max_latency 秒内发出。"""
+        key, text = _content_of(chunk)
+        with self._cond:
+            if text is None or key not in self._started:
+                self._started.add(key)
+                self._flush_key(key)
+                self._append(chunk)
+                self._notify()
+                return None
+            self._pending.setdefault(key, []).append(text)
+            self._pending_bytes[key] = self._pending_bytes.get(key, 0) + len(text.encode("utf-8"))
+            if self._pending_bytes[key] >= max_bytes:
+                self._flush_key(key)
+                self._notify()
+                return None
+            if self._flush_at is None:
+                self._flush_at = time.monotonic() + max_latency
+                return self._flush_at
+            return None
+
+    def _flush_key(self, key: object) -> None:
+        texts = self._pending.pop(key, None)
+        self._pending_bytes.pop(key, None)
+        if texts:
+            text = "".join(texts)
+            self._append(text if key is None else {"candidate": key, "content": text})
+
+    def flush(self) -> None:
+        """写入所有缓冲中的文本块。"""
+        with self._cond:
+            self._flush_at = None
+            if self._pending:
+                for key in list(self._pending):
+                    self._flush_key(key)
+                self._notify()
+
+    def finish(self, error: BaseException | None = None) -> None:
+        with self._cond:
+            self._flush_at = None
+            for key in list(self._pending):
+                self._flush_key(key)
+            self._done = True
+            self._error = error
+            self.finished_at = time.monotonic()
+            self._notify()
+
+    def can_resume(self, after: int) -> bool:
+        with self._cond:
+            first = self._events[0][0] if self._events else self._last_seq + 1
+            return first <= after + 1 and after <= self._last_seq
+
+    def _read(self, after: int) -> tuple[list[tuple[int, str | dict]], bool]:
+        first = self._events[0][0] if self._events else self._last_seq + 1
+        if after + 1 < first:
+            raise StreamExpired(f"事件 {after} 之后的内容已被淘汰")
+        start = after + 1 - first
+        pending = [self._events[i] for i in range(start, len(self._events))]
+        return pending, self._done
+
+    def subscribe(self, after: int = 0, heartbeat: float | None = None) -> Iterator[tuple[int, str | dict] | None]:
+        """排队位置变化或 heartbeat 秒内没有新事件时产出 None，
+        调用方可借机写出状态帧或心跳，以及时发现客户端断开。"""
+        seen = 0
+        while True:
+            with self._cond:
+                pending, finished = self._read(after)
+                while not pending and not finished and seen == self._status_version:
+                    if not self._cond.wait(heartbeat) and heartbeat is not None:
+                        break
+                    pending, finished = self._read(after)
+                error = self._error
+                changed = seen != self._status_version
+                seen = self._status_version
+            if changed or (not pending and not finished):
+                yield None
+            for seq, chunk in pending:
+                yield seq, chunk
+                after = seq
+            if finished:
+                if error is not None:
+                    raise error
+                return
+
+    async def asubscribe(self, after: int = 0) -> AsyncIterator[tuple[int, str | dict] | None]:
+        """排队位置变化时产出 None。"""
+        loop = asyncio.get_running_loop()
+        seen = 0
+        while True:
+            waiter = None
+            with self._cond:
+                pending, finished = self._read(after)
+                error = self._error
+                changed = seen != self._status_version
+                seen = self._status_version
+                if not pending and not finished and not changed:
+                    waiter = loop.create_future()
+                    self._waiters.append((loop, waiter))
+            if waiter is not None:
+                try:
+                    await waiter
+                finally:
+                    with self._cond:
+                        if (loop, waiter) in self._waiters:
+                            self._waiters.remove((loop, waiter))
+                continue
+            if changed:
+                yield None
+            for seq, chunk in pending:
+                yield seq, chunk
+                after = seq
+            if finished:
+                if error is not None:
+                    raise error
+                return
+
+
+class StreamRegistry:
+    """保存进行中和刚结束的生成流，供断线后按 Last-Event-ID 续传。
+    已结束的流在 ttl_seconds 后淘汰；总缓冲超过 max_total_bytes 时先淘汰最早结束的流。
+    所有订阅方断开且 disconnect_grace_seconds 内无人续传时取消生成，释放上游算力。
+    断线宽限与文本块合并的截止时间都由同一个后台清理线程处理，不为每个流单独开线程。"""
+
+    def __init__(
+        self,
+        ttl_seconds: float,
+        max_total_bytes: int,
+        stream_max_bytes: int,
+        disconnect_grace_seconds: float = 0,
+    ) -> None:
+        self._ttl = ttl_seconds
+        self._grace = max(0.0, disconnect_grace_seconds)
+        self._max_total_bytes = max_total_bytes
+        self._stream_max_bytes = stream_max_bytes
+        self._lock = Lock()
+        self._streams: OrderedDict[str, ResumableStream] = OrderedDict()
+        self._tasks: set[asyncio.Task] = set()
+        self._timers: list[tuple[float, int, Callable[[], None]]] = []
+        self._timer_cond = Condition()
+        self._timer_seq = itertools.count()
+        self._sweeper: Thread | None = None
+        self._counters = {
+            "started": 0,
+            "resumed": 0,
+            "evicted": 0,
+            f"cancelled_{CANCEL_REQUESTED}": 0,
+            f"cancelled_{CANCEL_DISCONNECTED}": 0,
+        }
+
+    def _evict(self) -> None:
+        now = time.monotonic()
+        with self._lock:
+            finished = [s for s in self._streams.values() if s.finished_at is not None]
+            expired = [s for s in finished if now - s.finished_at >= self._ttl]
+            total = sum(s.nbytes for s in self._streams.values())
+            for stream in sorted(finished, key=lambda s: s.finished_at):
+                if stream in expired or total > self._max_total_bytes:
+                    total -= stream.nbytes
+                    del self._streams[stream.id]
+                    self._counters["evicted"] += 1
+
+    def create(self) -> ResumableStream:
+        self._evict()
+        stream = ResumableStream(uuid.uuid4().hex, self._stream_max_bytes)
+        with self._lock:
+            self._streams[stream.id] = stream
+            self._counters["started"] += 1
+        return stream
+
+    def start(
+        self,
+        factory: Callable[[ResumableStream], Iterable[str | dict]],
+        coalesce: tuple[float, int] = (0.0, 0),
+    ) -> ResumableStream:
+        """在后台线程中消费 factory(流) 返回的文本块，客户端断开不影响生成继续写入缓冲。
+        factory 可借助流的 cancel_token 与 set_queue_position 响应取消、报告排队位置。
+        coalesce 为 (最长等待秒数, 字节数)，大于 0 时在写入缓冲前合并相邻的小文本块。"""
+        stream = self.create()
+        source = factory(stream)
+        Thread(target=self._pump, args=(stream, source, coalesce), name="sse-stream", daemon=True).start()
+        return stream
+
+    def astart(self, factory: Callable[[ResumableStream], AsyncIterable[str]]) -> ResumableStream:
+        """取消时直接取消后台任务。"""
+        stream = self.create()
+        source = factory(stream)
+        # 持有任务引用，避免后台任务在完成前被回收
+        task = asyncio.ensure_future(self._apump(stream, source))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        loop = asyncio.get_running_loop()
+        # 取消可能来自其他线程（如 WSGI 处理的取消接口）
+        stream.cancel_token.on_cancel(lambda: loop.call_soon_threadsafe(task.cancel))
+        return stream
+
+    def _pump(self, stream: ResumableStream, source: Iterable[str | dict], coalesce: tuple[float, int]) -> None:
+        max_latency, max_bytes = coalesce
+        try:
+            for chunk in source:
+                if max_latency <= 0:
+                    stream.publish(chunk)
+                elif (flush_at := stream.coalesce(chunk, max_latency, max_bytes)) is not None:
+                    # 上游可能长时间不产出，到期未满的缓冲由清理线程写入
+                    self._schedule(flush_at, stream.flush)
+        except Exception as e:
+            stream.finish(None if stream.cancel_token.cancelled else e)
+        else:
+            stream.finish()
+
+    @staticmethod
+    async def _apump(stream: ResumableStream, source: AsyncIterable[str]) -> None:
+        try:
+            async for chunk in source:
+                stream.publish(chunk)
+        except Exception as e:
+            stream.finish(None if stream.cancel_token.cancelled else e)
+        except BaseException:
+            # 任务被取消时也要结束流，避免订阅方一直等待；主动取消视为正常结束
+            stream.finish(None if stream.cancel_token.cancelled else RuntimeError("生成已中止"))
+            raise
+        else:
+            stream.finish()
+
+    def cancel(self, stream_id: str, reason: str = CANCEL_REQUESTED) -> bool:
+        """取消仍在生成的流；已结束或不存在时返回 False。"""
+        stream = self.get(stream_id)
+        if stream is None or stream.done or stream.cancel_token.cancelled:
+            return False
+        stream.cancel_reason = reason
+        stream.cancel_token.cancel()
+        with self._lock:
+            self._counters[f"cancelled_{reason}"] += 1
+        return True
+
+    def release(self, stream: ResumableStream) -> None:
+        """订阅方断开时调用：没有其他订阅方且宽限期内无人续传时取消生成。"""
+        if stream.detach() > 0 or stream.done:
+            return
+        if self._grace <= 0:
+            self._cancel_abandoned(stream)
+            return
+        self._schedule(stream.released_at + self._grace, lambda: self._cancel_abandoned(stream))
+
+    def _cancel_abandoned(self, stream: ResumableStream) -> None:
+        # 期间有人续传后又断开时，以最后一次断开的时间计算宽限期
+        if stream.subscribers > 0 or stream.done or time.monotonic() < stream.released_at + self._grace:
+            return
+        self.cancel(stream.id, CANCEL_DISCONNECTED)
+
+    def _schedule(self, when: float, callback: Callable[[], None]) -> None:
+        """在 when（time.monotonic() 时间）由清理线程执行 callback。"""
+        with self._timer_cond:
+            heapq.heappush(self._timers, (when, next(self._timer_seq), callback))
+            if self._sweeper is None:
+                self._sweeper = Thread(target=self._sweep, name="sse-sweeper", daemon=True)
+                self._sweeper.start()
+            self._timer_cond.notify()
+
+    def _sweep(self) -> None:
+        while True:
+            with self._timer_cond:
+                while not self._timers or self._timers[0][0] > time.monotonic():
+                    self._timer_cond.wait(self._timers[0][0] - time.monotonic() if self._timers else None)
+                _, _, callback = heapq.heappop(self._timers)
+            try:
+                callback()
+            except Exception as e:
+                print(f"Stream sweeper callback failed: {e}")
+
+    def get(self, stream_id: str) -> ResumableStream | None:
+        self._evict()
+        with self._lock:
+            return self._streams.get(stream_id)
+
+    def count_resume(self) -> None:
+        with self._lock:
+            self._counters["resumed"] += 1
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            return {
+                **self._counters,
+                "streams": len(self._streams),
+                "active": sum(1 for s in self._streams.values() if not s.done),
+                "buffered_bytes": sum(s.nbytes for s in self._streams.values()),
+            }
+
+
+def parse_event_id(value: str | None) -> tuple[str, int] | None:
+    """解析形如 "<stream_id>:<事件号>" 的 Last-Event-ID。"""
+    if not value or ":" not in value:
+        return None
+    stream_id, _, seq = value.strip().rpartition(":")
+    if not stream_id or not seq.isdigit():
+        return None
+    return stream_id, int(seq)
+
+
+stream_registry = StreamRegistry(
+    ttl_seconds=config.sse_resume_ttl_seconds,
+    max_total_bytes=config.sse_resume_max_total_bytes,
+    stream_max_bytes=config.sse_resume_stream_max_bytes,
+    disconnect_grace_seconds=config.sse_disconnect_grace_seconds,
+)
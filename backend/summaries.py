@@ -0,0 +1,166 @@
+from __future__ import annotations
+
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+from typing import Callable
+
+from sqlalchemy import delete, select
+from sqlalchemy.orm import Session
+
+from .config import load_config
+from .database import SessionLocal
+from .models import ArcSummary, Chapter, ChapterSummary
+from .novel_ai import AIRequest, ai_service
+from .revisions import novel_revisions
+from .utils.hashing import content_hash
+
+
+config = load_config()
+
+
+class SummaryService:
+    """后台维护章节概要与分卷概要，只在章节内容哈希变化时重新生成。"""
+
+    def __init__(self, arc_size: int, max_workers: int) -> None:
+        self._arc_size = max(1, arc_size)
+        self._executor = ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="summary")
+        self._lock = Lock()
+        self._pending: set[int] = set()
+        self._refreshed: dict[int, int] = {}
+
+    def ensure_fresh(self, novel_id: int) -> None:
+        """小说修订号变化后在后台刷新概要；同一小说同时只排队一次。"""
+        revision = novel_revisions.get(novel_id)
+        with self._lock:
+            if novel_id in self._pending or self._refreshed.get(novel_id) == revision:
+                return
+            self._pending.add(novel_id)
+        self._executor.submit(self._refresh, novel_id, revision)
+
+    def _refresh(self, novel_id: int, revision: int) -> None:
+        requeue = False
+        try:
+            if self.refresh_novel(novel_id):
+                # 新概要需要让上下文缓存失效；没有其他写入时记录自己产生的修订号，避免再次排队
+                bumped = novel_revisions.bump_if(novel_id, revision)
+                if bumped is not None:
+                    revision = bumped
+                else:
+                    # 刷新期间小说又被修改，这次的结果可能已过时：仍使缓存失效，并重新排队
+                    novel_revisions.bump(novel_id)
+                    requeue = True
+        except Exception as e:
+            print(f"Failed to refresh summaries for novel {novel_id}: {e}")
+        finally:
+            with self._lock:
+                self._refreshed[novel_id] = revision
+                self._pending.discard(novel_id)
+        if requeue:
+            self.ensure_fresh(novel_id)
+
+    def _summarized_chapter_ids(self, db: Session, novel_id: int) -> list[int]:
+        chapter_ids = db.scalars(
+            select(Chapter.id).where(Chapter.novel_id == novel_id).order_by(Chapter.order_index.asc())
+        ).all()
+        # 最新一章通常仍在编辑，且已经包含在前文里，不做概要
+        return list(chapter_ids[:-1])
+
+    def _summarize(self, mode: str, text: str) -> str:
+        request = AIRequest(mode=mode, context={"target_text": text}, stream=False, priority="background")
+        return ai_service.generate(request).strip()
+
+    def refresh_novel(self, novel_id: int, on_progress: Callable[[int, int], None] | None = None) -> bool:
+        """同步刷新一部小说的概要，返回是否有概要被重新生成。
+        每处理完一章或一卷回调 on_progress(已处理数, 总数)。"""
+        changed = False
+        with SessionLocal() as db:
+            chapter_ids = self._summarized_chapter_ids(db, novel_id)
+            total = len(chapter_ids) + len(chapter_ids) // self._arc_size
+            done = 0
+            records = {
+                s.chapter_id: s
+                for s in db.scalars(
+                    select(ChapterSummary).join(Chapter).where(Chapter.novel_id == novel_id)
+                )
+            }
+            hashes: list[str] = []
+            for chapter_id in chapter_ids:
+                if on_progress is not None:
+                    on_progress(done, total)
+                done += 1
+                content = db.scalar(select(Chapter.content).where(Chapter.id == chapter_id)) or ""
+                digest = content_hash(content)
+                hashes.append(digest)
+                record = records.get(chapter_id)
+                if record is not None and record.content_hash == digest:
+                    continue
+                summary = self._summarize("chapter_summary", content) if content.strip() else ""
+                if record is None:
+                    record = ChapterSummary(chapter_id=chapter_id)
+                    records[chapter_id] = record
+                record.content_hash = digest
+                record.summary = summary
+                db.add(record)
+                db.commit()
+                changed = True
+
+            arc_count = len(chapter_ids) // self._arc_size
+            arcs = {a.arc_index: a for a in db.scalars(select(ArcSummary).where(ArcSummary.novel_id == novel_id))}
+            for arc_index in range(arc_count):
+                if on_progress is not None:
+                    on_progress(done, total)
+                done += 1
+                start = arc_index * self._arc_size
+                end = start + self._arc_size
+                source_hash = content_hash("".join(hashes[start:end]))
+                arc = arcs.get(arc_index)
+                if arc is not None and arc.source_hash == source_hash:
+                    continue
+                text = "\n".join(records[cid].summary for cid in chapter_ids[start:end] if records[cid].summary)
+                if arc is None:
+                    arc = ArcSummary(novel_id=novel_id, arc_index=arc_index)
+                arc.source_hash = source_hash
+                arc.summary = self._summarize("arc_summary", text) if text else ""
+                db.add(arc)
+                db.commit()
+                changed = True
+
+            stale = db.execute(
+                delete(ArcSummary).where(ArcSummary.novel_id == novel_id, ArcSummary.arc_index >= arc_count)
+            )
+            db.commit()
+            changed = changed or stale.rowcount > 0
+        if on_progress is not None:
+            on_progress(total, total)
+        return changed
+
+    def story_so_far(self, db: Session, novel_id: int) -> str:
+        """按分卷概要 + 其后各章概要拼出“前情提要”；缺失的分卷概要用章节概要代替。"""
+        chapter_ids = self._summarized_chapter_ids(db, novel_id)
+        if not chapter_ids:
+            return ""
+        chapter_summaries = dict(
+            db.execute(
+                select(ChapterSummary.chapter_id, ChapterSummary.summary)
+                .join(Chapter)
+                .where(Chapter.novel_id == novel_id)
+            ).all()
+        )
+        arc_summaries = dict(
+            db.execute(
+                select(ArcSummary.arc_index, ArcSummary.summary).where(ArcSummary.novel_id == novel_id)
+            ).all()
+        )
+        parts: list[str] = []
+        arc_count = len(chapter_ids) // self._arc_size
+        for arc_index in range(arc_count):
+            if arc_summaries.get(arc_index):
+                parts.append(arc_summaries[arc_index])
+                continue
+            start = arc_index * self._arc_size
+            parts.extend(chapter_summaries.get(cid, "") for cid in chapter_ids[start:start + self._arc_size])
+        parts.extend(chapter_summaries.get(cid, "") for cid in chapter_ids[arc_count * self._arc_size:])
+        return "\n".join(p for p in parts if p)
+
+
+summary_service = SummaryService(arc_size=config.summary_arc_size, max_workers=config.summary_workers)
@@ -0,0 +1,5 @@
+import hashlib
+
+
+def content_hash(text: str | None) -> str:
+    return hashlib.sha256((text or "").encode("utf-8")).hexdigest()
@@ -17,7 +17,8 @@ class InMemoryFixedWindowLimiter:
         self._lock = Lock()
         self._buckets: dict[str, tuple[int, int]] = {}
 
-    def check(self, key: str) -> RateLimitResult:
+    def check(self, key: str, cost: int = 1) -> RateLimitResult:
+        """cost 为本次计入的请求数，剩余额度不足时整体拒绝。"""
         now = int(time.time())
         window_start = now - (now % self._window_seconds)
 
@@ -25,11 +26,11 @@ class InMemoryFixedWindowLimiter:
             count, start = self._buckets.get(key, (0, window_start))
             if start != window_start:
                 count, start = 0, window_start
-            if count >= self._limit:
+            if count + cost > self._limit:
                 reset_in = (start + self._window_seconds) - now
                 return RateLimitResult(False, 0, max(reset_in, 0))
 
-            count += 1
+            count += cost
             self._buckets[key] = (count, start)
             remaining = max(self._limit - count, 0)
             reset_in = (start + self._window_seconds) - now
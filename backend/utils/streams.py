@@ -0,0 +1,378 @@
+import asyncio
+import queue
+from threading import Condition, Event, Lock, Semaphore, Thread
+from typing import AsyncIterable, AsyncIterator, Callable, Iterable, Iterator
+
+
+class CancelToken:
+    """协作式取消标记：取消时依次执行已注册的回调（如关闭上游连接）。"""
+
+    def __init__(self) -> None:
+        self._lock = Lock()
+        self._cancelled = False
+        self._callbacks: dict[int, Callable[[], None]] = {}
+        self._next_handle = 0
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled
+
+    def on_cancel(self, callback: Callable[[], None]) -> Callable[[], None]:
+        """注册回调并返回注销函数；已取消时立即执行回调。"""
+        with self._lock:
+            if not self._cancelled:
+                handle = self._next_handle
+                self._next_handle += 1
+                self._callbacks[handle] = callback
+                return lambda: self._remove(handle)
+        callback()
+        return lambda: None
+
+    def _remove(self, handle: int) -> None:
+        with self._lock:
+            self._callbacks.pop(handle, None)
+
+    def cancel(self) -> None:
+        with self._lock:
+            if self._cancelled:
+                return
+            self._cancelled = True
+            callbacks = list(self._callbacks.values())
+            self._callbacks.clear()
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                print(f"Cancel callback failed: {e}")
+
+
+class BroadcastStream:
+    """把一个上游文本流广播给多个订阅者；后加入的订阅者先回放已收到的块，再跟随实时输出。"""
+
+    def __init__(self) -> None:
+        self._cond = Condition()
+        self._chunks: list[str] = []
+        self._done = False
+        self._error: BaseException | None = None
+
+    def publish(self, chunk: str) -> None:
+        with self._cond:
+            self._chunks.append(chunk)
+            self._cond.notify_all()
+
+    def finish(self, error: BaseException | None = None) -> None:
+        with self._cond:
+            self._done = True
+            self._error = error
+            self._cond.notify_all()
+
+    def pump(self, source: Iterable[str]) -> None:
+        try:
+            for chunk in source:
+                self.publish(chunk)
+        except Exception as e:
+            self.finish(e)
+        else:
+            self.finish()
+
+    @property
+    def done(self) -> bool:
+        return self._done
+
+    def _wake(self) -> None:
+        with self._cond:
+            self._cond.notify_all()
+
+    def subscribe(self, cancel: CancelToken | None = None) -> Iterator[str]:
+        """cancel 触发后该订阅方立即结束，不影响上游和其他订阅方。"""
+        unregister = cancel.on_cancel(self._wake) if cancel is not None else None
+        try:
+            yield from self._read_from(cancel)
+        finally:
+            if unregister is not None:
+                unregister()
+
+    def _read_from(self, cancel: CancelToken | None) -> Iterator[str]:
+        index = 0
+        while True:
+            with self._cond:
+                while index >= len(self._chunks) and not self._done:
+                    if cancel is not None and cancel.cancelled:
+                        return
+                    self._cond.wait()
+                pending = self._chunks[index:]
+                index += len(pending)
+                finished = self._done and index >= len(self._chunks)
+                error = self._error
+            yield from pending
+            if finished:
+                if error is not None:
+                    raise error
+                return
+
+
+class _Flight:
+    def __init__(self) -> None:
+        self.shared = BroadcastStream()
+        self.upstream = CancelToken()
+        self.subscribers = 0
+
+
+class SingleFlight:
+    """相同 key 的并发调用只触发一次上游请求，所有调用方共享同一个 BroadcastStream。
+    所有订阅方都提前离开时取消上游请求。"""
+
+    def __init__(self) -> None:
+        self._lock = Lock()
+        self._inflight: dict[str, _Flight] = {}
+        self._counters = {"leaders": 0, "joined": 0, "cancelled": 0}
+
+    def stream(
+        self,
+        key: str,
+        factory: Callable[[CancelToken], Iterable[str]],
+        cancel: CancelToken | None = None,
+    ) -> Iterator[str]:
+        """factory 接收上游共用的 CancelToken；cancel 只代表当前调用方。"""
+        with self._lock:
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = _Flight()
+                self._inflight[key] = flight
+            flight.subscribers += 1
+            self._counters["leaders" if leader else "joined"] += 1
+        if leader:
+            Thread(target=self._run, args=(key, flight, factory), daemon=True).start()
+        return self._subscribe(key, flight, cancel)
+
+    def _subscribe(self, key: str, flight: _Flight, cancel: CancelToken | None) -> Iterator[str]:
+        try:
+            yield from flight.shared.subscribe(cancel)
+        finally:
+            self._leave(key, flight)
+
+    def _leave(self, key: str, flight: _Flight) -> None:
+        with self._lock:
+            flight.subscribers -= 1
+            abandoned = flight.subscribers == 0 and not flight.shared.done
+            if abandoned:
+                # 已无人读取：取消上游，并且不再让新的调用方加入这个被截断的流
+                self._counters["cancelled"] += 1
+                if self._inflight.get(key) is flight:
+                    del self._inflight[key]
+        if abandoned:
+            flight.upstream.cancel()
+
+    def _run(self, key: str, flight: _Flight, factory: Callable[[CancelToken], Iterable[str]]) -> None:
+        try:
+            flight.shared.pump(factory(flight.upstream))
+        except Exception as e:
+            flight.shared.finish(e)
+        finally:
+            with self._lock:
+                if self._inflight.get(key) is flight:
+                    del self._inflight[key]
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            return {**self._counters, "inflight": len(self._inflight)}
+
+
+class _AsyncFlight:
+    def __init__(self) -> None:
+        self.changed = asyncio.Condition()
+        self.chunks: list[str] = []
+        self.done = False
+        self.error: BaseException | None = None
+        self.subscribers = 0
+        self.task: asyncio.Task | None = None
+
+
+class AsyncSingleFlight:
+    """SingleFlight 的异步版本：同一事件循环中相同 key 的调用共享一个上游任务；
+    所有订阅方都提前离开时取消该任务（httpx 随之关闭上游连接）。"""
+
+    def __init__(self) -> None:
+        self._inflight: dict[str, _AsyncFlight] = {}
+        self._counters = {"leaders": 0, "joined": 0, "cancelled": 0}
+
+    async def stream(self, key: str, factory: Callable[[], AsyncIterable[str]]) -> AsyncIterator[str]:
+        flight = self._inflight.get(key)
+        leader = flight is None
+        if leader:
+            flight = _AsyncFlight()
+            self._inflight[key] = flight
+            flight.task = asyncio.create_task(self._run(key, flight, factory))
+        flight.subscribers += 1
+        self._counters["leaders" if leader else "joined"] += 1
+        try:
+            index = 0
+            while True:
+                async with flight.changed:
+                    await flight.changed.wait_for(lambda: index < len(flight.chunks) or flight.done)
+                    pending = flight.chunks[index:]
+                    index += len(pending)
+                    finished = flight.done and index >= len(flight.chunks)
+                for chunk in pending:
+                    yield chunk
+                if finished:
+                    if flight.error is not None:
+                        raise flight.error
+                    return
+        finally:
+            flight.subscribers -= 1
+            if flight.subscribers == 0 and not flight.done:
+                # 已无人读取：取消上游，并且不再让新的调用方加入这个被截断的流
+                self._counters["cancelled"] += 1
+                if self._inflight.get(key) is flight:
+                    del self._inflight[key]
+                flight.task.cancel()
+
+    async def _run(self, key: str, flight: _AsyncFlight, factory: Callable[[], AsyncIterable[str]]) -> None:
+        error: BaseException | None = None
+        try:
+            async for chunk in factory():
+                async with flight.changed:
+                    flight.chunks.append(chunk)
+                    flight.changed.notify_all()
+        except asyncio.CancelledError:
+            error = asyncio.CancelledError()
+        except Exception as e:
+            error = e
+        finally:
+            if self._inflight.get(key) is flight:
+                del self._inflight[key]
+            flight.error = error
+            flight.done = True
+            async with flight.changed:
+                flight.changed.notify_all()
+
+    def stats(self) -> dict[str, int]:
+        return {**self._counters, "inflight": len(self._inflight)}
+
+
+_CHUNK, _END, _ERROR = "chunk", "end", "error"
+
+
+def _pump_into(source: Iterable[str], events: queue.Queue, stopped: Event) -> None:
+    iterator = iter(source)
+    try:
+        for chunk in iterator:
+            if stopped.is_set():
+                break
+            events.put((_CHUNK, chunk))
+        events.put((_END, None))
+    except Exception as e:
+        events.put((_ERROR, e))
+    finally:
+        close = getattr(iterator, "close", None)
+        if close is not None:
+            close()
+
+
+def merge_streams(
+    factories: list[Callable[[CancelToken], Iterable]],
+    lanes: list[str],
+    limits: dict[str, int],
+    cancel: CancelToken | None = None,
+) -> Iterator:
+    """并发执行多个流，按到达顺序合并输出。同一 lane 同时执行的流不超过 limits[lane]（缺省或 0 为不限），
+    其余的流等前面的结束后再开始。某个流出错、调用方提前结束或 cancel 触发时停止所有流。"""
+    events: queue.Queue = queue.Queue()
+    stopped = CancelToken()
+    halted = Event()
+    stopped.on_cancel(halted.set)
+    unlink = cancel.on_cancel(stopped.cancel) if cancel is not None else None
+    slots = {lane: Semaphore(limits[lane]) for lane in set(lanes) if limits.get(lane, 0) > 0}
+
+    def run(index: int) -> None:
+        lane_slots = slots.get(lanes[index])
+        if lane_slots is not None:
+            while not lane_slots.acquire(timeout=0.2):
+                if halted.is_set():
+                    events.put((_END, None))
+                    return
+        try:
+            if halted.is_set():
+                events.put((_END, None))
+            else:
+                _pump_into(factories[index](stopped), events, halted)
+        except Exception as e:
+            events.put((_ERROR, e))
+        finally:
+            if lane_slots is not None:
+                lane_slots.release()
+
+    for index in range(len(factories)):
+        Thread(target=run, args=(index,), name="merge-worker", daemon=True).start()
+    remaining = len(factories)
+    try:
+        while remaining:
+            kind, value = events.get()
+            if kind == _CHUNK:
+                yield value
+            elif kind == _END:
+                remaining -= 1
+            else:
+                raise value
+    finally:
+        stopped.cancel()
+        if unlink is not None:
+            unlink()
+
+
+async def acoalesce_chunks(chunks: AsyncIterable[str], max_latency: float, max_bytes: int) -> AsyncIterator[str]:
+    """合并相邻的小文本块：缓冲超过 max_latency 秒或 max_bytes 字节时输出一次。
+    首个文本块和结束时的剩余内容立即输出；max_latency <= 0 时不合并。"""
+    iterator = chunks.__aiter__()
+    if max_latency <= 0:
+        async for chunk in iterator:
+            yield chunk
+        return
+    loop = asyncio.get_running_loop()
+    pending: asyncio.Future | None = None
+    buffer: list[str] = []
+    size = 0
+    deadline = 0.0
+    first = True
+    try:
+        while True:
+            if pending is None:
+                pending = asyncio.ensure_future(iterator.__anext__())
+            timeout = max(0.0, deadline - loop.time()) if buffer else None
+            # 超时只输出缓冲内容，不取消正在等待的上游读取
+            done, _ = await asyncio.wait({pending}, timeout=timeout)
+            if not done:
+                yield "".join(buffer)
+                buffer, size = [], 0
+                continue
+            task, pending = pending, None
+            try:
+                value = task.result()
+            except StopAsyncIteration:
+                if buffer:
+                    yield "".join(buffer)
+                return
+            except Exception:
+                if buffer:
+                    yield "".join(buffer)
+                raise
+            if first:
+                first = False
+                yield value
+                continue
+            if not buffer:
+                deadline = loop.time() + max_latency
+            buffer.append(value)
+            size += len(value.encode("utf-8"))
+            if size >= max_bytes:
+                yield "".join(buffer)
+                buffer, size = [], 0
+    finally:
+        if pending is not None:
+            pending.cancel()
+            await asyncio.gather(pending, return_exceptions=True)
+        aclose = getattr(iterator, "aclose", None)
+        if aclose is not None:
+            await aclose()